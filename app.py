@@ -1,14 +1,15 @@
-import os, stripe, hashlib, hmac, time, httpx, functools, mimetypes, shutil
+import os, stripe, hashlib, hmac, time, mimetypes, shutil
 import traceback
 from io import BytesIO
 from collections import Counter
-import re, json, base64, logging, requests, io, tempfile, uuid
+import re, json, base64, logging, io, tempfile, uuid, threading
 from functools import wraps
 from auth_utils import api_login_required, is_staff, is_superadmin, require_superadmin
 
 from flask import (
     Blueprint, Flask, request, jsonify, render_template, redirect, session,
-    flash, url_for, send_file, current_app, Response, make_response, g, abort
+    flash, url_for, send_file, current_app, Response, make_response, g, abort,
+    has_request_context, stream_with_context
 )
 from flask_cors import CORS
 from flask_login import (
@@ -22,15 +23,31 @@ from dotenv import load_dotenv
 from supabase_auth.errors import AuthApiError
 from typing import Tuple, List, Optional
 from decimal import Decimal, ROUND_HALF_UP
+from concurrent.futures import ThreadPoolExecutor, wait
 from security import verify_turnstile
 
 # Local modules
-from extensions import login_manager, init_supabase, init_openai
+from extensions import login_manager, init_supabase, init_openai, init_auth_client
+import http_pool
+import ocr_pool
+import extract_cache
+import doc_extract
+import chat_context
+from ocr_pool import OcrBusy
+from doc_extract import ExtractionRejected
+from ttl_cache import cache_for, cache_stats
+from job_snapshot import JobSnapshotStore
+from conversation_cache import conversation_cache
+from chat_writer import chat_writer
+from conversation_summary import conversation_summaries
+from response_cache import response_cache
 from typing import Optional
 from datetime import datetime, timedelta, timezone, date
 from auth_utils import require_superadmin, is_staff, is_superadmin, api_login_required
 from limits import (
     check_and_increment,
+    check_and_increment_many,
+    counter_backend,
     get_usage_count,
     job_insights_level,
     feature_enabled,
@@ -40,6 +57,8 @@ from limits import (
 from itsdangerous import URLSafeSerializer, BadSignature
 from supabase import create_client
 from abuse_guard import allow_free_use
+import session_cache
+from session_cache import invalidate_user
 from urllib.parse import quote, urlencode, urlparse
 from werkzeug.utils import secure_filename
 
@@ -52,7 +71,7 @@ try:
 except Exception:
     _babel_mofile = None
     _babel_pofile = None
-from PIL import Image, ImageOps, ImageFilter
+from PIL import Image, ImageOps
 
 # Optional HEIF/HEIC support (won't crash deploys if package isn't installed)
 try:
@@ -62,15 +81,6 @@ try:
 except Exception:
     HEIF_ENABLED = False
 
-import pytesseract
-
-try:
-    from pytesseract import TesseractNotFoundError as _TesseractNotFoundError
-except Exception:  # pragma: no cover - pytesseract always exports this, but be safe
-    class _TesseractNotFoundError(RuntimeError):
-        """Fallback error so we can detect missing Tesseract binaries."""
-        pass
-
 api_bp = Blueprint("api", __name__, url_prefix="/api")
 resumes_bp = None  # will set when found
 
@@ -628,27 +638,9 @@ def enforce_role_bounds(role: Optional[str], value: int) -> int:
         value = min(value, ub)
     return value
 
-# -------- lightweight cache decorator (in-memory) --------
-_cache = {}
-def cache_for(seconds: int):
-    def deco(fn):
-        @functools.wraps(fn)
-            # pyright: reportGeneralTypeIssues=false
-        def wrapped(*a, **kw):
-            key = (fn.__name__, tuple(sorted(kw.items())))
-            now = time.time()
-            if key in _cache:
-                val, exp = _cache[key]
-                if now < exp:
-                    return val
-            val = fn(*a, **kw)
-            _cache[key] = (val, now + seconds)
-            return val
-        return wrapped
-    return deco
-
 # -------- Optional: external salary estimate (Adzuna UK example) --------
-@cache_for(3600)
+# bounded LRU + TTL, shared across workers when REDIS_URL is set (ttl_cache.py)
+@cache_for(3600, maxsize=1024, stale=600, shared=True)
 def fetch_salary_external(role: str, location: str) -> Optional[int]:
     """
     Fetch a robust estimate from an external feed (Adzuna example).
@@ -674,10 +666,9 @@ def fetch_salary_external(role: str, location: str) -> Optional[int]:
         "content-type": "application/json",
     }
     try:
-        with httpx.Client(timeout=8) as client:
-            r = client.get(base_url, params=params)
-            r.raise_for_status()
-            data = r.json() or {}
+        r = http_pool.get(base_url, params=params, timeout=8)
+        r.raise_for_status()
+        data = r.json() or {}
 
         items = data.get("results") or []
         vals: List[float] = []
@@ -798,34 +789,100 @@ def compute_locations(role: Optional[str], location: Optional[str]):
     counts = [int(c * _deterministic_bump(f"loc:{name}:{_norm(role)}", 0.10)) for name, c in base]
     return labels, counts
 
+# -------- Snapshot store (pre-aggregated Adzuna data, see job_snapshot.py) --------
+job_snapshot = JobSnapshotStore()
+MIN_SALARY_SAMPLES = 5
+
+def _ensure_snapshot_ingestion():
+    if ADZUNA_APP_ID and ADZUNA_APP_KEY:
+        job_snapshot.start({
+            "titles": JOB_TITLES, "keywords": KEYWORDS,
+            "app_id": ADZUNA_APP_ID, "app_key": ADZUNA_APP_KEY, "api_url": ADZUNA_API_URL,
+        })
+
+def snapshot_salary(role, location):
+    if role and location:
+        cell = job_snapshot.lookup(role, location)
+        if cell and cell["n"] >= MIN_SALARY_SAMPLES:
+            return [f"{role} – {location}"], [enforce_role_bounds(role, cell["p50"])]
+        return None
+    if role:
+        cell = job_snapshot.lookup(role, "")
+        if not cell or cell["n"] < MIN_SALARY_SAMPLES:
+            return None
+        # interquartile spread stands in for seniority
+        return ([f"{role} – {lvl}" for lvl, _m in LEVELS],
+                [enforce_role_bounds(role, cell[q]) for q in ("p25", "p50", "p75")])
+    cells = [job_snapshot.lookup(t, location) for t in JOB_TITLES]
+    if not all(c and c["n"] >= MIN_SALARY_SAMPLES for c in cells):
+        return None
+    return JOB_TITLES, [enforce_role_bounds(t, c["p50"]) for t, c in zip(JOB_TITLES, cells)]
+
+def snapshot_job_counts(role, location):
+    if role:
+        cell = job_snapshot.lookup(role, location)
+        if not cell:
+            return None
+        total = cell["count"]
+        return ([f"{role} – Entry", f"{role} – Mid", f"{role} – Senior"],
+                [int(total * 0.35), int(total * 0.45), int(total * 0.20)])
+    cells = [job_snapshot.lookup(t, location) for t in JOB_TITLES]
+    if not all(cells):
+        return None
+    return JOB_TITLES, [c["count"] for c in cells]
+
+def snapshot_skills(role, location):
+    cell = job_snapshot.lookup(role, location)
+    if not cell:
+        return None
+    return KEYWORDS, [cell["skills"].get(k, 0) for k in KEYWORDS]
+
+def snapshot_locations(role, location):
+    cell = job_snapshot.lookup(role, "")
+    if not cell or not cell["locations"]:
+        return None
+    return [name for name, _c in cell["locations"]], [c for _name, c in cell["locations"]]
+
+def _insights_response(kind: str, value_key: str, snapshot_fn, compute_fn):
+    """
+    Serve from the snapshot when it covers (role, location), else compute.
+    Snapshot answers carry a version-based ETag so repeat chart loads are 304s.
+    """
+    _ensure_snapshot_ingestion()
+    role = request.args.get("role", "")
+    location = request.args.get("location", "")
+    try:
+        hit = snapshot_fn(role, location)
+    except Exception:
+        current_app.logger.warning("snapshot lookup failed for %s", kind, exc_info=True)
+        hit = None
+    labels, values = hit if hit else compute_fn(role, location)
+
+    resp = jsonify({"labels": labels, value_key: values})
+    if hit:
+        etag = hashlib.sha1(f"{job_snapshot.version}|{kind}|{_norm(role)}|{_norm(location)}".encode()).hexdigest()
+        resp.set_etag(etag)
+        resp.headers["X-Snapshot-Version"] = str(job_snapshot.version)
+        resp.headers["Cache-Control"] = "private, max-age=300"
+        return resp.make_conditional(request)
+    return resp, 200
+
 # ---------------- Routes ----------------
 @DECORATOR
 def _salary_view():
-    role = request.args.get("role", "")
-    location = request.args.get("location", "")
-    labels, salaries = compute_salary(role, location)
-    return jsonify({"labels": labels, "salaries": salaries}), 200
+    return _insights_response("salary", "salaries", snapshot_salary, compute_salary)
 
 @DECORATOR
 def _job_count_view():
-    role = request.args.get("role", "")
-    location = request.args.get("location", "")
-    labels, counts = compute_job_counts(role, location)
-    return jsonify({"labels": labels, "counts": counts}), 200
+    return _insights_response("job-count", "counts", snapshot_job_counts, compute_job_counts)
 
 @DECORATOR
 def _skills_view():
-    role = request.args.get("role", "")
-    location = request.args.get("location", "")
-    labels, frequency = compute_skills(role, location)
-    return jsonify({"labels": labels, "frequency": frequency}), 200
+    return _insights_response("skills", "frequency", snapshot_skills, compute_skills)
 
 @DECORATOR
 def _locations_view():
-    role = request.args.get("role", "")
-    location = request.args.get("location", "")
-    labels, counts = compute_locations(role, location)
-    return jsonify({"labels": labels, "counts": counts}), 200
+    return _insights_response("locations", "counts", snapshot_locations, compute_locations)
 
 # Attach endpoints (avoid decorator stacking issues)
 app.add_url_rule("/api/salary",     view_func=_salary_view,     methods=["GET"])
@@ -881,10 +938,11 @@ def send_tx_email(to: str, subject: str, html: str, cc_admin: bool=False):
     if cc_admin and ADMIN_EMAILS:
         payload["bcc"] = list(ADMIN_EMAILS)
     try:
-        r = requests.post(
+        r = http_pool.post(
             "https://api.resend.com/emails",
             json=payload,
-            headers={"Authorization": f"Bearer {RESEND_API_KEY}"}
+            headers={"Authorization": f"Bearer {RESEND_API_KEY}"},
+            timeout=DEFAULT_HTTP_TIMEOUT,
         )
         if r.status_code >= 300:
             current_app.logger.error("send_tx_email failed: %s %s", r.status_code, r.text)
@@ -1028,12 +1086,103 @@ def send_failed_email(
         send_tx_email(admin_to, "ALERT: Jobcus subscription payment failed", admin_html)
 
 # --- OCR helpers ---
+# OpenAI vision is the fallback when Tesseract gets nothing out of an image, and
+# the expensive path: it is bounded per worker (OPENAI_OCR_CONCURRENCY calls at
+# once, waiting at most OPENAI_OCR_WAIT s for a slot) and per user
+# ("ocr_vision_day" in limits.py), and results are cached by image hash.
+# The API bills on its own resized copy (fit in 2048², short side 768 for
+# detail=high), so we send exactly that, as grayscale JPEG, instead of the
+# original 12 MP photo.
+OPENAI_OCR_SHORT_EDGE = int(os.getenv("OPENAI_OCR_SHORT_EDGE", "768"))
+OPENAI_OCR_LONG_EDGE = int(os.getenv("OPENAI_OCR_LONG_EDGE", "2048"))
+OPENAI_OCR_CONCURRENCY = int(os.getenv("OPENAI_OCR_CONCURRENCY", "4"))
+OPENAI_OCR_WAIT = float(os.getenv("OPENAI_OCR_WAIT", "10"))
+
+_vision_sem = threading.BoundedSemaphore(OPENAI_OCR_CONCURRENCY)
+_vision_lock = threading.Lock()
+_vision_stats = {"calls": 0, "cache_hits": 0, "busy": 0, "over_budget": 0, "errors": 0,
+                 "prompt_tokens": 0, "completion_tokens": 0, "total_ms": 0.0, "bytes_sent": 0}
+
+class VisionOcrQuota(OcrBusy):
+    """The user's daily vision OCR budget is spent; retry after midnight UTC."""
+    status = 429
+    error = "ocr_quota_exceeded"
+
+    def __init__(self):
+        now = datetime.now(timezone.utc)
+        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        super().__init__("You've reached today's limit for reading scanned images. "
+                         "Try a text-based PDF or DOCX, or come back tomorrow.",
+                         retry_after=int((tomorrow - now).total_seconds()) + 1)
+
+def _vision_bump(**kw):
+    with _vision_lock:
+        for k, v in kw.items():
+            _vision_stats[k] += v
+
+def _vision_stats_snapshot() -> dict:
+    with _vision_lock:
+        s = dict(_vision_stats)
+    s["avg_ms"] = round(s["total_ms"] / s["calls"], 1) if s["calls"] else 0.0
+    s.update(concurrency=OPENAI_OCR_CONCURRENCY, short_edge=OPENAI_OCR_SHORT_EDGE)
+    return s
+
+def _vision_image_bytes(path: str) -> bytes:
+    """The image as the API will see it: upright, grayscale, resized the way detail=high does, JPEG."""
+    with Image.open(path) as raw:
+        img = ImageOps.exif_transpose(raw).convert("L")
+    w, h = img.size
+    scale = min(1.0, OPENAI_OCR_LONG_EDGE / max(w, h), OPENAI_OCR_SHORT_EDGE / max(1, min(w, h)))
+    if scale < 1.0:
+        img = img.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS)
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=85, optimize=True)
+    return buf.getvalue()
+
+def _charge_vision_ocr():
+    """Count one vision OCR call against the user's daily budget; raises VisionOcrQuota when spent."""
+    try:
+        if not (has_request_context() and current_user.is_authenticated):
+            return   # internal callers (scripts, jobs) aren't metered
+        plan = (getattr(current_user, "plan", "free") or "free").lower()
+        ok, _info = check_and_increment(supabase_admin, current_user.id, plan, "ocr_vision_day")
+    except Exception:
+        current_app.logger.warning("vision OCR: quota check failed; allowing", exc_info=True)
+        return
+    if not ok:
+        _vision_bump(over_budget=1)
+        raise VisionOcrQuota()
+
 def _ocr_via_openai(path: str) -> str:
-    """Fallback OCR using the configured OpenAI client."""
+    """
+    Fallback OCR using the configured OpenAI client, cached by image hash.
+    Raises OcrBusy when this worker already has OPENAI_OCR_CONCURRENCY calls
+    in flight, VisionOcrQuota when the user's daily budget is spent.
+    """
     client = current_app.config.get("OPENAI_CLIENT")
     if client is None:
         return ""
 
+    digest = extract_cache.digest_file(path)
+    hit = extract_cache.get(digest, "openai-vision")
+    if hit is not None:
+        _vision_bump(cache_hits=1)
+        return hit["text"]
+
+    if not _vision_sem.acquire(timeout=OPENAI_OCR_WAIT):
+        _vision_bump(busy=1)
+        raise OcrBusy()
+    try:
+        _charge_vision_ocr()   # only once we're actually going to make the call
+        text, model = _ocr_via_openai_uncached(client, path)
+    finally:
+        _vision_sem.release()
+    extract_cache.put(digest, "openai-vision", text, model, 1)
+    return text
+
+def _ocr_via_openai_uncached(client, path: str):
+    """(text, model) from one vision call; ("", model) on failure."""
+
     def _extract_text_from_choice(choice) -> str:
         if not choice:
             return ""
@@ -1068,18 +1217,14 @@ def _ocr_via_openai(path: str) -> str:
 
         return "\n".join(p for p in parts if p).strip()
 
+    model = os.getenv("OCR_MODEL", os.getenv("OPENAI_OCR_MODEL", "gpt-4o-mini"))
+    t0 = time.monotonic()
     try:
-        with Image.open(path) as raw:
-            fmt = (raw.format or "PNG").upper()
-        with open(path, "rb") as fh:
-            data = fh.read()
+        data = _vision_image_bytes(path)
         if not data:
-            return ""
+            return "", model
 
-        mime = Image.MIME.get(fmt) or "image/png"
         b64 = base64.b64encode(data).decode("utf-8")
-
-        model = os.getenv("OCR_MODEL", os.getenv("OPENAI_OCR_MODEL", "gpt-4o-mini"))
         resp = client.chat.completions.create(
             model=model,
             temperature=0,
@@ -1097,40 +1242,37 @@ def _ocr_via_openai(path: str) -> str:
                         },
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:{mime};base64,{b64}"},
+                            "image_url": {"url": f"data:image/jpeg;base64,{b64}", "detail": "high"},
                         },
                     ],
                 },
             ],
         )
         choice = resp.choices[0] if resp and resp.choices else None
-        return _extract_text_from_choice(choice)
+        text = _extract_text_from_choice(choice)
+        usage = getattr(resp, "usage", None)
+        ms = (time.monotonic() - t0) * 1000
+        _vision_bump(calls=1, total_ms=ms, bytes_sent=len(data),
+                     prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                     completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+        current_app.logger.info("vision OCR: %.0f ms, %d bytes, %s prompt / %s completion tokens",
+                                ms, len(data), getattr(usage, "prompt_tokens", "?"),
+                                getattr(usage, "completion_tokens", "?"))
+        return text, model
     except Exception:
+        _vision_bump(errors=1, total_ms=(time.monotonic() - t0) * 1000)
         current_app.logger.warning("OpenAI OCR fallback failed", exc_info=True)
-        return ""
+        return "", model
 
-def _img_to_text_file(path: str) -> str:
-    """
-    Open image from disk, do light preprocessing, run Tesseract.
-    Works for PNG/JPG/WEBP/HEIC (if pillow-heif is registered).
-    Falls back to OpenAI vision OCR if Tesseract is unavailable.
-    """
+def _ocr_owner():
+    """Whose OCR job this is, for the per-user limit in ocr_pool (None outside a login)."""
     try:
-        img = Image.open(path)
-        img = ImageOps.exif_transpose(img)   # respect camera rotation
-        img = img.convert("L")               # grayscale
-        img = ImageOps.autocontrast(img)
-        img = img.filter(ImageFilter.MedianFilter(size=3))  # light denoise
-        text = (pytesseract.image_to_string(img) or "").strip()
-        if text:
-            return text
-    except _TesseractNotFoundError:
-        current_app.logger.info("Tesseract binary not found; using OpenAI OCR fallback")
+        if has_request_context() and current_user.is_authenticated:
+            return str(current_user.id)
     except Exception:
-        current_app.logger.warning("Tesseract OCR failed", exc_info=True)
+        pass
+    return None
 
-    return _ocr_via_openai(path)
-    
 # ---- Model selection helpers ----
 def _dedupe(seq):
     seen, out = set(), []
@@ -1323,6 +1465,7 @@ def change_plan(user_id: str, new_plan: str):
         supabase.table("users").update({
             "plan": plan
         }).eq("id", user_id).execute()
+    invalidate_user(user_id)
 
 ALLOWED_EXTS = {
     "pdf", "txt", "rtf", "doc", "docx",
@@ -1336,60 +1479,25 @@ def _allowed(filename: str) -> bool:
     return "." in filename and filename.rsplit(".",1)[1].lower() in ALLOWED_EXTS
 
 # ------ extract_text -------
+UPLOAD_MAX_CHARS = 200_000  # what /api/upload hands back; PDF reading stops once this much is in
+
 def _extract_text(path: str, ext: str) -> str:
-    ext = (ext or "").lower()
+    """
+    Text of an uploaded file, via doc_extract: format sniffed from the bytes,
+    PDFs read page by page with OCR only for pages without a text layer,
+    images OCR'd (OpenAI vision if Tesseract gives nothing), all cached by
+    content hash. Raises OcrBusy / ExtractionRejected so the route can answer;
+    a corrupt file gives "".
+    """
     try:
-        if ext == "pdf":
-            # 1) Try normal (text) PDF extraction first
-            text = ""
-            try:
-                from pypdf import PdfReader
-                with open(path, "rb") as f:
-                    reader = PdfReader(f)
-                    out = []
-                    for page in reader.pages:
-                        out.append(page.extract_text() or "")
-                    text = "\n".join(out).strip()
-            except Exception:
-                pass
-
-            # 2) If empty (image-only PDF), OCR each page (needs poppler)
-            if not text.strip():
-                try:
-                    from pdf2image import convert_from_path
-                    pages = convert_from_path(path, dpi=300)  # needs poppler-utils
-                    bits = []
-                    for pg in pages:
-                        g = pg.convert("L")
-                        g = ImageOps.autocontrast(g)
-                        g = g.filter(ImageFilter.MedianFilter(size=3))
-                        bits.append(pytesseract.image_to_string(g) or "")
-                    text = "\n".join(bits).strip()
-                except Exception:
-                    # Optional: pdfplumber as a second attempt
-                    try:
-                        import pdfplumber
-                        with pdfplumber.open(path) as pdf:
-                            text = "\n".join([(p.extract_text() or "") for p in pdf.pages]).strip()
-                    except Exception:
-                        pass
-            return text
-
-        elif ext in ("doc", "docx"):
-            import docx2txt
-            return (docx2txt.process(path) or "").strip()
-
-        elif ext == "rtf":
-            raw = open(path, "rb").read().decode(errors="ignore")
-            return re.sub(r"{\\.*?}|\\[a-z]+\d* ?|[{}]", " ", raw).strip()
-
-        elif ext in ("png", "jpg", "jpeg", "webp", "heic", "heif"):
-            return _img_to_text_file(path)
-
-        else:  # treat as plain text (e.g., .txt)
-            return open(path, "rb").read().decode(errors="ignore").strip()
-
+        res = doc_extract.extract(path, f"upload.{ext}", owner=_ocr_owner(),
+                                  max_chars=UPLOAD_MAX_CHARS, max_bytes=MAX_UPLOAD_BYTES,
+                                  image_fallback=_ocr_via_openai)
+        return res["text"]
+    except (OcrBusy, ExtractionRejected):
+        raise   # let the route answer 4xx/503 instead of "no text found"
     except Exception:
+        current_app.logger.warning("upload: text extraction failed", exc_info=True)
         return ""
 
 # --- Employer JD helpers ------------------------------------------------------
@@ -1501,6 +1609,22 @@ def load_user(user_id: "Optional[str]"):
     if not user_id or user_id == "None":
         return None
 
+    # 1) this worker's LRU, 2) the signed plan/role cookie (only with REDIS_URL), 3) the database
+    row = session_cache.get_user_row(user_id)
+    if row is None and has_request_context():
+        row = session_cache.load_user_cookie(request.cookies.get(session_cache.USER_COOKIE), user_id)
+        if row is not None:
+            session_cache.put_user_row(row)
+    if row is not None:
+        return User(
+            auth_id=row.get("auth_id"),
+            email=row.get("email"),
+            fullname=row.get("fullname"),
+            role=row.get("role") or "user",
+            plan=row.get("plan") or "free",
+            plan_status=row.get("plan_status"),
+        )
+
     supabase = current_app.config.get("SUPABASE")
     if supabase is None:
         logging.warning("load_user: supabase client is not initialized")
@@ -1521,6 +1645,10 @@ def load_user(user_id: "Optional[str]"):
         if not row:
             return None
 
+        session_cache.put_user_row(row)
+        if has_request_context():
+            g.user_cache_cookie = session_cache.dump_user_cookie(row)  # set in _refresh_user_cache_cookie
+
         return User(
             auth_id=row.get("auth_id"),
             email=row.get("email"),
@@ -1610,6 +1738,11 @@ def record_login_event(user):
         current_app.logger.exception("failed to record login event")
 
 # --- Per-account session control (1 active session for Free) ---
+def _write_last_seen(sids, ts):
+    supabase.table("user_sessions").update({"last_seen": ts}).in_("id", sids).execute()
+
+_last_seen = session_cache.LastSeenToucher(_write_last_seen)
+
 def _sign_session_id(session_id: str) -> str:
     return _session_signer.dumps({"sid": session_id, "ts": int(time.time())})
 
@@ -1630,6 +1763,7 @@ def start_user_session(user):
     if plan == "free":
         supabase.table("user_sessions").update({"is_active": False})\
             .eq("auth_id", user.id).eq("is_active", True).execute()
+        invalidate_user(user.id)
 
     row = {"auth_id": user.id, "device_hash": dev, "ip_hash": iph, "user_agent": ua, "is_active": True}
     ins = supabase.table("user_sessions").insert(row).execute()
@@ -1656,9 +1790,14 @@ def end_current_session(redirect_endpoint="account"):
             supabase.table("user_sessions").update({"is_active": False}).eq("id", sid).execute()
         except Exception:
             current_app.logger.exception("failed to end session")
+        session_cache.forget_session(sid)
+    if current_user.is_authenticated:
+        invalidate_user(current_user.id)
+    g.pop("user_cache_cookie", None)
     resp = make_response(redirect(url_for(redirect_endpoint)))
     resp.set_cookie(SID_COOKIE, "", expires=0, path="/")
     resp.set_cookie("jobcus_device", "", expires=0, path="/")
+    resp.set_cookie(session_cache.USER_COOKIE, "", expires=0, path="/")
     logout_user()
     return resp
 
@@ -1687,17 +1826,29 @@ def enforce_single_active_session():
     if not sid:
         return end_current_session("account")  # no bound session cookie → sign out
     try:
-        q = supabase.table("user_sessions").select("*").eq("id", sid).limit(1).execute()
-        row = q.data[0] if q.data else None
+        row = session_cache.get_session_row(sid)
+        if row is None:
+            q = supabase.table("user_sessions").select("id,auth_id,is_active").eq("id", sid).limit(1).execute()
+            row = q.data[0] if q.data else None
+            if row:
+                session_cache.put_session_row(sid, row)
         if not row or (row["auth_id"] != str(current_user.id)) or (not row["is_active"]):
             return end_current_session()
-        # touch last_seen
-        supabase.table("user_sessions").update({"last_seen": datetime.utcnow().isoformat()})\
-            .eq("id", sid).execute()
+        # touch last_seen (throttled + batched, see session_cache)
+        _last_seen.touch(sid)
     except Exception:
         current_app.logger.exception("session check failed")
         return end_current_session()
 
+@app.after_request
+def _refresh_user_cache_cookie(resp):
+    # load_user hit the database this request → hand the browser a fresh copy
+    token = g.pop("user_cache_cookie", None)
+    if token:
+        resp.set_cookie(session_cache.USER_COOKIE, token, max_age=session_cache.USER_COOKIE_MAX_AGE,
+                        httponly=True, samesite="Lax", secure=True, path="/")
+    return resp
+
 # --- Error Handler ---#
 def _wants_json():
     return "application/json" in (request.headers.get("Accept") or "")
@@ -1748,9 +1899,10 @@ def free_plan_device_guard():
 # Jobs fetch (add short timeouts to avoid worker hangs)
 DEFAULT_HTTP_TIMEOUT = (5, 15)  # connect, read
 
-def fetch_remotive_jobs(query: str):
+def fetch_remotive_jobs(query: str, raise_errors: bool = False):
     try:
-        r = requests.get(REMOTIVE_API_URL, params={"search": query}, timeout=DEFAULT_HTTP_TIMEOUT)
+        r = http_pool.get(REMOTIVE_API_URL, params={"search": query}, timeout=DEFAULT_HTTP_TIMEOUT)
+        r.raise_for_status()
         jobs = r.json().get("jobs", [])
         return [
             {
@@ -1763,9 +1915,11 @@ def fetch_remotive_jobs(query: str):
             for job in jobs
         ]
     except Exception:
+        if raise_errors:
+            raise
         return []
 
-def fetch_adzuna_jobs(query: str, location: str, job_type: str):
+def fetch_adzuna_jobs(query: str, location: str, job_type: str, raise_errors: bool = False):
     country = "gb"
     params = {
         "app_id": ADZUNA_APP_ID,
@@ -1775,7 +1929,8 @@ def fetch_adzuna_jobs(query: str, location: str, job_type: str):
         "results_per_page": 10
     }
     try:
-        r = requests.get(f"{ADZUNA_API_URL}/{country}/search/1", params=params, timeout=DEFAULT_HTTP_TIMEOUT)
+        r = http_pool.get(f"{ADZUNA_API_URL}/{country}/search/1", params=params, timeout=DEFAULT_HTTP_TIMEOUT)
+        r.raise_for_status()
         results = r.json().get("results", [])
         return [
             {
@@ -1788,9 +1943,11 @@ def fetch_adzuna_jobs(query: str, location: str, job_type: str):
             for job in results
         ]
     except Exception:
+        if raise_errors:
+            raise
         return []
 
-def fetch_jsearch_jobs(query: str):
+def fetch_jsearch_jobs(query: str, raise_errors: bool = False):
     url = "https://jsearch.p.rapidapi.com/search"
     headers = {
         "X-RapidAPI-Key": JSEARCH_API_KEY,
@@ -1798,7 +1955,8 @@ def fetch_jsearch_jobs(query: str):
     }
     params = {"query": query, "num_pages": 1}
     try:
-        r = requests.get(url, headers=headers, params=params, timeout=DEFAULT_HTTP_TIMEOUT)
+        r = http_pool.get(url, headers=headers, params=params, timeout=DEFAULT_HTTP_TIMEOUT)
+        r.raise_for_status()
         data = r.json().get("data", [])
         return [
             {
@@ -1811,8 +1969,118 @@ def fetch_jsearch_jobs(query: str):
             for job in data
         ]
     except Exception:
+        if raise_errors:
+            raise
         return []
 
+# --- /jobs aggregator: concurrent fan-out under one deadline ---
+JOBS_DEADLINE_SECONDS = float(os.getenv("JOBS_DEADLINE_SECONDS", "8"))
+# "fallback" (default, as before): JSearch (paid, RapidAPI) only when the free
+# providers came back empty; "always": query it alongside the others (lower
+# latency on empty searches, one paid call per search)
+JSEARCH_MODE = os.getenv("JSEARCH_MODE", "fallback").strip().lower()
+
+_jobs_pool = ThreadPoolExecutor(max_workers=int(os.getenv("JOBS_POOL_SIZE", "12")),
+                                thread_name_prefix="jobs")
+
+def _job_key(job: dict) -> str:
+    """Identity used to spot the same posting listed by several providers."""
+    norm = lambda v: re.sub(r"[^a-z0-9]+", " ", str(v or "").lower()).strip()
+    title, company = norm(job.get("title")), norm(job.get("company"))
+    if title and company:
+        return f"{title}|{company}"
+    return (job.get("url") or "").split("?")[0].rstrip("/").lower() or f"{title}|{company}"
+
+def _merge_jobs(results: dict, query: str, location: str) -> list[dict]:
+    """
+    Dedupe across providers and rank: query words in the title first, then
+    postings several providers agree on, then location match, then provider order.
+    """
+    q_words = {w for w in re.findall(r"[a-z0-9]+", (query or "").lower()) if len(w) > 1}
+    loc = (location or "").strip().lower()
+
+    merged: dict[str, dict] = {}
+    order: list[str] = []
+    for provider, jobs in results.items():
+        for job in jobs or []:
+            if not job.get("title") or not job.get("url"):
+                continue
+            k = _job_key(job)
+            if k in merged:
+                if provider not in merged[k]["sources"]:
+                    merged[k]["sources"].append(provider)
+                # fill gaps from the other listing
+                for field in ("company", "location"):
+                    if not merged[k].get(field) and job.get(field):
+                        merged[k][field] = job[field]
+                continue
+            merged[k] = {**job, "source": provider, "sources": [provider]}
+            order.append(k)
+
+    def score(pos_key):
+        pos, k = pos_key
+        job = merged[k]
+        title_words = set(re.findall(r"[a-z0-9]+", (job.get("title") or "").lower()))
+        rel = (len(q_words & title_words) / len(q_words)) if q_words else 0.0
+        loc_hit = 1 if loc and loc in (job.get("location") or "").lower() else 0
+        return (-rel, -len(job["sources"]), -loc_hit, pos)
+
+    return [merged[k] for _pos, k in sorted(enumerate(order), key=score)]
+
+def aggregate_jobs(query: str, location: str, jtype: str, deadline: float = JOBS_DEADLINE_SECONDS) -> dict:
+    """
+    Query every eligible provider at once and return what arrived before the
+    deadline. Shape: {remotive, adzuna, jsearch, jobs, providers}; `jobs` is the
+    merged, deduped, ranked list and `providers` has a status per provider
+    (ok | empty | error | timeout | skipped) with its latency.
+    """
+    started = time.monotonic()
+    calls = {}
+    if jtype in ("remote", ""):
+        calls["remotive"] = lambda: fetch_remotive_jobs(query, raise_errors=True)
+    if jtype in ("onsite", "hybrid", ""):
+        calls["adzuna"] = lambda: fetch_adzuna_jobs(query, location, jtype, raise_errors=True)
+    jsearch_call = lambda: fetch_jsearch_jobs(query, raise_errors=True)
+    if JSEARCH_MODE != "fallback":
+        calls["jsearch"] = jsearch_call
+
+    results: dict[str, list] = {"remotive": [], "adzuna": [], "jsearch": []}
+    status: dict[str, dict] = {name: {"status": "skipped", "count": 0} for name in results}
+
+    def _timed(fn):
+        t0 = time.monotonic()
+        out = fn()
+        return out, int((time.monotonic() - t0) * 1000)
+
+    def _run(batch: dict):
+        futures = {_jobs_pool.submit(_timed, fn): name for name, fn in batch.items()}
+        remaining = max(0.0, deadline - (time.monotonic() - started))
+        done, not_done = wait(futures, timeout=remaining)
+        for fut in done:
+            name = futures[fut]
+            try:
+                jobs, ms = fut.result()
+                results[name] = jobs
+                status[name] = {"status": "ok" if jobs else "empty", "count": len(jobs), "ms": ms}
+            except Exception as e:
+                current_app.logger.warning("jobs provider %s failed: %s", name, e)
+                status[name] = {"status": "error", "count": 0}
+        for fut in not_done:
+            # the request itself keeps running until its own timeout; we just stop waiting
+            fut.cancel()
+            status[futures[fut]] = {"status": "timeout", "count": 0}
+
+    _run(calls)
+    if JSEARCH_MODE == "fallback" and not (results["remotive"] or results["adzuna"]):
+        _run({"jsearch": jsearch_call})
+
+    return {
+        **results,
+        "jobs": _merge_jobs(results, query, location),
+        "providers": status,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
+
 def fetch_salary_data():
     data = []
     country = "gb"
@@ -1824,7 +2092,7 @@ def fetch_salary_data():
             "results_per_page": 1
         }
         try:
-            r = requests.get(f"{ADZUNA_API_URL}/{country}/search/1", params=params, timeout=DEFAULT_HTTP_TIMEOUT)
+            r = http_pool.get(f"{ADZUNA_API_URL}/{country}/search/1", params=params, timeout=DEFAULT_HTTP_TIMEOUT)
             results = r.json().get("results", [])
             if results:
                 job = results[0]
@@ -1841,7 +2109,7 @@ def fetch_job_counts():
     counts = []
     for title in JOB_TITLES:
         try:
-            r = requests.get(REMOTIVE_API_URL, params={"search": title}, timeout=DEFAULT_HTTP_TIMEOUT)
+            r = http_pool.get(REMOTIVE_API_URL, params={"search": title}, timeout=DEFAULT_HTTP_TIMEOUT)
             counts.append(len(r.json().get("jobs", [])))
         except Exception:
             counts.append(0)
@@ -1850,7 +2118,7 @@ def fetch_job_counts():
 def fetch_skill_trends():
     freq = Counter()
     try:
-        r = requests.get(REMOTIVE_API_URL, params={"limit": 50}, timeout=DEFAULT_HTTP_TIMEOUT)
+        r = http_pool.get(REMOTIVE_API_URL, params={"limit": 50}, timeout=DEFAULT_HTTP_TIMEOUT)
         for job in r.json().get("jobs", []):
             text = (job.get("description") or "").lower()
             for key in KEYWORDS:
@@ -1864,7 +2132,7 @@ def fetch_location_counts():
     freq = Counter()
     country = "gb"
     try:
-        r = requests.get(f"{ADZUNA_API_URL}/{country}/search/1", params={
+        r = http_pool.get(f"{ADZUNA_API_URL}/{country}/search/1", params={
             "app_id": ADZUNA_APP_ID,
             "app_key": ADZUNA_APP_KEY,
             "results_per_page": 30
@@ -2211,6 +2479,7 @@ def subscribe():
                 "plan_status": "active",
                 "free_plan_used": True,
             }).eq("auth_id", auth_id).execute()
+            invalidate_user(auth_id)
 
         except Exception:
             current_app.logger.exception("Could not activate free plan")
@@ -2430,6 +2699,7 @@ def _activate_user_plan_by_metadata(supabase, metadata, customer_id=None, subscr
         }).eq("auth_id", user_id).execute()
     except Exception:
         current_app.logger.exception("Failed to update user plan from webhook")
+    invalidate_user(user_id)
 
 
 def _deactivate_user_plan_by_customer(supabase, customer_id):
@@ -2440,6 +2710,7 @@ def _deactivate_user_plan_by_customer(supabase, customer_id):
         }).eq("stripe_customer_id", customer_id).execute()
     except Exception:
         current_app.logger.exception("Failed to downgrade after cancel")
+    invalidate_user(_find_user_id_by_customer(supabase, customer_id))
 
 
 # Map Stripe Price IDs -> your internal plan codes
@@ -2517,6 +2788,7 @@ def _update_user_plan_from_subscription(supabase, sub):
         supabase.table("users").update(db_update).eq("auth_id", user_id).execute()
     except Exception:
         current_app.logger.exception("Failed updating user from subscription")
+    invalidate_user(user_id)
 
 
 @app.post("/stripe/webhook")
@@ -2609,6 +2881,7 @@ def stripe_webhook():
                     supabase.table("users").update({"plan_status": "past_due"}).eq("auth_id", auth_id).execute()
                 except Exception:
                     pass
+                invalidate_user(auth_id)
 
             # Fallback to invoice email if not in DB
             email = email or invoice.get("customer_email")
@@ -2731,7 +3004,7 @@ def account():
     # ---------- SIGNUP ----------
     if mode == "signup":
         try:
-            resp = supabase.auth.sign_up({"email": email, "password": password})
+            resp = init_auth_client().auth.sign_up({"email": email, "password": password})
             user = resp.user
             if not user:
                 return jsonify(success=False, message="Signup failed."), 400
@@ -2752,6 +3025,7 @@ def account():
             if email and email.lower() in admin_emails:
                 try:
                     supabase.table("users").update({"role": "superadmin"}).eq("auth_id", auth_id).execute()
+                    invalidate_user(auth_id)
                 except Exception:
                     current_app.logger.exception("auto-promote admin failed")
 
@@ -2780,7 +3054,7 @@ def account():
     # ---------- LOGIN ----------
     # mode == "login"
     try:
-        resp = supabase.auth.sign_in_with_password({"email": email, "password": password})
+        resp = init_auth_client().auth.sign_in_with_password({"email": email, "password": password})
         user = resp.user
         if not user:
             return jsonify(success=False, message="Invalid email or password."), 401
@@ -2793,6 +3067,7 @@ def account():
         if email and email.lower() in admin_emails:
             try:
                 supabase.table("users").update({"role": "superadmin"}).eq("auth_id", auth_id).execute()
+                invalidate_user(auth_id)
             except Exception:
                 current_app.logger.exception("auto-promote admin failed")
 
@@ -2992,11 +3267,11 @@ def oauth_complete():
 
         # Ask Supabase Auth who this token belongs to
         # (Equivalent to supabase.auth.get_user(access_token) in JS)
-        with httpx.Client(timeout=10) as client:
-            r = client.get(
-                f"{SUPABASE_URL}/auth/v1/user",
-                headers={"Authorization": f"Bearer {access_token}", "apikey": SUPABASE_ANON},
-            )
+        r = http_pool.get(
+            f"{SUPABASE_URL}/auth/v1/user",
+            headers={"Authorization": f"Bearer {access_token}", "apikey": SUPABASE_ANON},
+            timeout=10,
+        )
         if r.status_code != 200:
             current_app.logger.warning("OAuth token verify failed: %s %s", r.status_code, r.text)
             return jsonify(success=False, message="Token verification failed"), 401
@@ -3037,10 +3312,15 @@ ask_bp = Blueprint("ask", __name__)
 
 # --- OpenAI (v1) ---
 _oai_client = None
+_oai_client_lock = threading.Lock()
 def _client():
+    # one client per worker; the lock stops concurrent first requests
+    # (threads / greenlets) from each building their own connection pool
     global _oai_client
     if _oai_client is None:
-        _oai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        with _oai_client_lock:
+            if _oai_client is None:
+                _oai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
     return _oai_client
 
 CAREER_SYSTEM_PROMPT = (
@@ -3071,24 +3351,34 @@ def _first_name_fallback():
         return fn or "there"
     return "there"
 
-def _chat_completion(model: str, user_msg: str, history=None, fallback_model: str | None = None) -> str:
+CHAT_ERROR_REPLY = "Sorry—I'm having trouble reaching the AI right now. Please try again."
+
+def _chat_messages(user_msg: str, history=None, model: str = "gpt-4o-mini", attachments=None,
+                   plan: str | None = None, report: dict | None = None, summary: str | None = None) -> list[dict]:
+    # packed into the plan's token budget: system prompts, the message, the summary of
+    # older turns, attachment snippets, then as much recent history as fits (see chat_context.py)
+    msgs, rep = chat_context.build(
+        model, [CAREER_SYSTEM_PROMPT, STYLE_GUIDE], user_msg,
+        history=history, attachments=attachments, summary=summary, plan=plan,
+    )
+    if report is not None:
+        report.update(rep)
+    return msgs
+
+def _chat_completion(model: str, user_msg: str, history=None, fallback_model: str | None = None,
+                     attachments=None, plan: str | None = None, report: dict | None = None,
+                     summary: str | None = None) -> str:
     """
-    Minimal OpenAI wrapper. `history` can be a list of {role, content}.
+    Minimal OpenAI wrapper. `history` can be a list of {role, content} (without
+    the current message); `attachments` a list of (filename, text); `summary`
+    stands in for turns older than the history. Pass a dict as `report` to get
+    the prompt's token counts back.
 
     If the requested model fails (common for preview models like gpt-5), we
     automatically retry with the caller-provided fallback_model so users still
     get an answer instead of a hard failure.
     """
-    msgs = [
-        {"role": "system", "content": CAREER_SYSTEM_PROMPT},
-        {"role": "system", "content": STYLE_GUIDE},  # ← add this line
-    ]
-    if history:
-        # keep a small sliding window
-        for m in history[-6:]:
-            if m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str):
-                msgs.append({"role": m["role"], "content": m["content"]})
-    msgs.append({"role": "user", "content": user_msg})
+    msgs = _chat_messages(user_msg, history, model, attachments, plan, report, summary)
 
     def _run(model_id: str):
         resp = _client().chat.completions.create(
@@ -3096,6 +3386,10 @@ def _chat_completion(model: str, user_msg: str, history=None, fallback_model: st
             messages=msgs,
             temperature=0.4,
         )
+        if report is not None:
+            report["model_used"] = model_id
+            # "length" / "content_filter" replies are cut short: fine to show, not to cache
+            report["complete"] = resp.choices[0].finish_reason == "stop"
         return (resp.choices[0].message.content or "").strip()
 
     try:
@@ -3112,7 +3406,90 @@ def _chat_completion(model: str, user_msg: str, history=None, fallback_model: st
                     "Fallback chat call also failed for %s", fallback_model, exc_info=True
                 )
 
-        return "Sorry—I'm having trouble reaching the AI right now. Please try again."
+        return CHAT_ERROR_REPLY
+
+def _chat_completion_stream(model: str, user_msg: str, history=None, fallback_model: str | None = None,
+                            attachments=None, plan: str | None = None, report: dict | None = None,
+                            summary: str | None = None):
+    """
+    Streaming twin of _chat_completion. Yields (model_used, text_delta) pairs.
+
+    The fallback model is only tried if the first model fails before producing
+    any text; once tokens have gone out to the browser we can't take them back,
+    so a mid-stream failure just ends the reply. report["complete"] is set only
+    once the stream has run out with finish_reason "stop".
+    """
+    msgs = _chat_messages(user_msg, history, model, attachments, plan, report, summary)
+
+    def _run(model_id: str):
+        stream = _client().chat.completions.create(
+            model=model_id or "gpt-4o-mini",
+            messages=msgs,
+            temperature=0.4,
+            stream=True,
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+            if chunk.choices[0].finish_reason:
+                finish[model_id] = chunk.choices[0].finish_reason
+
+    candidates = [model]
+    if fallback_model and fallback_model != model:
+        candidates.append(fallback_model)
+    finish = {}
+
+    for model_id in candidates:
+        started = False
+        try:
+            for delta in _run(model_id):
+                started = True
+                yield model_id, delta
+            if started:
+                if report is not None:
+                    report["model_used"] = model_id
+                    report["complete"] = finish.get(model_id) == "stop"
+                return
+            # an empty stream counts as a failure, same as a blank reply would
+            current_app.logger.warning("OpenAI stream for %s returned no content", model_id)
+        except Exception:
+            if started:
+                current_app.logger.warning("OpenAI stream for %s broke mid-reply", model_id, exc_info=True)
+                return
+            current_app.logger.warning("OpenAI chat stream failed for %s; attempting fallback", model_id, exc_info=True)
+
+    yield model, CHAT_ERROR_REPLY
+
+SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+
+def _summary_completion(msgs: list[dict]) -> str:
+    # runs on conversation_summary's background threads: no request/app context here
+    resp = _client().chat.completions.create(model=SUMMARY_MODEL, messages=msgs, temperature=0.2)
+    return (resp.choices[0].message.content or "").strip()
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _wants_stream(data: dict) -> bool:
+    return bool(data.get("stream")) or "text/event-stream" in (request.headers.get("Accept") or "")
+
+def _msg_ts(value):
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return value
+
+def _with_pending(rows: list[dict], conv_id) -> list[dict]:
+    """
+    Database rows (oldest first, with created_at) plus the ones chat_writer
+    hasn't written yet. A row the writer is just confirming can be in both;
+    created_at identifies it.
+    """
+    seen = {_msg_ts(r.get("created_at")) for r in rows}
+    return rows + [r for r in chat_writer.pending_for(conv_id) if _msg_ts(r["created_at"]) not in seen]
 
 # SINGLE SOURCE OF TRUTH for chat
 @app.post("/api/ask")
@@ -3132,18 +3509,18 @@ def api_ask():
         return jsonify(error="bad_request", message="message is required"), 400
 
     # --- Attachment context (from client) ---
-    attachments = data.get("attachments") or []
-    att_blocks = []
-    for att in attachments:
+    # The model gets token-budgeted snippets (chat_context.build); the stored
+    # message keeps the old 8000-char excerpt so the transcript reads the same.
+    attachments = []
+    for att in (data.get("attachments") or []):
         fname = (att.get("filename") or "attachment.txt")[:80]
         text  = (att.get("text") or "")
-        if not text:
-            continue
-        snippet = text[:8000]  # keep token/word budget sane
-        att_blocks.append(f"--- {fname} ---\n{snippet}")
-    att_context = "\n\n".join(att_blocks)
-    if att_context:
-        message = f"{message}\n\n[Attachment context]\n{att_context}"
+        if text:
+            attachments.append((fname, text))
+    stored_message = message
+    if attachments:
+        att_context = "\n\n".join(f"--- {fname} ---\n{text[:8000]}" for fname, text in attachments)
+        stored_message = f"{message}\n\n[Attachment context]\n{att_context}"
     # --- end attachment block ---
 
     auth_id = getattr(current_user, "id", None) or getattr(current_user, "auth_id", None)
@@ -3169,38 +3546,42 @@ def api_ask():
     if not admin:
         return jsonify(error="server_config", message="Supabase admin client is not configured."), 500
 
-    ok, info = check_and_increment(admin, str(auth_id), plan, "chat_messages")
+    # plan quota + hourly/daily caps in one batched, all-or-nothing check
+    ok, info = check_and_increment_many(
+        admin, str(auth_id), plan, ["chat_messages", "chat_messages_hour", "chat_messages_day"]
+    )
     if not ok:
         info.setdefault("error", "quota_exceeded")
         info.setdefault("message", "You’ve reached your plan limit for this feature.")
-        return jsonify(info), 402
-
-    # Optional soft caps (ignore failures)
-    try:
-        check_and_increment(admin, str(auth_id), plan, "chat_messages_hour")
-        check_and_increment(admin, str(auth_id), plan, "chat_messages_day")
-    except Exception:
-        pass
+        # hour/day caps are rate limits; the plan quota is an upgrade prompt
+        return jsonify(info), (429 if info.get("feature") != "chat_messages" else 402)
 
     # payload
     conv_id = data.get("conversation_id")
     
-    # Validate conversation ownership/existence
+    # Validate conversation ownership/existence (cached per conversation + owner,
+    # together with the recent window, see conversation_cache.py)
+    history = None
     if conv_id:
-        try:
-            owns = (
-                admin.table("conversations")
-                .select("id")
-                .eq("id", str(conv_id))
-                .eq("auth_id", auth_id)
-                .limit(1)
-                .execute()
-                .data
-            )
-            if not owns:
+        owned, history = conversation_cache.lookup(conv_id, auth_id)
+        if not owned:
+            try:
+                owns = (
+                    admin.table("conversations")
+                    .select("id")
+                    .eq("id", str(conv_id))
+                    .eq("auth_id", auth_id)
+                    .limit(1)
+                    .execute()
+                    .data
+                )
+                if owns:
+                    conversation_cache.remember(conv_id, auth_id)
+                else:
+                    conv_id = None
+            except Exception:
                 conv_id = None
-        except Exception:
-            conv_id = None
+    window_cached = history is not None
     
     # 3) Create conversation if needed
     if not conv_id:
@@ -3209,34 +3590,124 @@ def api_ask():
             {"auth_id": auth_id, "title": title}
         ).execute()
         conv_id = row.data[0]["id"]
+        history = []   # brand new: nothing to read back
+        conversation_summaries.remember(conv_id)
     
-    # 4) Now safe to insert the user message
-    admin.table("conversation_messages").insert({
-        "conversation_id": conv_id, "role": "user", "content": message
-    }).execute()
-
-    # 5) short history window
-    ctx = admin.table("conversation_messages") \
-        .select("role,content") \
-        .eq("conversation_id", conv_id) \
-        .order("created_at", desc=True).limit(8).execute().data or []
-    history = list(reversed(ctx))
+    # 4) short history window — from the cache when we have it, else the database
+    #    (plus whatever this worker still has queued for it)
+    if history is None:
+        ctx = admin.table("conversation_messages") \
+            .select("role,content,created_at") \
+            .eq("conversation_id", conv_id) \
+            .order("created_at", desc=True).limit(8).execute().data or []
+        history = [{"role": r["role"], "content": r["content"]}
+                   for r in _with_pending(list(reversed(ctx)), conv_id)]
+
+    # 5) Now safe to store the user message (write-behind, see chat_writer.py)
+    prior = history[-8:]   # the model gets this turn's message separately
+    chat_writer.enqueue(admin, conv_id, "user", stored_message)
+    history = (history + [{"role": "user", "content": stored_message}])[-8:]
+    if window_cached:
+        # add to the cached window; rewriting it could drop another worker's append
+        conversation_cache.append(conv_id, auth_id, "user", stored_message)
+    else:
+        conversation_cache.remember(conv_id, auth_id, history)
+
+    # older turns ride along as a rolling summary (conversation_summary.py)
+    summary = conversation_summaries.get(admin, conv_id)
+
+    # The opening question of a conversation, with nothing of the user's own
+    # attached, is answered from the response cache (response_cache.py): shared
+    # when it's a short generic question, this user's own otherwise (a pasted
+    # resume, contact details). Anything with history, a summary or attachments
+    # always goes to the model.
+    cache_key = None
+    if not prior and not attachments and not summary:
+        scope = None if response_cache.shareable(message) else auth_id
+        cache_key = response_cache.lookup_key("ask", model, 0.4, [CAREER_SYSTEM_PROMPT, STYLE_GUIDE, message],
+                                              scope=scope)
+    else:
+        response_cache.bypass()
+    cached = response_cache.get(cache_key) if cache_key else None
+
+    def _cache_reply(reply: str, t0: float, ctx_report: dict):
+        # only whole replies (no broken streams, no max_tokens cut-offs) from the
+        # requested model, or a fallback's answer would stick to its key
+        if (cache_key and reply and reply != CHAT_ERROR_REPLY and ctx_report.get("complete")
+                and ctx_report.get("model_used", model) == model):
+            tokens = (ctx_report.get("prompt_tokens") or 0) + chat_context.count_tokens(reply, model)
+            response_cache.put(cache_key, reply, ms=(time.monotonic() - t0) * 1000, tokens=tokens)
 
     # 6) call model
     fallback_for_chat = plan_fallback_model if plan_fallback_model != model else None
-    ai_reply = _chat_completion(
-        model=model,
-        user_msg=message,
-        history=history,
-        fallback_model=fallback_for_chat,
-    )
+
+    if _wants_stream(data):
+        # Server-sent events: meta → token* → done. The assistant message is
+        # stored once, after the last token.
+        def _events():
+            parts, used, ctx_report, t0 = [], model, {}, time.monotonic()
+            yield _sse("meta", {"conversation_id": conv_id, "modelUsed": model})
+            try:
+                if cached:
+                    parts.append(cached["text"])
+                    yield _sse("token", {"delta": cached["text"]})
+                else:
+                    for used, delta in _chat_completion_stream(
+                        model=model,
+                        user_msg=message,
+                        history=prior,
+                        fallback_model=fallback_for_chat,
+                        attachments=attachments,
+                        plan=plan,
+                        report=ctx_report,
+                        summary=summary,
+                    ):
+                        parts.append(delta)
+                        yield _sse("token", {"delta": delta})
+            finally:
+                # runs on normal completion and when the client disconnects
+                reply = "".join(parts).strip()
+                if reply:
+                    try:
+                        chat_writer.enqueue(admin, conv_id, "assistant", reply)
+                        conversation_cache.append(conv_id, auth_id, "assistant", reply)
+                        conversation_summaries.note_turn(admin, conv_id, _summary_completion)
+                    except Exception:
+                        current_app.logger.exception("failed to store streamed assistant message")
+            if not cached and used == model:
+                _cache_reply(reply, t0, ctx_report)
+            yield _sse("done", {"reply": reply, "modelUsed": used, "conversation_id": conv_id,
+                                "promptTokens": ctx_report.get("prompt_tokens"), "cached": bool(cached)})
+
+        return Response(
+            stream_with_context(_events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    ctx_report, t0 = {}, time.monotonic()
+    if cached:
+        ai_reply = cached["text"]
+    else:
+        ai_reply = _chat_completion(
+            model=model,
+            user_msg=message,
+            history=prior,
+            fallback_model=fallback_for_chat,
+            attachments=attachments,
+            plan=plan,
+            report=ctx_report,
+            summary=summary,
+        )
+        _cache_reply(ai_reply, t0, ctx_report)
     
-    # 7) persist assistant message
-    admin.table("conversation_messages").insert({
-        "conversation_id": conv_id, "role": "assistant", "content": ai_reply
-    }).execute()
+    # 7) persist assistant message (queued; the reply doesn't wait for the database)
+    chat_writer.enqueue(admin, conv_id, "assistant", ai_reply)
+    conversation_cache.append(conv_id, auth_id, "assistant", ai_reply)
+    conversation_summaries.note_turn(admin, conv_id, _summary_completion)
 
-    return jsonify(reply=ai_reply, modelUsed=model, conversation_id=conv_id), 200
+    return jsonify(reply=ai_reply, modelUsed=model, conversation_id=conv_id,
+                   promptTokens=ctx_report.get("prompt_tokens"), cached=bool(cached)), 200
 
 # --- Conversations list ---
 @app.get("/api/conversations")
@@ -3296,7 +3767,10 @@ def list_messages(conv_id):
             .execute()
             .data or []
         )
-        return jsonify(rows)
+        # messages this worker hasn't written yet (reload right after a reply, or during an outage)
+        rows = [{"role": r["role"], "content": r["content"], "created_at": r["created_at"]}
+                for r in _with_pending(rows, conv_id)]
+        return jsonify(rows[:200])
     except Exception as e:
         current_app.logger.exception("list_messages failed")
         return jsonify(error="server_error", message=str(e)), 500
@@ -3345,7 +3819,10 @@ def delete_conversation(cid):
         return jsonify(error="not_found", message="Conversation not found."), 404
 
     # 2) Delete children by conversation_id ONLY (no auth_id in this table)
+    chat_writer.discard(cid)   # and don't write queued ones afterwards
     admin.table("conversation_messages").delete().eq("conversation_id", str(cid)).execute()
+    conversation_cache.forget(cid, auth_id)
+    conversation_summaries.forget(cid)
 
     # 3) Now delete the parent — THIS is where the line goes
     admin.table("conversations").delete().eq("id", str(cid)).eq("auth_id", auth_id).execute()
@@ -3395,13 +3872,11 @@ def get_jobs():
         location = data.get("location","")
         jtype    = data.get("jobType","").lower()
 
-        rem = fetch_remotive_jobs(query) if jtype in ["remote",""] else []
-        adz = fetch_adzuna_jobs(query, location, jtype) if jtype in ["onsite","hybrid",""] else []
-        js  = [] if rem or adz else fetch_jsearch_jobs(query)
-
-        return jsonify(remotive=rem, adzuna=adz, jsearch=js)
+        # all providers at once, one overall deadline (see aggregate_jobs)
+        return jsonify(aggregate_jobs(query, location, jtype))
     except Exception:
-        return jsonify(remotive=[], adzuna=[], jsearch=[])
+        current_app.logger.exception("/jobs failed")
+        return jsonify(remotive=[], adzuna=[], jsearch=[], jobs=[], providers={})
 
 @app.get("/api/salary")
 def salary_api_external():
@@ -3443,6 +3918,21 @@ def get_location_data():
 def admin_settings():
     return render_template("admin/settings.html")
 
+@app.get("/admin/metrics")
+@require_superadmin
+def admin_metrics():
+    """Per-worker runtime metrics (each gunicorn worker answers with its own numbers)."""
+    out = {"pid": os.getpid(), "http": http_pool.stats(), "caches": cache_stats(), "ocr": ocr_pool.stats(),
+           "extract_cache": extract_cache.stats(), "ocr_vision": _vision_stats_snapshot(),
+           "conversations": conversation_cache.snapshot(), "chat_writer": chat_writer.stats(),
+           "chat_context": chat_context.stats(), "chat_summaries": conversation_summaries.snapshot(),
+           "response_cache": response_cache.snapshot(),
+           "job_snapshot": {"version": job_snapshot.version, "created_at": job_snapshot.created_at}}
+    backend = counter_backend(current_app.config["SUPABASE_ADMIN"])
+    if hasattr(backend, "stats"):
+        out["usage_cache"] = backend.stats()
+    return jsonify(out)
+
 # ----------------------------
 # Cover Letter
 # ----------------------------
@@ -3616,13 +4106,19 @@ Example format:
         return jsonify(result=fallback, aiUsed=False), 200
 
     try:
-        resp = client.chat.completions.create(
+        # same goal + skills → same analysis, whoever asks (response_cache.py);
+        # a pasted CV or anything with contact details stays with its user
+        shared = response_cache.shareable(goal) and response_cache.shareable(skills)
+        reply, _cached = response_cache.completion(
+            client, "skill-gap",
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.4,
+            query=f"{goal}\n{skills}",
+            scope=None if shared else str(current_user.id),
+            similar=True,
             max_tokens=600,
         )
-        reply = (resp.choices[0].message.content or "").strip()
         return jsonify(result=reply, aiUsed=True), 200
     except Exception as e:
         current_app.logger.exception("skill-gap: OpenAI call failed")
@@ -3764,13 +4260,17 @@ Seniority: {exp}
 """.strip()
 
     try:
-        resp = client.chat.completions.create(
+        # a few different questions per role combination are kept and rotated
+        question, _cached = response_cache.completion(
+            client, "interview-question",
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.6,
+            query=f"{prev}\n{target}\n{exp}",
+            variants=5,
+            similar=True,
             max_tokens=120,
         )
-        question = (resp.choices[0].message.content or "").strip()
         # Strip markdown fences if any creep in
         question = question.replace("```", "").strip()
         return jsonify(question=question), 200
@@ -3907,6 +4407,12 @@ def employer_inquiry():
         current_app.logger.exception("employer_inquiry failed")
         return jsonify(error="Server error"), 500
 
+def _is_json_object(text: str) -> bool:
+    try:
+        return isinstance(json.loads(text), dict)
+    except ValueError:
+        return False
+
 @app.post("/api/employer/skills-suggest")
 def employer_skills_suggest():
     data = request.get_json(silent=True) or {}
@@ -3925,17 +4431,22 @@ def employer_skills_suggest():
                 "Response must be JSON with a top-level 'skills' string array."
             )
             usermsg = f"JOB TITLE: {title}\nSUMMARY: {summary or '(none)'}"
-            resp = client.chat.completions.create(
+            # a posting's own summary is only ever matched exactly, never by similarity
+            content, _cached = response_cache.completion(
+                client, "skills-suggest",
                 model="gpt-4o-mini",
                 messages=[
                     {"role":"system","content": system},
                     {"role":"user","content": usermsg}
                 ],
-                response_format={"type":"json_object"},
                 temperature=0.2,
+                query=title,
+                similar=not summary,
+                accept=_is_json_object,
+                response_format={"type":"json_object"},
             )
             import json
-            payload = json.loads(resp.choices[0].message.content)
+            payload = json.loads(content)
             skills = [s for s in payload.get("skills", []) if isinstance(s, str)]
     except Exception as e:
         current_app.logger.warning("skills_suggest LLM fallback: %s", e)
@@ -4161,7 +4672,12 @@ def api_upload():
 
         filename = secure_filename(f.filename)
         ext = filename.rsplit(".",1)[1].lower()
-        text = _extract_text(tmp.name, ext)
+        try:
+            text = _extract_text(tmp.name, ext)
+        except OcrBusy as e:
+            return jsonify(error=e.error, message=e.message), e.status, {"Retry-After": str(e.retry_after)}
+        except ExtractionRejected as e:
+            return jsonify(error=e.error, message=e.message), e.status
         # trim to a reasonable budget to keep prompts small
         text = (text or "")[:200_000]  # ~200k chars max
 
@@ -1,17 +1,19 @@
-import base64, re, json, logging, os
+import base64, re, json, logging, os, hashlib, time, threading, zipfile, multiprocessing
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
-from flask import Blueprint, request, jsonify, current_app, make_response, send_file, render_template, Response
+from flask import Blueprint, request, jsonify, current_app, make_response, send_file, render_template, Response, stream_with_context
 from flask_login import login_required, current_user
 
-from limits import feature_enabled, check_and_increment
+from limits import feature_enabled, check_and_increment, check_and_increment_many
 from abuse_guard import allow_free_use  # NEW: device/user-scoped guard
 from auth_utils import api_login_required
+from ttl_cache import TTLCache
+import doc_extract
 
-import docx
 from weasyprint import HTML, CSS
 from docxtpl import DocxTemplate
-from PyPDF2 import PdfReader
 from jinja2 import TemplateNotFound
 from authz import require_plan
 from docx import Document
@@ -132,7 +134,7 @@ def build_context(data: dict) -> dict:
 
 
 # === ATS model: weights and deterministic checks ===
-import math, datetime, collections, statistics, itertools
+import math, datetime, collections, statistics, itertools, functools, bisect
 
 # We’ll use this to approximate pages for text resumes (PDF page count is not reliable post-OCR)
 WORDS_PER_PAGE = 600
@@ -231,68 +233,81 @@ def _clean_kw_list(lst):
 
     return sorted(set(out))
 
+# hint lookups used by the JD term extractor, compiled once.
+# Plain substring semantics ("risk" hits "risk register"), longest first.
+def _substring_re(hints):
+    return re.compile("|".join(re.escape(h) for h in sorted(hints, key=len, reverse=True)))
+
+_CERT_RE         = _substring_re(CERT_HINTS)
+_TITLE_RE        = _substring_re(TITLE_HINTS)
+_SKILL_DOMAIN_RE = _substring_re(SKILL_HINTS | DOMAIN_HINTS)
+_PHRASE_HINT_RE  = _substring_re(SKILL_HINTS | TITLE_HINTS | DOMAIN_HINTS | CERT_HINTS)
+_SINGLE_EXCLUDE  = frozenset(STOPWORDS_KW | NOISE_VERBS | NOISE_NOUNS)
+
+JD_ACRONYMS = {
+    "aws": "amazon web services",
+    "ad": "active directory",
+    "sql": "structured query language",
+    "k8s": "kubernetes",
+    "mdm": "mobile device management",
+    "sso": "single sign on",
+    "u at": "user acceptance testing",
+    "sd lc": "software development life cycle"
+}
+
+# Users usually iterate their CV against one posting, so the same JD comes
+# back again and again; key on its hash and skip extraction on repeats.
+_jd_terms_cache = TTLCache("resumes.jd_terms", ttl=24 * 3600, maxsize=256)
+
 def _build_jd_terms(jd: str):
     """
     Extract meaningful JD terms:
     - remove stopwords/boilerplate/generic verbs
     - keep skills/tools/methods/titles/certs/domains (+ acronyms)
     - include useful bigrams/trigrams (e.g., 'risk register', 'ms project')
+    Returns a fresh copy each call, so callers may mutate it.
     """
     if not jd:
         return {"skills": [], "titles": [], "certs": [], "all": [], "acronyms": {}}
 
+    key = hashlib.sha256(jd.encode("utf-8", "surrogatepass")).hexdigest()
+    terms = _jd_terms_cache.get_or_load(key, lambda: _extract_jd_terms(jd))
+    return {k: (dict(v) if isinstance(v, dict) else list(v)) for k, v in terms.items()}
+
+def _extract_jd_terms(jd: str):
+    """Single pass over the JD tokens; linear in JD length."""
     words = re.findall(r"[A-Za-z][A-Za-z+\-/#0-9]*", jd)
     toks  = [w.lower() for w in words]
 
-    bigrams  = [" ".join([toks[i], toks[i+1]]) for i in range(len(toks)-1)]
-    trigrams = [" ".join([toks[i], toks[i+1], toks[i+2]]) for i in range(len(toks)-2)]
-
-    singles = [
-        t for t in toks
-        if (_is_acronym(words[toks.index(t)]) or len(t) >= 3)
-        and t not in STOPWORDS_KW
-        and t not in NOISE_VERBS
-        and t not in NOISE_NOUNS
-    ]
+    # original casing of each token's FIRST occurrence (acronym check)
+    first_word = {}
+    for w, t in zip(words, toks):
+        first_word.setdefault(t, w)
 
-    def looks_useful_phrase(p: str) -> bool:
-        if any(h in p for h in (SKILL_HINTS | TITLE_HINTS | DOMAIN_HINTS)):
-            return True
-        if any(c in p for c in CERT_HINTS):
-            return True
-        if any(t in p for t in TITLE_HINTS):
-            return True
-        return False
-
-    phrases = [p for p in (bigrams + trigrams) if looks_useful_phrase(p)]
-
-    acronyms = {
-        "aws": "amazon web services",
-        "ad": "active directory",
-        "sql": "structured query language",
-        "k8s": "kubernetes",
-        "mdm": "mobile device management",
-        "sso": "single sign on",
-        "u at": "user acceptance testing",
-        "sd lc": "software development life cycle"
+    singles = {
+        t for t, w in first_word.items()
+        if (_is_acronym(w) or len(t) >= 3) and t not in _SINGLE_EXCLUDE
     }
 
-    expanded = set(singles) | set(phrases)
-    for a, full in acronyms.items():
+    ngrams = {" ".join(toks[i:i+2]) for i in range(len(toks)-1)}
+    ngrams.update(" ".join(toks[i:i+3]) for i in range(len(toks)-2))
+    phrases = {p for p in ngrams if _PHRASE_HINT_RE.search(p)}
+
+    expanded = singles | phrases
+    for a, full in JD_ACRONYMS.items():
         if a in expanded:   expanded.add(full)
         if full in expanded: expanded.add(a)
 
-    certs  = sorted({w for w in expanded if any(c in w for c in CERT_HINTS)})
-    titles = sorted({w for w in expanded if any(t in w for t in TITLE_HINTS)})
-    skills = sorted({
-        w for w in expanded
-        if w not in set(certs) | set(titles)
-        and (any(h in w for h in (SKILL_HINTS | DOMAIN_HINTS))
-             or _is_acronym(w.replace(" ", "").upper()))
-    })
+    certs  = {w for w in expanded if _CERT_RE.search(w)}
+    titles = {w for w in expanded if _TITLE_RE.search(w)}
+    skills = {
+        w for w in expanded - certs - titles
+        if _SKILL_DOMAIN_RE.search(w) or _is_acronym(w.replace(" ", "").upper())
+    }
 
-    all_terms = sorted(set(skills) | set(titles) | set(certs), key=lambda x: (-len(x), x))
-    return {"skills": skills, "titles": titles, "certs": certs, "all": all_terms, "acronyms": acronyms}
+    all_terms = sorted(skills | titles | certs, key=lambda x: (-len(x), x))
+    return {"skills": sorted(skills), "titles": sorted(titles), "certs": sorted(certs),
+            "all": all_terms, "acronyms": dict(JD_ACRONYMS)}
 
 # --------------------------- helpers ---------------------------
 def _clean_lines(text: str):
@@ -301,9 +316,93 @@ def _clean_lines(text: str):
 def _tokenize(text: str):
     return re.findall(r"[A-Za-z][A-Za-z+\-/#0-9]*", text.lower())
 
-def _split_sections(text: str):
+def _trie_regex(node: dict) -> str:
+    """Regex for a char trie; shared prefixes are written once so the engine doesn't retry them per term."""
+    end = "" in node
+    alts = [re.escape(ch) + _trie_regex(node[ch]) for ch in sorted(k for k in node if k)]
+    if not alts:
+        return ""
+    body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+    if end:
+        # greedy: prefer the longer term, fall back to the shorter one
+        return "(?:" + body + ")?"
+    return body
+
+def _term_trie(terms) -> dict:
+    trie: dict = {}
+    for t in terms:
+        node = trie
+        for ch in t:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    return trie
+
+class KeywordIndex:
+    """
+    A set of lowercase terms compiled into one regex per matching mode.
+    scan() walks the text and returns {term: [offsets]} for every hit,
+    including terms nested at the same start ("risk" inside "risk register").
+
+    Terms shorter than `substring_min` (acronyms, "sql", "aws") must be whole
+    words; with plurals=True a trailing s/es still counts ("stakeholders").
+    Longer terms match anywhere in a word, as the old `t in txt` check did:
+    "engineer" in "engineering lead", "python" in "python3",
+    "manager" in "projectmanager". substring_min=None keeps every term
+    word-bounded.
+    """
+
+    def __init__(self, terms, plurals: bool = True, substring_min: int | None = None):
+        self.terms = frozenset(t.strip().lower() for t in terms if t and t.strip())
+        loose = {t for t in self.terms if substring_min is not None and len(t) >= substring_min}
+        strict = self.terms - loose
+        suffix = "(?:e?s)?" if plurals else ""
+        self._word_re = re.compile(
+            rf"(?<![a-z0-9])(?=({_trie_regex(_term_trie(strict))}){suffix}(?![a-z0-9]))"
+        ) if strict else None
+        # zero-width, so finditer tries every offset, not just word starts
+        self._sub_re = re.compile(rf"(?=({_trie_regex(_term_trie(loose))}))") if loose else None
+        # shorter terms found at the same start as a longer one
+        self._nested = {}
+        for t in strict:
+            pre = [t[:i] for i in range(1, len(t)) if not t[i].isalnum() and t[:i] in strict]
+            if pre:
+                self._nested[t] = pre
+        for t in loose:
+            pre = [t[:i] for i in range(1, len(t)) if t[:i] in loose]
+            if pre:
+                self._nested[t] = pre
+
+    def scan(self, text: str) -> dict:
+        hits: dict = {}
+        if not text:
+            return hits
+        for rx in (self._word_re, self._sub_re):
+            if rx is None:
+                continue
+            for m in rx.finditer(text):
+                t, pos = m.group(1), m.start()
+                hits.setdefault(t, []).append(pos)
+                for p in self._nested.get(t, ()):
+                    hits.setdefault(p, []).append(pos)
+        return hits
+
+    def search(self, text: str) -> bool:
+        return any(rx is not None and rx.search(text) is not None for rx in (self._word_re, self._sub_re))
+
+@functools.lru_cache(maxsize=256)
+def _keyword_index(terms: tuple) -> KeywordIndex:
+    # whole words for short terms only; longer ones keep the old substring match
+    return KeywordIndex(terms, substring_min=4)
+
+_PERSONAL_DATA_INDEX = KeywordIndex(PERSONAL_DATA, plurals=False)
+
+def _split_sections(text):
     """Split into canonical sections so we can measure distribution."""
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    if isinstance(text, ParsedResume):
+        return text.sections
+    return _sections_from_lines(_clean_lines(text))
+
+def _sections_from_lines(lines):
     sections = collections.OrderedDict()
     cur = "_start"; sections[cur] = []
 
@@ -358,8 +457,47 @@ def _normalize_extracted_text(s: str) -> str:
 
     return s
 
-def _extract_roles_with_dates(text: str):
+class ParsedResume:
+    """
+    Everything the ATS scorers need from one resume, worked out once.
+
+    The scoring helpers below accept either plain text or a ParsedResume;
+    resume_analysis builds one per request so sections, tokens, roles and
+    bullet stats aren't recomputed by every scorer.
+    """
+
+    def __init__(self, text: str):
+        self.text = text or ""
+        self.lower = self.text.lower()
+        self.lines = _clean_lines(self.text)
+        # offset of each clean line in `lower`, so keyword hits map back to lines
+        self.line_starts = []
+        off = 0
+        for raw in self.lower.splitlines(keepends=True):
+            if raw.strip():
+                self.line_starts.append(off + len(raw) - len(raw.lstrip()))
+            off += len(raw)
+        self.sections = _sections_from_lines(self.lines)
+        self.tokens = _tokenize(self.text)
+        self.token_counts = collections.Counter(self.tokens)
+        self.roles = _extract_roles_with_dates(self)
+        self.quant = _quant_stats(self)
+
+    def line_at(self, offset: int) -> str:
+        """The clean line containing `offset` (an index into .lower)."""
+        i = bisect.bisect_right(self.line_starts, offset) - 1
+        return self.lines[i] if 0 <= i < len(self.lines) else ""
+
+def _as_parsed(resume) -> "ParsedResume":
+    return resume if isinstance(resume, ParsedResume) else ParsedResume(resume)
+
+def _resume_text(resume) -> str:
+    return resume.text if isinstance(resume, ParsedResume) else resume
+
+def _extract_roles_with_dates(text):
     """Return list of roles with date hints + lines (to weight recency and detect gaps)."""
+    if isinstance(text, ParsedResume) and hasattr(text, "roles"):
+        return text.roles
     sections = _split_sections(text)
     all_lines = list(itertools.chain.from_iterable(sections.values()))
     roles = []
@@ -394,8 +532,13 @@ def _has_action_verb_start(line: str):
     w = m.group(1).lower() if m else ""
     return w in ACTION_VERBS_STRONG, w
 
-def _quant_stats(text: str):
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+def _quant_stats(text):
+    if isinstance(text, ParsedResume):
+        if hasattr(text, "quant"):
+            return text.quant
+        lines = text.lines
+    else:
+        lines = _clean_lines(text)
     bullets = [ln for ln in lines if ln[:2] in ("- ", "* ", "• ") or (ln and ln[0] in BULLET_MARKERS)]
 
     # Fallback: treat experience lines that start with a strong action verb as bullets
@@ -422,7 +565,8 @@ def _quant_stats(text: str):
         "avg_words_per_bullet": round(avg_len,1)
     }
 
-def _parse_and_format_score(resume_text: str, file_kind: str, raw_bytes: bytes|None):
+def _parse_and_format_score(resume_text, file_kind: str, raw_bytes: bytes|None):
+    resume_text = _resume_text(resume_text)
     # 1) selectable text
     selectable = len(resume_text.strip()) >= 180
     s1 = 4 if selectable else 0
@@ -441,17 +585,19 @@ def _parse_and_format_score(resume_text: str, file_kind: str, raw_bytes: bytes|N
     # 4) standard bullets/fonts (we can only check bullets)
     s4 = 1 if re.search(r"(^|\n)\s*(?:•|\-|\*)\s+", txt) else 0
 
-    # image-only PDF heuristic (bytes >> text)
+    # image-only PDF heuristic (bytes >> text); raw_bytes may also be just the size
     hard_fail = False
     if raw_bytes and file_kind == "pdf":
-        bpc = len(raw_bytes) / max(1, len(txt.encode("utf-8")))
+        size = raw_bytes if isinstance(raw_bytes, int) else len(raw_bytes)
+        bpc = size / max(1, len(txt.encode("utf-8")))
         if selectable is False or bpc > 60:
             hard_fail = True
 
     return (0 if hard_fail else (s1+s2+s3+s4)), hard_fail
 
-def _sections_structure_score(text: str):
-    sec = _split_sections(text)
+def _sections_structure_score(resume):
+    sec = _split_sections(resume)
+    text = _resume_text(resume)
     has_std = {
         "experience": any("experience" in k for k in sec.keys()),
         "education": any("education" in k for k in sec.keys()),
@@ -463,7 +609,7 @@ def _sections_structure_score(text: str):
     base += 2 if PHONE_PAT.search(text) else 0
     base += 1 if LOC_PAT.search(text) else 0
 
-    roles = _extract_roles_with_dates(text)
+    roles = _extract_roles_with_dates(resume)
     dated   = sum(1 for r in roles if r.get("start") or r.get("end"))
     chrono  = 1 if len(roles) < 2 else int(all((roles[i].get("end") or 0) >= (roles[i+1].get("end") or 0) for i in range(len(roles)-1)))
     rc = min(5, dated) + chrono  # max 6 for this part
@@ -476,7 +622,7 @@ def _sections_structure_score(text: str):
     }
 
 # ---------------------- JD keyword scoring (0–100) ----------------------
-def _keyword_match_to_jd(resume_text: str, jd_terms: dict, roles: list):
+def _keyword_match_to_jd(resume_text, jd_terms: dict, roles: list):
     """
     Bucketed keyword scoring → normalized to 0–100.
       Buckets (max points 35 total):
@@ -486,9 +632,18 @@ def _keyword_match_to_jd(resume_text: str, jd_terms: dict, roles: list):
         - Acronym ↔ full form coverage ...  3
         - Natural distribution ...........  3
     """
-    txt = resume_text.lower()
-    sections = _split_sections(resume_text)
-    skills_blob = " ".join(sections.get("skills", [])).lower()
+    parsed = _as_parsed(resume_text)
+    acronyms = jd_terms.get("acronyms", {}) or {}
+
+    # every JD term (+ acronym pairs) in one pass over the resume: term -> [offsets]
+    index = _keyword_index(tuple(sorted(
+        set(jd_terms.get("skills", []) or []) | set(jd_terms.get("titles", []) or [])
+        | set(jd_terms.get("certs", []) or []) | set(acronyms) | set(acronyms.values())
+    )))
+    found = index.scan(parsed.lower)
+
+    def found_in(t, lines):
+        return any(parsed.line_at(pos) in lines for pos in found.get(t, ()))
 
     def cover(terms):
         if not terms: return 0.0, [], terms
@@ -498,7 +653,7 @@ def _keyword_match_to_jd(resume_text: str, jd_terms: dict, roles: list):
                 continue
             if t in STOPWORDS_KW or t in NOISE_VERBS or t in NOISE_NOUNS:
                 continue
-            if t in txt or re.search(rf"\b{re.escape(t)}\b", txt):
+            if t in found:
                 hits.append(t)
         matched = sorted(set(hits))
         missing = sorted(set(terms) - set(matched))
@@ -509,12 +664,12 @@ def _keyword_match_to_jd(resume_text: str, jd_terms: dict, roles: list):
     cov_ti, m_ti, miss_ti = cover(jd_terms.get("titles", []))
     cov_ce, m_ce, miss_ce = cover(jd_terms.get("certs", []))
 
-    recent_txt = " ".join(" ".join(r["lines"]).lower() for r in (roles or [])[:2])
+    recent_lines = {ln for r in (roles or [])[:2] for ln in r["lines"]}
 
     def recency_boost(cov, matched):
         if not matched:
             return cov
-        in_recent = sum(1 for t in matched if t in recent_txt)
+        in_recent = sum(1 for t in matched if found_in(t, recent_lines))
         if in_recent:
             cov = min(1.0, cov + 0.1)
         return cov
@@ -529,13 +684,14 @@ def _keyword_match_to_jd(resume_text: str, jd_terms: dict, roles: list):
 
     # Acronym ↔ full-form coverage
     acro_ok = 0
-    for a, full in jd_terms.get("acronyms", {}).items():
-        if re.search(rf"\b{re.escape(a)}\b", txt) and re.search(rf"\b{re.escape(full)}\b", txt):
+    for a, full in acronyms.items():
+        if a in found and full in found:
             acro_ok = 3
             break
 
     # Distribution (not only in "skills" section)
-    in_skills = sum(1 for t in set(m_sk + m_ti + m_ce) if t in skills_blob)
+    skills_lines = set(parsed.sections.get("skills", []))
+    in_skills = sum(1 for t in set(m_sk + m_ti + m_ce) if found_in(t, skills_lines))
     distribution_ok = in_skills < max(2, int(0.6 * len(set(m_sk + m_ti + m_ce))))
     pts_dist = 3 if distribution_ok else 0
 
@@ -555,7 +711,7 @@ def _keyword_match_to_jd(resume_text: str, jd_terms: dict, roles: list):
         "components": {"skills": pts_sk, "titles": pts_ti, "certs": pts_ce, "acro": acro_ok, "distribution": pts_dist, "total_points": total_pts}
     }
 
-def _experience_relevance(jd_text: str, roles: list, resume_text: str):
+def _experience_relevance(jd_text: str, roles: list, resume_text):
     m = re.search(r"(\d+)\+?\s+years", jd_text, re.I)
     req = int(m.group(1)) if m else None
     yoe = _years_of_experience(roles)
@@ -572,28 +728,33 @@ def _experience_relevance(jd_text: str, roles: list, resume_text: str):
     s_recent = 3 if overlap >= 4 else 2 if overlap >= 2 else 1
 
     jd_verbs = {w for w in _tokenize(jd_text) if w in verbs}
-    res_verbs= {w for w in _tokenize(resume_text) if w in verbs}
+    res_tokens = resume_text.token_counts if isinstance(resume_text, ParsedResume) else _tokenize(resume_text)
+    res_verbs= {w for w in res_tokens if w in verbs}
     s_task   = 2 if len(jd_verbs & res_verbs) >= 2 else 1 if (jd_verbs & res_verbs) else 0
 
     return {"score": s_years + s_senior + s_recent + s_task, "yoe": yoe, "req": req}
 
-def _education_and_certs(resume_text: str, jd_terms: dict):
+def _education_and_certs(resume_text, jd_terms: dict):
     score = 0
-    if re.search(r"\b(bsc|msc|b\.?sc|m\.?sc|bachelor|master|degree)\b", resume_text, re.I):
+    lower = resume_text.lower if isinstance(resume_text, ParsedResume) else resume_text.lower()
+    if re.search(r"\b(bsc|msc|b\.?sc|m\.?sc|bachelor|master|degree)\b", lower):
         score += 3
-    certs_found = [c for c in jd_terms.get("certs", []) if c in resume_text.lower()]
+    certs_found = [c for c in jd_terms.get("certs", []) if c in lower]
     if certs_found: score += 3
     return {"score": score, "certs_found": certs_found}
 
-def _eligibility_location(resume_text: str):
+def _eligibility_location(resume_text):
+    resume_text = _resume_text(resume_text)
     score = 0
     if LOC_PAT.search(resume_text): score += 1
     if re.search(r"\b(eligible to work|work authorization|right to work|visa|relocat)\b", resume_text, re.I):
         score += 2
     return {"score": score}
 
-def _readability_brevity(resume_text: str, level: str):
-    words = len(_tokenize(resume_text))
+def _readability_brevity(resume_text, level: str):
+    parsed = _as_parsed(resume_text)
+    resume_text = parsed.text
+    words = len(parsed.tokens)
     est_pages = max(1, int(round(words/WORDS_PER_PAGE)))
     if level in ("exec","senior"):
         length_ok = est_pages <= 3
@@ -601,7 +762,7 @@ def _readability_brevity(resume_text: str, level: str):
         length_ok = est_pages <= 2
     s_len = 3 if length_ok else 1
 
-    qs = _quant_stats(resume_text)
+    qs = parsed.quant
     within = 8 <= qs["avg_words_per_bullet"] <= 20 if qs["bullet_count"] else False
     s_bul = 3 if within else 1
 
@@ -617,10 +778,11 @@ def _readability_brevity(resume_text: str, level: str):
         "consistency_component": s_con,
     }
 
-def _content_depth_penalty(resume_text: str, level: str):
+def _content_depth_penalty(resume_text, level: str):
     """Penalise very short / sparse resumes so 1-page thin CVs can't score high."""
-    words = len(_tokenize(resume_text))
-    qs = _quant_stats(resume_text)
+    parsed = _as_parsed(resume_text)
+    words = len(parsed.tokens)
+    qs = parsed.quant
     bullets = qs["bullet_count"]
 
     min_words = 300 if level in ("entry",) else 350
@@ -643,17 +805,19 @@ def _detect_unnecessary_sections(resume_text: str):
     if re.search(r"(?i)^\s*objective\b",  resume_text, re.M): found.append("Objective")
     return found
 
-def _penalties(resume_text: str, roles: list, hard_fail: bool):
+def _penalties(resume_text, roles: list, hard_fail: bool):
     pts, reasons = 0, []
     if hard_fail: return 100, ["Image-only/unparseable PDF"]
+    parsed = _as_parsed(resume_text)
+    resume_text = parsed.text
 
     # missing any dates across roles
     if sum(1 for r in roles if r.get("start") or r.get("end")) == 0:
         pts += 5; reasons.append("Missing dates on roles")
 
-    toks = _tokenize(resume_text)
+    toks = parsed.tokens
     if toks:
-        counts = collections.Counter(toks)
+        counts = parsed.token_counts.copy()
         common_actions = {"managed","led","delivered","supported","coordinated"}
         for a in common_actions: counts.pop(a, None)
         if counts:
@@ -669,7 +833,7 @@ def _penalties(resume_text: str, roles: list, hard_fail: bool):
         if b - a >= 2:
             pts += 3; reasons.append("Potential gaps"); break
 
-    if any(re.search(rf"\b{re.escape(p)}\b", resume_text, re.I) for p in PERSONAL_DATA):
+    if _PERSONAL_DATA_INDEX.search(parsed.lower):
         pts += 2; reasons.append("Personal data (DOB/photo/etc.)")
 
     return pts, reasons
@@ -923,24 +1087,23 @@ def optimize_resume():
         ), 403
 
     client = current_app.config["OPENAI_CLIENT"]
-    data = request.get_json(force=True)
+    try:
+        data, upload_kind, source = _resume_request()
+    except UploadRejected as e:
+        return jsonify(error=str(e)), e.status
     resume_text = ""
 
-    if data.get("pdf"):
+    if upload_kind == "pdf":
         try:
-            pdf_bytes = base64.b64decode(data["pdf"])
-            reader = PdfReader(BytesIO(pdf_bytes))
-            resume_text = "\n".join((p.extract_text() or "") for p in reader.pages)
+            resume_text = _raw_text_from_upload("pdf", source)
             if not resume_text.strip():
                 return jsonify(error="PDF content appears to have no selectable text (likely scanned). Upload a text-based PDF or DOCX."), 400
         except Exception:
             logging.exception("PDF Decode Error")
             return jsonify(error="Unable to extract PDF text (corrupt or scanned). Upload a text-based PDF or DOCX."), 400
-    elif data.get("docx"):
+    elif upload_kind == "docx":
         try:
-            docx_bytes = base64.b64decode(data["docx"])
-            d = docx.Document(BytesIO(docx_bytes))
-            resume_text = "\n".join(p.text for p in d.paragraphs)
+            resume_text = _raw_text_from_upload("docx", source)
             if not resume_text.strip():
                 return jsonify(error="DOCX appears empty. Please check the file content."), 400
         except Exception:
@@ -1458,124 +1621,168 @@ def ai_helper():
     return jsonify(error="unknown_field", message="Unsupported field"), 400
 
 # ---------- 3) AI resume analysis ----------
-@resumes_bp.route("/api/resume-analysis", methods=["POST"])
-@api_login_required
-def resume_analysis():
-    supabase_admin = current_app.config["SUPABASE_ADMIN"]
-    plan = (getattr(current_user, "plan", "free") or "free").lower()
-
-    # NEW: device/user-scoped free-plan guard (no router IP)
-    ok, payload = allow_free_use(current_user.id, plan)
-    if not ok:
-        return jsonify({
-            "error": "too_many_free_accounts",
-            "message": payload.get("message") or "Free usage limit reached for this device."
-        }), 429
+RESUME_MAX_UPLOAD_BYTES = int(float(os.getenv("RESUME_MAX_UPLOAD_MB", "10")) * 1024 * 1024)
 
-    # FIX: align quota key with limits/UI: resume_analyzer
-    allowed, info = check_and_increment(supabase_admin, current_user.id, plan, "resume_analyzer")
-    if not allowed:
-        base = "https://www.jobcus.com"
-        anchor = "#employer-pricing" if plan == "employer_jd" else ""
-        PRICING_URL = f"{base}/pricing{anchor}"
-    
-        info.setdefault("error", "quota_exceeded")
-        info.setdefault("message", "You’ve reached your plan limit for this feature.")
-        info.setdefault(
-            "message_html",
-            f'You’ve reached your plan limit for this feature. <a href="{PRICING_URL}">Upgrade now →</a>'
-        )
-        info.setdefault("pricing_url", PRICING_URL)
-        return jsonify(info), 402
+class UploadRejected(ValueError):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
 
-    # Additional hour/day call caps
-    okh, infh = check_and_increment(supabase_admin, current_user.id, plan, "resume_analyzer_hour")
-    if not okh:
-        return jsonify(infh), 429
-    
-    okd, infd = check_and_increment(supabase_admin, current_user.id, plan, "resume_analyzer_day")
-    if not okd:
-        return jsonify(infd), 429
+def _resume_request():
+    """
+    (fields, kind, source) for the resume endpoints.
 
+    multipart/form-data: the file stays in Werkzeug's spooled temp file and
+    `source` is that stream — no base64 inflation, no extra copy. Older
+    clients posting JSON with base64 "pdf"/"docx" still work; `source` is
+    then the decoded bytes. kind is "pdf", "docx", or None (text/no file).
     """
-    ATS scoring model (100 pts) + penalties, aligned to industry best practice.
-    Preserves your existing response shape for the dashboard.
+    if request.files:
+        fields = request.form.to_dict()
+        fs = next((request.files[k] for k in ("file", "resume", "pdf", "docx") if k in request.files), None)
+        fs = fs or next(iter(request.files.values()))
+        if not fs or not fs.filename:
+            return fields, None, None
+        try:
+            kind = doc_extract.detect(fs.stream, fs.filename, max_bytes=RESUME_MAX_UPLOAD_BYTES)
+        except doc_extract.ExtractionRejected as e:
+            raise UploadRejected(e.message, e.status)
+        if kind not in ("pdf", "docx"):
+            raise UploadRejected("Unsupported file type. Upload a PDF or DOCX.")
+        return fields, kind, fs.stream
+
+    fields = request.get_json(force=True, silent=True) or {}
+    for kind in ("pdf", "docx"):
+        if fields.get(kind):
+            try:
+                return fields, kind, base64.b64decode(fields[kind])
+            except Exception:
+                raise UploadRejected("Could not read the resume file")
+    return fields, None, None
+
+def _upload_size(source) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    return size
+
+def _raw_text_from_upload(kind: str, source) -> str:
     """
-    client = current_app.config.get("OPENAI_CLIENT")
-    data = request.get_json(force=True) or {}
+    Text of an uploaded PDF/DOCX via doc_extract (not normalised). `source`
+    is bytes or a seekable binary stream, parsed in place. No OCR: the score
+    should reflect what an ATS parser sees, so a scanned CV still comes back
+    empty. Cached by content hash. Raises on unreadable files.
+    """
+    return doc_extract.extract(source, kind=kind, ocr=False,
+                               max_bytes=RESUME_MAX_UPLOAD_BYTES)["text"]
 
-    # ---- Decode input ----
-    resume_text, file_kind, raw_bytes = "", None, None
-    try:
-        if data.get("pdf"):
-            raw_bytes = base64.b64decode(data["pdf"])
-            reader = PdfReader(BytesIO(raw_bytes))
-            resume_text = "\n".join((p.extract_text() or "") for p in reader.pages)
-            resume_text = _normalize_extracted_text(resume_text)  # normalize
-            file_kind = "pdf"
-    
-        elif data.get("docx"):
-            raw_bytes = base64.b64decode(data["docx"])
-            buf = BytesIO(raw_bytes)
-            d = docx.Document(buf)
-            resume_text = "\n".join(p.text for p in d.paragraphs)
-            resume_text = _normalize_extracted_text(resume_text)  # normalize
-            file_kind = "docx"
-    
-        elif data.get("text"):
-            resume_text = (data["text"] or "").strip()
-            resume_text = _normalize_extracted_text(resume_text)  # normalize
-            file_kind = "text"
+def _llm_commentary(client, resume_text: str, job_desc: str = "", job_role: str = "") -> dict:
+    """Qualitative LLM pass (issues/strengths/writing/relevance); defaults if no client or on error."""
+    llm = {
+        "analysis": {"issues": [], "strengths": []},
+        "suggestions": [],
+        "writing": {"readability": "", "repetition": [], "grammar": []},
+        "relevance": {"role": job_role, "score": 0, "explanation": "", "aligned_keywords": [], "missing_keywords": []},
+    }
     
-        else:
-            return jsonify(error="No resume data provided"), 400
+    if client:
+        try:
+            role_or_desc = (
+                f"Job description:\n{job_desc}"
+                if job_desc
+                else (f"Target role: {job_role}" if job_role else "No job description provided.")
+            )
+            prompt = f"""
+You are an ATS-certified resume analyst. Return ONLY valid JSON (no backticks) with:
+{{
+  "analysis": {{"issues": ["..."], "strengths": ["..."]}},
+  "suggestions": ["..."],
+  "writing": {{
+    "readability": "Grade level (e.g., Grade 8–10 / B2)",
+    "repetition": [{{"term":"managed","count":5,"alternatives":["led","owned","coordinated"]}}],
+    "grammar": ["Short, actionable fixes."]
+  }},
+  "relevance": {{
+    "role": "{job_role}",
+    "score": 0-100,
+    "explanation": "1–2 sentences",
+    "aligned_keywords": ["..."],
+    "missing_keywords": ["..."]
+  }}
+}}
+Context:
+{role_or_desc}
+
+Resume:
+{resume_text[:8000]}
+""".strip()
     
-    except Exception:
-        current_app.logger.exception("resume-analysis: decode failed")
-        return jsonify(error="Could not read the resume file"), 400
+            resp = client.chat.completions.create(
+                model="gpt-4o",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+            )
+            content = (resp.choices[0].message.content or "").strip()
     
-    if not (resume_text or "").strip():
-        return jsonify(error="Could not extract any text"), 400
+            # (usage logging + JSON extraction)
+            content = re.sub(r"```(?:json)?", "", content)
+            s, e = content.find("{"), content.rfind("}")
+            if s >= 0 and e > s:
+                js = json.loads(content[s:e + 1])
+                for k, v in js.items():
+                    llm[k] = v
     
-    job_desc = (data.get("jobDescription") or "").strip()
-    job_role = (data.get("jobRole") or "").strip()
-    level    = (data.get("careerLevel") or "mid").lower()
+        except Exception:
+            logging.warning(
+                "LLM step skipped; continuing with deterministic output", exc_info=True
+            )
+    return llm
 
-    # ---- Deterministic ATS categories ----
-    pf_score, hard_fail = _parse_and_format_score(resume_text, file_kind, raw_bytes)  # /10
-    sec_struct   = _sections_structure_score(resume_text)                              # /15
-    roles        = _extract_roles_with_dates(resume_text)
+def _ats_score(parsed: "ParsedResume", file_kind, raw_bytes, job_desc: str = "", job_role: str = "", level: str = "mid",
+               jd_terms: dict | None = None) -> dict:
+    """
+    Deterministic part of /api/resume-analysis: category scores, penalties,
+    caps, UI breakdown bars, headline and diagnostics. No I/O, no LLM, so the
+    same numbers come out for the same resume + JD every time.
+    Pass `jd_terms` to reuse terms already extracted from job_desc (batch).
+    """
+    pf_score, hard_fail = _parse_and_format_score(parsed, file_kind, raw_bytes)  # /10
+    sec_struct   = _sections_structure_score(parsed)                              # /15
+    roles        = parsed.roles
 
     # Build JD terms with fallbacks: JD > role > summary/skills
     jd_source = (job_desc or "").strip()
     if not jd_source and job_role:
         jd_source = job_role
     if not jd_source:
-        secs = _split_sections(resume_text)
+        secs = parsed.sections
         summary_blob = " ".join(secs.get("summary", []))
         skills_blob  = " ".join(secs.get("skills", []))
         jd_source = f"{summary_blob}\n{skills_blob}".strip()
 
-    jd_terms = _build_jd_terms(jd_source) if jd_source else {"all": [], "skills": [], "titles": [], "certs": [], "acronyms": {}}
+    if jd_terms is None or not job_desc:
+        jd_terms = _build_jd_terms(jd_source) if jd_source else {"all": [], "skills": [], "titles": [], "certs": [], "acronyms": {}}
 
-    kw_match     = _keyword_match_to_jd(resume_text, jd_terms, roles)   # points 0–35
+    kw_match     = _keyword_match_to_jd(parsed, jd_terms, roles)   # points 0–35
     kw_points    = kw_match["score"]
 
     # Clean the keyword lists before returning
     matched = _clean_kw_list(kw_match.get("matched", []))
     missing = _clean_kw_list(kw_match.get("missing", []))
 
-    exp_rel      = _experience_relevance(job_desc, roles, resume_text)  # /15
-    quant        = _quant_stats(resume_text)                             # achievements
+    exp_rel      = _experience_relevance(job_desc, roles, parsed)  # /15
+    quant        = parsed.quant                             # achievements
     ach_score    = (5 if quant["pct_with_numbers"] >= 50 else int(5 * quant["pct_with_numbers"]/50)) \
                    + (3 if quant["pct_action_starts"] >= 70 else int(3 * quant["pct_action_starts"]/70))  # /8
-    edu_certs    = _education_and_certs(resume_text, jd_terms)           # /6
-    elig_loc     = _eligibility_location(resume_text)                    # /3
-    read_brief   = _readability_brevity(resume_text, level)              # /8
+    edu_certs    = _education_and_certs(parsed, jd_terms)           # /6
+    elig_loc     = _eligibility_location(parsed)                    # /3
+    read_brief   = _readability_brevity(parsed, level)              # /8
 
     # ---- Penalties ----
-    depth_pts, depth_reasons = _content_depth_penalty(resume_text, level)
-    pen_pts, pen_reasons = _penalties(resume_text, roles, hard_fail)
+    depth_pts, depth_reasons = _content_depth_penalty(parsed, level)
+    pen_pts, pen_reasons = _penalties(parsed, roles, hard_fail)
     pen_pts += depth_pts
     pen_reasons += depth_reasons
     if not sec_struct["std"]["experience"]:
@@ -1607,67 +1814,6 @@ def resume_analysis():
         cap = min(cap, 74)
     score = min(score, cap)
 
-    # ---- Optional LLM pass for qualitative commentary ----
-    llm = {
-        "analysis": {"issues": [], "strengths": []},
-        "suggestions": [],
-        "writing": {"readability": "", "repetition": [], "grammar": []},
-        "relevance": {"role": job_role, "score": 0, "explanation": "", "aligned_keywords": [], "missing_keywords": []},
-    }
-    
-    if current_app.config.get("OPENAI_CLIENT"):
-        try:
-            client = current_app.config["OPENAI_CLIENT"]
-            role_or_desc = (
-                f"Job description:\n{job_desc}"
-                if job_desc
-                else (f"Target role: {job_role}" if job_role else "No job description provided.")
-            )
-            prompt = f"""
-You are an ATS-certified resume analyst. Return ONLY valid JSON (no backticks) with:
-{{
-  "analysis": {{"issues": ["..."], "strengths": ["..."]}},
-  "suggestions": ["..."],
-  "writing": {{
-    "readability": "Grade level (e.g., Grade 8–10 / B2)",
-    "repetition": [{{"term":"managed","count":5,"alternatives":["led","owned","coordinated"]}}],
-    "grammar": ["Short, actionable fixes."]
-  }},
-  "relevance": {{
-    "role": "{job_role}",
-    "score": 0-100,
-    "explanation": "1–2 sentences",
-    "aligned_keywords": ["..."],
-    "missing_keywords": ["..."]
-  }}
-}}
-Context:
-{role_or_desc}
-
-Resume:
-{resume_text[:8000]}
-""".strip()
-    
-            resp = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0,
-            )
-            content = (resp.choices[0].message.content or "").strip()
-    
-            # (usage logging + JSON extraction)
-            content = re.sub(r"```(?:json)?", "", content)
-            s, e = content.find("{"), content.rfind("}")
-            if s >= 0 and e > s:
-                js = json.loads(content[s:e + 1])
-                for k, v in js.items():
-                    llm[k] = v
-    
-        except Exception:
-            current_app.logger.warning(
-                "LLM step skipped; continuing with deterministic output", exc_info=True
-            )
-        
     # ---- Map to your UI breakdown bars ----
     breakdown = {
         "formatting": int(round((pf_score/10)*100)),
@@ -1693,7 +1839,7 @@ Resume:
     all_hundred = all(v >= 100 for v in visible)
     headline = score if all_hundred else min(score, avg_visible)
 
-    # ----- Diagnostics (build BEFORE using) -----
+    # ----- Diagnostics -----
     diagnostics = {
         "achievements": quant,
         "eligibility_location": elig_loc,
@@ -1706,6 +1852,109 @@ Resume:
         "length_pages_est": read_brief["length_pages"]
     }
 
+    return {
+        "score": headline,
+        "raw_score": score,
+        "breakdown": breakdown,
+        "diagnostics": diagnostics,
+        "matched": matched,
+        "missing": missing,
+        "kw_match": kw_match,
+        "sec_struct": sec_struct,
+        "quant": quant,
+        "read_brief": read_brief,
+        "pf_score": pf_score,
+        "elig_loc": elig_loc,
+        "hard_fail": hard_fail,
+        "roles": roles,
+    }
+
+@resumes_bp.route("/api/resume-analysis", methods=["POST"])
+@api_login_required
+def resume_analysis():
+    supabase_admin = current_app.config["SUPABASE_ADMIN"]
+    plan = (getattr(current_user, "plan", "free") or "free").lower()
+
+    # NEW: device/user-scoped free-plan guard (no router IP)
+    ok, payload = allow_free_use(current_user.id, plan)
+    if not ok:
+        return jsonify({
+            "error": "too_many_free_accounts",
+            "message": payload.get("message") or "Free usage limit reached for this device."
+        }), 429
+
+    # FIX: align quota key with limits/UI: resume_analyzer
+    # Plan quota + hour/day call caps in one batched, all-or-nothing check
+    allowed, info = check_and_increment_many(
+        supabase_admin, current_user.id, plan,
+        ["resume_analyzer", "resume_analyzer_hour", "resume_analyzer_day"],
+    )
+    if not allowed and info.get("feature") != "resume_analyzer":
+        return jsonify(info), 429
+    if not allowed:
+        base = "https://www.jobcus.com"
+        anchor = "#employer-pricing" if plan == "employer_jd" else ""
+        PRICING_URL = f"{base}/pricing{anchor}"
+    
+        info.setdefault("error", "quota_exceeded")
+        info.setdefault("message", "You’ve reached your plan limit for this feature.")
+        info.setdefault(
+            "message_html",
+            f'You’ve reached your plan limit for this feature. <a href="{PRICING_URL}">Upgrade now →</a>'
+        )
+        info.setdefault("pricing_url", PRICING_URL)
+        return jsonify(info), 402
+
+    """
+    ATS scoring model (100 pts) + penalties, aligned to industry best practice.
+    Preserves your existing response shape for the dashboard.
+    """
+    client = current_app.config.get("OPENAI_CLIENT")
+
+    # ---- Decode input (multipart upload, or legacy base64 JSON) ----
+    try:
+        data, upload_kind, source = _resume_request()
+    except UploadRejected as e:
+        return jsonify(error=str(e)), e.status
+
+    resume_text, file_kind, raw_bytes = "", None, None
+    try:
+        if upload_kind:
+            resume_text = _raw_text_from_upload(upload_kind, source)
+            resume_text = _normalize_extracted_text(resume_text)  # normalize
+            raw_bytes = _upload_size(source)  # only the size is used for scoring
+            file_kind = upload_kind
+    
+        elif data.get("text"):
+            resume_text = (data["text"] or "").strip()
+            resume_text = _normalize_extracted_text(resume_text)  # normalize
+            file_kind = "text"
+    
+        else:
+            return jsonify(error="No resume data provided"), 400
+    
+    except Exception:
+        current_app.logger.exception("resume-analysis: decode failed")
+        return jsonify(error="Could not read the resume file"), 400
+    
+    if not (resume_text or "").strip():
+        return jsonify(error="Could not extract any text"), 400
+    
+    job_desc = (data.get("jobDescription") or "").strip()
+    job_role = (data.get("jobRole") or "").strip()
+    level    = (data.get("careerLevel") or "mid").lower()
+
+    # ---- Deterministic ATS categories (parsed once, shared by every scorer) ----
+    ats = _ats_score(ParsedResume(resume_text), file_kind, raw_bytes, job_desc, job_role, level)
+    headline, breakdown, diagnostics = ats["score"], ats["breakdown"], ats["diagnostics"]
+    matched, missing = ats["matched"], ats["missing"]
+    kw_match, kw_points = ats["kw_match"], ats["kw_match"]["score"]
+    sec_struct, quant, read_brief = ats["sec_struct"], ats["quant"], ats["read_brief"]
+    pf_score, elig_loc = ats["pf_score"], ats["elig_loc"]
+
+    # ---- Optional LLM pass for qualitative commentary ----
+    llm = _llm_commentary(client, resume_text, job_desc, job_role)
+
     # helper if you don't already have one
     def _is_acronym(s: str) -> bool:
         s = (s or "").strip()
@@ -1963,3 +2212,264 @@ Resume:
 
     return jsonify(out)
 
+
+# ---------- 4) Batch resume analysis (employers / power users) ----------
+#
+# POST /api/resume-analysis/batch   (multipart/form-data)
+#   files            many .pdf / .docx / .txt files and/or .zip archives of them
+#   jobDescription   the JD every CV is ranked against (terms extracted once)
+#   jobRole, careerLevel   same as /api/resume-analysis
+#   commentary=1     also run the LLM commentary pass per CV (off by default)
+#
+# Extraction + scoring is CPU work, so it runs in a process pool; results
+# stream back as NDJSON in completion order:
+#   {"type":"meta",...}  {"type":"result",...} / {"type":"error",...}  ...  {"type":"done","ranking":[...]}
+# The whole batch counts once against the plan's `resume_batch` quota.
+
+BATCH_WORKERS        = int(os.getenv("RESUME_BATCH_WORKERS", str(min(4, os.cpu_count() or 1))))
+BATCH_MAX_FILE_MB    = float(os.getenv("RESUME_BATCH_MAX_FILE_MB", "5"))
+BATCH_MAX_TOTAL_MB   = float(os.getenv("RESUME_BATCH_MAX_TOTAL_MB", "150"))
+BATCH_TIMEOUT        = int(os.getenv("RESUME_BATCH_TIMEOUT", "300"))   # seconds, whole batch
+BATCH_COMMENTARY_MAX = int(os.getenv("RESUME_BATCH_COMMENTARY_MAX", "25"))
+_BATCH_EXTS = {".pdf": "pdf", ".docx": "docx", ".txt": "text"}
+
+_batch_pool = None
+_batch_pool_pid = None
+_batch_pool_lock = threading.Lock()
+
+def _batch_executor(reset: bool = False):
+    """One scoring process pool per web worker, created on first use (and after a crash)."""
+    global _batch_pool, _batch_pool_pid
+    with _batch_pool_lock:
+        if reset and _batch_pool is not None:
+            _batch_pool.shutdown(wait=False, cancel_futures=True)
+            _batch_pool = None
+        if _batch_pool is None or _batch_pool_pid != os.getpid():
+            # spawn, not fork: the web worker has live threads and sockets
+            _batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS,
+                                              mp_context=multiprocessing.get_context("spawn"))
+            _batch_pool_pid = os.getpid()
+        return _batch_pool
+
+def _text_from_bytes(kind: str, raw: bytes) -> str:
+    return _normalize_extracted_text(doc_extract.extract(raw, kind=kind, ocr=False)["text"])
+
+def _batch_score_one(kind: str, raw: bytes, job_desc: str, job_role: str, level: str,
+                     jd_terms: dict | None, want_text: bool) -> dict:
+    """Runs in a pool process: extract one CV and score it. Plain dicts in, plain dict out."""
+    try:
+        text = _text_from_bytes(kind, raw)
+    except Exception as e:
+        return {"error": "unreadable", "message": f"Could not read the file ({type(e).__name__})"}
+    if not text.strip():
+        return {"error": "no_text", "message": "Could not extract any text"}
+
+    ats = _ats_score(ParsedResume(text), kind, raw, job_desc, job_role, level, jd_terms=jd_terms)
+    std = ats["sec_struct"]["std"]
+    out = {
+        "score": int(ats["score"]),
+        "breakdown": ats["breakdown"],
+        "keywords": {"matched": ats["matched"], "missing": ats["missing"]},
+        "sections": {
+            "present": [k for k, v in std.items() if v],
+            "missing": [k for k, v in std.items() if not v],
+        },
+        "penalties": ats["diagnostics"]["penalties"],
+    }
+    if want_text:
+        out["text"] = text[:8000]
+    return out
+
+def _batch_collect_files(max_files: int):
+    """
+    Every uploaded CV as (filename, kind, read) — zips are expanded, bytes are
+    only read when the file is handed to the pool. Returns (items, skipped);
+    raises ValueError when the batch as a whole is over the limits.
+    """
+    items, skipped = [], []
+    max_file = int(BATCH_MAX_FILE_MB * 1024 * 1024)
+    max_total = int(BATCH_MAX_TOTAL_MB * 1024 * 1024)
+    total = 0
+
+    def add(name, size, read):
+        nonlocal total
+        kind = _BATCH_EXTS.get(os.path.splitext(name.lower())[1])
+        if not kind:
+            skipped.append({"filename": name, "error": "unsupported_type",
+                            "message": "Only PDF, DOCX and TXT files are scored"})
+            return
+        if size > max_file:
+            skipped.append({"filename": name, "error": "too_large",
+                            "message": f"Files must be under {BATCH_MAX_FILE_MB:g} MB"})
+            return
+        total += size
+        if total > max_total:
+            raise ValueError(f"The batch is larger than {BATCH_MAX_TOTAL_MB:g} MB.")
+        items.append((name, kind, read))
+        if len(items) > max_files:
+            raise ValueError(f"Your plan allows up to {max_files} CVs per batch.")
+
+    for _field, fs in request.files.items(multi=True):
+        name = os.path.basename(fs.filename or "") or "upload"
+        if name.lower().endswith(".zip"):
+            try:
+                zf = zipfile.ZipFile(fs.stream)
+            except zipfile.BadZipFile:
+                raise ValueError(f"{name} is not a valid zip archive.")
+            for info in zf.infolist():
+                base = os.path.basename(info.filename)
+                if info.is_dir() or not base or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+                    continue
+                # ZipExtFile stops at the declared size, so file_size is a real cap
+                add(f"{name}/{info.filename}", info.file_size, functools.partial(zf.read, info))
+        else:
+            fs.stream.seek(0, os.SEEK_END)
+            size = fs.stream.tell()
+            fs.stream.seek(0)
+            add(name, size, fs.read)
+    return items, skipped
+
+def _ndjson(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+@resumes_bp.route("/api/resume-analysis/batch", methods=["POST"])
+@api_login_required
+def resume_analysis_batch():
+    supabase_admin = current_app.config["SUPABASE_ADMIN"]
+    plan = (getattr(current_user, "plan", "free") or "free").lower()
+
+    max_files = int(feature_enabled(plan, "resume_batch_max_files", 0) or 0)
+    if max_files <= 0:
+        pricing_url = "/pricing#employer-pricing"
+        return jsonify(
+            error="upgrade_required",
+            message="Batch CV ranking is available on the Employer, Standard and Premium plans.",
+            message_html=f'Batch CV ranking is available on the Employer, Standard and Premium plans. <a href="{pricing_url}">Upgrade now →</a>',
+            pricing_url=pricing_url
+        ), 403
+
+    job_desc  = (request.form.get("jobDescription") or "").strip()
+    job_role  = (request.form.get("jobRole") or "").strip()
+    level     = (request.form.get("careerLevel") or "mid").lower()
+    want_llm  = (request.form.get("commentary") or "").strip().lower() in ("1", "true", "yes", "on")
+
+    try:
+        items, skipped = _batch_collect_files(max_files)
+    except ValueError as e:
+        return jsonify(error="invalid_batch", message=str(e)), 400
+    except Exception:
+        current_app.logger.exception("resume-analysis/batch: reading upload failed")
+        return jsonify(error="invalid_batch", message="Could not read the uploaded files"), 400
+    if not items:
+        return jsonify(error="invalid_batch", message="No PDF, DOCX or TXT resumes found in the upload",
+                       skipped=skipped), 400
+    if want_llm and len(items) > BATCH_COMMENTARY_MAX:
+        return jsonify(error="invalid_batch",
+                       message=f"AI commentary is limited to {BATCH_COMMENTARY_MAX} CVs per batch; "
+                               "send commentary=0 to score larger batches."), 400
+
+    # one batch = one unit of quota, however many files are in it
+    allowed, info = check_and_increment(supabase_admin, current_user.id, plan, "resume_batch")
+    if not allowed:
+        PRICING_URL = "https://www.jobcus.com/pricing#employer-pricing"
+        info.setdefault("message", "You’ve reached your plan limit for batch analysis.")
+        info.setdefault(
+            "message_html",
+            f'You’ve reached your plan limit for batch analysis. <a href="{PRICING_URL}">Upgrade now →</a>'
+        )
+        info.setdefault("pricing_url", PRICING_URL)
+        return jsonify(info), 402
+
+    jd_terms = _build_jd_terms(job_desc) if job_desc else None
+    client = current_app.config.get("OPENAI_CLIENT") if want_llm else None
+
+    def _events():
+        yield _ndjson({"type": "meta", "count": len(items), "skipped": len(skipped),
+                       "jd_terms": len(jd_terms["all"]) if jd_terms else 0, "commentary": bool(client)})
+        for sk in skipped:
+            yield _ndjson({"type": "error", "index": None, **sk})
+
+        ranking, failed = [], len(skipped)
+        todo = iter(enumerate(items))
+        pending = {}   # future -> (stage, index, filename, result)
+        window = max(2, BATCH_WORKERS * 2)   # bound how many files sit in memory at once
+        deadline = time.monotonic() + BATCH_TIMEOUT
+        llm_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="batch-llm") if client else None
+        try:
+            pool = _batch_executor()
+            while True:
+                while sum(1 for p in pending.values() if p[0] == "score") < window:
+                    nxt = next(todo, None)
+                    if nxt is None:
+                        break
+                    idx, (name, kind, read) = nxt
+                    try:
+                        raw = read()
+                    except Exception:
+                        current_app.logger.warning("resume-analysis/batch: could not read %s", name, exc_info=True)
+                        failed += 1
+                        yield _ndjson({"type": "error", "index": idx, "filename": name,
+                                       "error": "unreadable", "message": "Could not read the file"})
+                        continue
+                    fut = pool.submit(_batch_score_one, kind, raw, job_desc, job_role, level, jd_terms, bool(client))
+                    pending[fut] = ("score", idx, name, None)
+
+                if not pending:
+                    break
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                done, _ = wait(list(pending), timeout=left, return_when=FIRST_COMPLETED)
+
+                for fut in done:
+                    stage, idx, name, res = pending.pop(fut)
+                    if stage == "score":
+                        try:
+                            res = fut.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception:
+                            current_app.logger.exception("resume-analysis/batch: scoring %s failed", name)
+                            res = {"error": "failed", "message": "Scoring failed"}
+                        if "error" in res:
+                            failed += 1
+                            yield _ndjson({"type": "error", "index": idx, "filename": name, **res})
+                            continue
+                        if llm_pool is not None:
+                            text = res.pop("text", "")
+                            pending[llm_pool.submit(_llm_commentary, client, text, job_desc, job_role)] = ("llm", idx, name, res)
+                            continue
+                    else:
+                        llm = fut.result()   # _llm_commentary never raises
+                        res["analysis"] = llm.get("analysis", {})
+                        res["relevance"] = llm.get("relevance", {})
+
+                    ranking.append({"index": idx, "filename": name, "score": res["score"]})
+                    yield _ndjson({"type": "result", "index": idx, "filename": name, **res})
+
+        except BrokenProcessPool:
+            current_app.logger.exception("resume-analysis/batch: process pool died")
+            _batch_executor(reset=True)
+        finally:
+            # also runs when the client disconnects mid-stream: drop queued work
+            for fut in pending:
+                fut.cancel()
+            if llm_pool is not None:
+                llm_pool.shutdown(wait=False, cancel_futures=True)
+
+        # anything still outstanding ran out of time (or lost its worker)
+        leftovers = [(idx, name) for _stage, idx, name, _res in pending.values()]
+        leftovers += [(idx, name) for idx, (name, _kind, _read) in todo]
+        for idx, name in sorted(leftovers):
+            failed += 1
+            yield _ndjson({"type": "error", "index": idx, "filename": name,
+                           "error": "timeout", "message": "Not scored before the batch deadline"})
+
+        ranking.sort(key=lambda r: (-r["score"], r["index"]))
+        yield _ndjson({"type": "done", "scored": len(ranking), "failed": failed, "ranking": ranking})
+
+    return Response(
+        stream_with_context(_events()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,229 @@
+# chat_context.py
+#
+# Builds the message list for a chat completion inside a token budget.
+#
+# The old builder kept `history[-6:]` whatever its size, and /api/ask glued up
+# to 8000 characters per attachment onto the user message, so prompts swung
+# from a few hundred to tens of thousands of tokens. build() packs, in this
+# order of priority:
+#
+#   1. the system prompts                                    (always; all but the
+#                                                             first are cut if they
+#                                                             crowd out the message)
+#   2. the user's message                                    (always; at least
+#                                                             MIN_USER_TOKENS of it)
+#   3. a summary of older turns, when the caller has one     (conversation_summary.py)
+#   4. attachment snippets, up to ATTACH_SHARE of what's left, split evenly
+#   5. history, newest turn first, each turn capped at TURN_MAX tokens;
+#      turns that no longer fit are dropped
+#
+# The budget is per plan ("chat_context_tokens" in limits.FEATURE_FLAGS) and
+# never more than the model's context window minus REPLY_RESERVE.
+# Tokens are counted with tiktoken when it's installed, else estimated.
+#
+#   CHAT_CONTEXT_TOKENS     budget when the plan has none   (default 6000)
+#   CHAT_REPLY_RESERVE      tokens kept free for the reply  (default 1500)
+#   CHAT_TURN_MAX           tokens per history turn         (default 800)
+#   CHAT_ATTACH_SHARE       budget share for attachments    (default 0.6)
+#   CHAT_MIN_USER_TOKENS    message tokens always kept      (default 512)
+
+import os, math, threading, functools, logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken  # optional: exact counts; without it we estimate
+except Exception:
+    tiktoken = None
+
+DEFAULT_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKENS", "6000"))
+REPLY_RESERVE = int(os.getenv("CHAT_REPLY_RESERVE", "1500"))
+TURN_MAX = int(os.getenv("CHAT_TURN_MAX", "800"))
+ATTACH_SHARE = float(os.getenv("CHAT_ATTACH_SHARE", "0.6"))
+MIN_USER_TOKENS = int(os.getenv("CHAT_MIN_USER_TOKENS", "512"))
+
+MSG_OVERHEAD = 4      # role + separators per message
+REPLY_PRIMING = 3     # every reply is primed with <|start|>assistant<|message|>
+
+# context windows; prefixes, longest match wins
+_CONTEXT_WINDOWS = {
+    "gpt-5": 400_000, "gpt-4.1": 1_000_000, "gpt-4o": 128_000, "gpt-4-turbo": 128_000,
+    "gpt-4": 8_192, "gpt-3.5-turbo": 16_385, "o1": 200_000, "o3": 200_000, "o4": 200_000,
+}
+
+_lock = threading.Lock()
+_stats = {"builds": 0, "prompt_tokens": 0, "max_prompt_tokens": 0, "turns_dropped": 0,
+          "turns_truncated": 0, "attachments_truncated": 0, "over_budget": 0}
+
+
+def context_window(model: str) -> int:
+    m = (model or "").lower()
+    best = max((p for p in _CONTEXT_WINDOWS if m.startswith(p)), key=len, default=None)
+    return _CONTEXT_WINDOWS[best] if best else 128_000
+
+
+@functools.lru_cache(maxsize=32)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # unknown/new model names: the 4o-family encoding is the best guess
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    if not text:
+        return 0
+    enc = _encoding(model or "gpt-4o-mini")
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    # ~4 chars per token for English; words * 1.3 catches short-word text
+    return max(math.ceil(len(text) / 4), math.ceil(len(text.split()) * 1.3))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini", marker: str = " …[truncated]") -> str:
+    """Head of `text` that fits in max_tokens (marker included)."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    room = max(0, max_tokens - count_tokens(marker, model))
+    enc = _encoding(model or "gpt-4o-mini")
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:room]) + marker
+    lo, hi = 0, len(text)   # estimate mode: binary search on characters
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid], model) <= room:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + marker
+
+
+def budget_for(plan: str | None, model: str) -> int:
+    from limits import feature_enabled
+    budget = feature_enabled(plan, "chat_context_tokens", DEFAULT_BUDGET) if plan else DEFAULT_BUDGET
+    return max(256, min(int(budget or DEFAULT_BUDGET), context_window(model) - REPLY_RESERVE))
+
+
+def _msg_tokens(content: str, model: str) -> int:
+    return count_tokens(content, model) + MSG_OVERHEAD
+
+
+def build(model: str, system_prompts: list[str], user_msg: str, history=None, attachments=None,
+          summary: str | None = None, plan: str | None = None, budget: int | None = None):
+    """
+    (messages, report). `history` is a list of {role, content}, oldest first,
+    without the current message. `attachments` is a list of (filename, text).
+    report = {prompt_tokens, budget, history_used, history_dropped,
+              attachment_tokens, summary_tokens, truncated}.
+    """
+    budget = budget or budget_for(plan, model)
+    report = {"budget": budget, "history_used": 0, "history_dropped": 0, "attachment_tokens": 0,
+              "summary_tokens": 0, "truncated": []}
+
+    msgs = [{"role": "system", "content": p} for p in system_prompts if p]
+    used = REPLY_PRIMING + sum(_msg_tokens(m["content"], model) for m in msgs)
+
+    # 2) the user's own words always go in. If the system prompts leave less
+    #    than MIN_USER_TOKENS for them, the extra system prompts (style guides,
+    #    not the main one) are cut first; past that the budget gives way.
+    user_tokens = _msg_tokens(user_msg, model)
+    need = min(user_tokens, MIN_USER_TOKENS + MSG_OVERHEAD)
+    for m in reversed(msgs[1:]):
+        over = used + need - budget
+        if over <= 0:
+            break
+        t = _msg_tokens(m["content"], model)
+        m["content"] = truncate_tokens(m["content"], t - over - MSG_OVERHEAD, model)
+        used += _msg_tokens(m["content"], model) - t if m["content"] else -t
+        report["truncated"].append("system")
+    msgs = [m for m in msgs if m["content"]]
+    if used + user_tokens > budget:
+        room = max(budget - used, need) - MSG_OVERHEAD
+        user_msg = truncate_tokens(user_msg, room, model)
+        user_tokens = _msg_tokens(user_msg, model)
+        report["truncated"].append("message")
+    used += user_tokens
+
+    # 3) summary of what's no longer in the window
+    summary_msg = None
+    if summary:
+        room = max(0, (budget - used) // 3)
+        text = truncate_tokens(f"Summary of the earlier conversation:\n{summary}", room - MSG_OVERHEAD, model)
+        if text:
+            summary_msg = {"role": "system", "content": text}
+            report["summary_tokens"] = _msg_tokens(text, model)
+            used += report["summary_tokens"]
+
+    # 4) attachments: a fixed share, split evenly, each cut at the head; what a
+    #    short one doesn't use goes to the longer ones
+    att_block = ""
+    atts = [(n, t) for n, t in (attachments or []) if t]
+    if atts:
+        room = int((budget - used) * ATTACH_SHARE)
+        snippets = {}
+        order = sorted(range(len(atts)), key=lambda i: count_tokens(atts[i][1], model))
+        for k, i in enumerate(order):
+            name, text = atts[i]
+            header = f"--- {name} ---\n"
+            each = room // (len(order) - k)
+            snippet = truncate_tokens(text, each - count_tokens(header, model), model)
+            if snippet != text:
+                report["truncated"].append(name)
+            if snippet:
+                snippets[i] = header + snippet
+                room -= count_tokens(snippets[i], model)
+        blocks = [snippets[i] for i in range(len(atts)) if i in snippets]
+        if blocks:
+            att_block = "\n\n[Attachment context]\n" + "\n\n".join(blocks)
+            report["attachment_tokens"] = count_tokens(att_block, model)
+            used += report["attachment_tokens"]
+
+    # 5) history, newest first
+    kept = []
+    turns = [m for m in (history or [])
+             if m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)]
+    for i, m in enumerate(reversed(turns)):
+        content = m["content"]
+        if _msg_tokens(content, model) > TURN_MAX:
+            content = truncate_tokens(content, TURN_MAX - MSG_OVERHEAD, model)
+            report["truncated"].append("history")
+        t = _msg_tokens(content, model)
+        if used + t > budget:
+            report["history_dropped"] = len(turns) - i
+            break
+        kept.append({"role": m["role"], "content": content})
+        used += t
+    kept.reverse()
+    report["history_used"] = len(kept)
+
+    if summary_msg:
+        msgs.append(summary_msg)
+    msgs.extend(kept)
+    msgs.append({"role": "user", "content": user_msg + att_block})
+    report["prompt_tokens"] = used
+
+    with _lock:
+        _stats["builds"] += 1
+        _stats["prompt_tokens"] += used
+        _stats["max_prompt_tokens"] = max(_stats["max_prompt_tokens"], used)
+        _stats["turns_dropped"] += report["history_dropped"]
+        _stats["turns_truncated"] += report["truncated"].count("history")
+        _stats["attachments_truncated"] += sum(1 for x in report["truncated"] if x not in ("history", "message", "system"))
+        _stats["over_budget"] += used > budget
+    return msgs, report
+
+
+def stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+    s["avg_prompt_tokens"] = round(s["prompt_tokens"] / s["builds"], 1) if s["builds"] else 0.0
+    s.update(tokenizer="tiktoken" if tiktoken is not None else "estimate", default_budget=DEFAULT_BUDGET)
+    return s
@@ -0,0 +1,358 @@
+# chat_writer.py
+#
+# Write-behind persistence for chat messages (conversation_messages).
+#
+# /api/ask used to wait for two blocking INSERTs per turn, one of them after
+# the model had already answered. Now the route hands the rows to this queue
+# and returns; a background thread writes whatever has queued up every
+# CHAT_WRITE_FLUSH seconds as one multi-row INSERT.
+#
+# Ordering: every row gets its created_at when it is queued, strictly
+# increasing per conversation, so a user message and its reply written in the
+# same INSERT still sort correctly. Rows are written in queue order, and a
+# failed batch holds back everything queued after it.
+#
+# Failures:
+#   * transient (network, 5xx, timeouts): the pending rows are appended to a
+#     spill file (CHAT_SPILL_DIR/chat_spill.<pid>.jsonl) and retried with
+#     backoff; the spill file is always drained before newer rows. Spill files
+#     left behind by a dead worker are picked up by the next one to flush.
+#   * permanent (the database rejects the row, e.g. its conversation was
+#     deleted): the batch is retried row by row and the bad rows are dropped
+#     and logged, so one row can't wedge the queue.
+# Rows still in memory are flushed at exit; only a hard kill loses them.
+#
+# pending_for() shows a conversation's rows until they are in the database:
+# queued, being written, or waiting in a spill file during an outage.
+#
+#   CHAT_WRITE_FLUSH         seconds between flushes            (default 0.25)
+#   CHAT_WRITE_BATCH         rows per INSERT                    (default 200)
+#   CHAT_WRITE_MAX_BACKOFF   longest wait between retries, s    (default 60)
+#   CHAT_SPILL_DIR           (default: <tmp>/jobcus_chat_spill)
+#   CHAT_WRITE_SYNC=1        write inline instead (debugging)
+
+import os, glob, json, time, atexit, tempfile, threading, logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITE_FLUSH = float(os.getenv("CHAT_WRITE_FLUSH", "0.25"))
+CHAT_WRITE_BATCH = int(os.getenv("CHAT_WRITE_BATCH", "200"))
+CHAT_WRITE_MAX_BACKOFF = float(os.getenv("CHAT_WRITE_MAX_BACKOFF", "60"))
+CHAT_SPILL_DIR = os.getenv("CHAT_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "jobcus_chat_spill")
+CHAT_WRITE_SYNC = os.getenv("CHAT_WRITE_SYNC", "0") in ("1", "true", "yes")
+
+TABLE = "conversation_messages"
+
+
+def _is_permanent(exc: Exception) -> bool:
+    """Postgres rejected the data itself (SQLSTATE class 22/23/42), retrying won't help."""
+    code = getattr(exc, "code", None)
+    return isinstance(code, str) and code[:2] in ("22", "23", "42")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True   # exists, just not ours to signal
+    return True
+
+
+class ChatWriter:
+    def __init__(self, flush_every: float = CHAT_WRITE_FLUSH, batch: int = CHAT_WRITE_BATCH,
+                 spill_dir: str = CHAT_SPILL_DIR):
+        self.flush_every = flush_every
+        self.batch = batch
+        self.spill_dir = spill_dir
+        self._client = None
+        self._queue: deque = deque()
+        self._last_ts: dict[str, datetime] = {}   # conversation -> last created_at handed out
+        # rows off the queue but not confirmed written (in flight or spilled): conversation -> {row key: row}
+        self._unwritten: dict[str, dict[tuple, dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()        # one flush at a time (thread / atexit)
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._pid = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._stats = {"queued": 0, "written": 0, "batches": 0, "spilled": 0, "respilled": 0,
+                       "dropped": 0, "errors": 0, "flush_ms": 0.0}
+        atexit.register(self.close)
+
+    def _bump(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    # ---------- producer side ----------
+
+    def _stamp(self, conv_id: str) -> str:
+        # caller holds self._lock
+        now = datetime.now(timezone.utc)
+        last = self._last_ts.get(conv_id)
+        if last is not None and now <= last:
+            now = last + timedelta(microseconds=1)
+        self._last_ts[conv_id] = now
+        if len(self._last_ts) > 10000:   # only the recent ones matter for ordering
+            for k in list(self._last_ts)[:5000]:
+                del self._last_ts[k]
+        return now.isoformat()
+
+    def enqueue(self, client, conversation_id, role: str, content: str) -> dict:
+        """Queue one message row for writing; returns the row (with its created_at)."""
+        cid = str(conversation_id)
+        with self._lock:
+            row = {"conversation_id": cid, "role": role, "content": content,
+                   "created_at": self._stamp(cid)}
+            self._client = client
+            if not CHAT_WRITE_SYNC:
+                self._queue.append(row)
+            self._stats["queued"] += 1
+        if CHAT_WRITE_SYNC:
+            client.table(TABLE).insert(row).execute()
+            self._bump("written")
+            return row
+        self._ensure_thread()
+        self._wake.set()
+        return row
+
+    @staticmethod
+    def _row_key(r) -> tuple:
+        return r["conversation_id"], r["created_at"], r["role"]
+
+    def _hold(self, rows):
+        with self._lock:
+            for r in rows:
+                self._unwritten.setdefault(r["conversation_id"], {})[self._row_key(r)] = r
+
+    def _release(self, rows):
+        with self._lock:
+            for r in rows:
+                held = self._unwritten.get(r["conversation_id"])
+                if held is not None:
+                    held.pop(self._row_key(r), None)
+                    if not held:
+                        del self._unwritten[r["conversation_id"]]
+
+    def pending_for(self, conversation_id) -> list[dict]:
+        """
+        Rows of a conversation not in the database yet, oldest first: queued,
+        being written or spilled (so a reload right after a reply, or during
+        an outage, still shows them).
+        """
+        cid = str(conversation_id)
+        with self._lock:
+            rows = {self._row_key(r): r for r in self._unwritten.get(cid, {}).values()}
+            rows.update((self._row_key(r), r) for r in self._queue if r["conversation_id"] == cid)
+        return [dict(r) for r in sorted(rows.values(), key=lambda r: r["created_at"])]
+
+    def discard(self, conversation_id) -> int:
+        """Forget queued rows of a conversation that is being deleted."""
+        cid = str(conversation_id)
+        with self._lock:
+            keep = deque(r for r in self._queue if r["conversation_id"] != cid)
+            n = len(self._queue) - len(keep)
+            self._queue = keep
+            self._last_ts.pop(cid, None)
+            self._unwritten.pop(cid, None)
+        return n
+
+    # ---------- background thread ----------
+
+    def _ensure_thread(self):
+        # started lazily so it lives in the gunicorn worker, not the master
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid is not None and self._pid != os.getpid():
+                self._queue.clear()   # forked child: those rows belong to the parent
+                self._unwritten.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="chat-writer", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(timeout=max(self.flush_every, 1.0))
+            time.sleep(self.flush_every)   # let the rest of this turn (and others) join the batch
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("chat writer: flush failed")
+
+    # ---------- flushing ----------
+
+    def _spill_path(self, pid=None) -> str:
+        return os.path.join(self.spill_dir, f"chat_spill.{pid or os.getpid()}.jsonl")
+
+    def _spill_files(self) -> list[str]:
+        """
+        Spill files to drain, oldest first: files left by dead workers (claimed
+        by renaming them to our pid, so only one worker replays them), then ours.
+        """
+        me = os.getpid()
+        own = self._spill_path()
+        for p in glob.glob(os.path.join(self.spill_dir, "chat_spill.*.jsonl")):
+            try:
+                pid = int(os.path.basename(p).split(".")[1])
+            except (IndexError, ValueError):
+                continue
+            if pid != me and not _pid_alive(pid):
+                try:
+                    os.rename(p, os.path.join(self.spill_dir, f"chat_spill.{me}.from{pid}-{time.time_ns()}.jsonl"))
+                except FileNotFoundError:
+                    pass   # another worker claimed it first
+        adopted = glob.glob(os.path.join(self.spill_dir, f"chat_spill.{me}.from*.jsonl"))
+        adopted.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        return adopted + ([own] if os.path.exists(own) else [])
+
+    def _spill(self, rows: list[dict]):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with open(self._spill_path(), "a", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write(self, rows: list[dict]):
+        """Insert rows in order; permanent rejections are dropped row by row. Raises on transient errors."""
+        for i in range(0, len(rows), self.batch):
+            chunk = rows[i:i + self.batch]
+            try:
+                self._client.table(TABLE).insert(chunk).execute()
+                self._release(chunk)
+                self._bump("written", len(chunk))
+                self._bump("batches")
+            except Exception as e:
+                if not _is_permanent(e):
+                    raise _Transient(i) from e
+                for j, r in enumerate(chunk):
+                    try:
+                        self._client.table(TABLE).insert(r).execute()
+                        self._release([r])
+                        self._bump("written")
+                    except Exception as e1:
+                        if not _is_permanent(e1):
+                            raise _Transient(i + j) from e1
+                        self._release([r])
+                        logger.error("chat writer: dropping message for conversation %s: %s",
+                                     r.get("conversation_id"), e1)
+                        self._bump("dropped")
+
+    def flush(self) -> int:
+        """Write spilled rows, then queued rows. Returns rows written."""
+        if self._client is None or not self._flush_lock.acquire(blocking=False):
+            return 0
+        t0 = time.monotonic()
+        before = self._stats["written"]
+        try:
+            with self._lock:
+                rows = list(self._queue)
+                self._queue.clear()
+            self._hold(rows)   # still visible to pending_for until written
+
+            if time.time() < self._retry_at:
+                if rows:
+                    self._spill(rows)   # keep their place behind the rows already waiting
+                    self._bump("spilled", len(rows))
+                return 0
+
+            # 1) older rows first
+            for path in self._spill_files():
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        spilled = [json.loads(ln) for ln in f if ln.strip()]
+                except FileNotFoundError:
+                    continue
+                self._hold(spilled)   # incl. rows adopted from a dead worker's file
+                try:
+                    self._write(spilled)
+                except _Transient as t:
+                    self._backoff(t.__cause__)
+                    rest = spilled[t.index:]
+                    self._rewrite(path, rest)   # keep the unwritten tail where it was
+                    if rows:
+                        self._spill(rows)
+                        self._bump("spilled", len(rows))
+                    self._bump("respilled", len(rest))
+                    return self._stats["written"] - before
+                os.remove(path)
+
+            # 2) then what queued up since the last flush
+            if rows:
+                try:
+                    self._write(rows)
+                except _Transient as t:
+                    self._backoff(t.__cause__)
+                    self._spill(rows[t.index:])
+                    self._bump("spilled", len(rows) - t.index)
+                    return self._stats["written"] - before
+            self._failures, self._retry_at = 0, 0.0
+            return self._stats["written"] - before
+        finally:
+            self._bump("flush_ms", (time.monotonic() - t0) * 1000)
+            self._flush_lock.release()
+
+    def _rewrite(self, path, rows):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for r in rows:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        os.replace(tmp, path)
+
+    def _backoff(self, exc):
+        self._failures += 1
+        delay = min(CHAT_WRITE_MAX_BACKOFF, 2 ** min(self._failures, 10))
+        self._retry_at = time.time() + delay
+        self._bump("errors")
+        logger.warning("chat writer: write failed (%s); retrying in %.0fs", exc, delay)
+
+    def close(self):
+        """Last flush at exit; whatever can't be written goes to the spill file."""
+        try:
+            self._retry_at = 0.0
+            self.flush()
+        except Exception:
+            logger.exception("chat writer: final flush failed")
+        with self._lock:
+            rows = list(self._queue)
+            self._queue.clear()
+        if rows:
+            try:
+                self._spill(rows)
+            except Exception:
+                logger.exception("chat writer: could not spill %d message(s) at exit", len(rows))
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["pending"] = len(self._queue)
+            s["unwritten"] = sum(len(v) for v in self._unwritten.values())
+        spilled = 0
+        for p in glob.glob(os.path.join(self.spill_dir, "chat_spill.*.jsonl")):
+            try:
+                with open(p, "rb") as f:
+                    spilled += sum(1 for _ in f)
+            except OSError:
+                pass
+        s.update(spill_pending=spilled, failures=self._failures, sync=CHAT_WRITE_SYNC,
+                 flush_every=self.flush_every)
+        return s
+
+
+class _Transient(Exception):
+    """A write failed in a way worth retrying; `index` is the first row not written."""
+
+    def __init__(self, index: int):
+        super().__init__(index)
+        self.index = index
+
+
+chat_writer = ChatWriter()
@@ -0,0 +1,241 @@
+# conversation_cache.py
+#
+# The recent-message window of each conversation, for /api/ask, so a chat
+# turn doesn't re-read what it has just written.
+#
+# Before, every turn did four sequential Supabase calls:
+#   select conversations (ownership) → insert user message →
+#   select last 8 messages → insert assistant message
+# Now ownership and the window are cached per (conversation, owner) and
+# updated in place as messages are written; the database is only read on a
+# miss, so a warm turn is just the writes.
+#
+# Where the window lives:
+#   * REDIS_URL set (shared_store.py): in the shared store, so whichever worker
+#     serves the next turn sees this one. The window is a Redis list appended
+#     with RPUSH + LTRIM in one MULTI, so two turns served by different
+#     workers at once can't drop each other's message. A window read from the
+#     database only seeds the cache if nobody else has (WATCH on the marker),
+#     so it never overwrites appends made in the meantime.
+#   * a single worker (WEB_CONCURRENCY=1), or CONV_CACHE=local: in-process LRU
+#   * otherwise only ownership is cached, for CONV_CACHE_OWNER_TTL seconds (a
+#     delete on another worker isn't seen here, so it's re-checked often); the
+#     window is still read from the database, because another worker may have
+#     served the previous turn
+#
+#   CONV_CACHE          auto | local | off                  (default auto)
+#   CONV_CACHE_MAX      conversations kept per worker       (default 2000)
+#   CONV_CACHE_TTL      seconds an idle conversation stays  (default 1800)
+#   CONV_CACHE_WINDOW   messages kept per conversation      (default 8)
+#   CONV_CACHE_OWNER_TTL  seconds ownership-only entries live (default 60)
+
+import os, json, time, threading, logging
+from collections import OrderedDict
+
+from shared_store import get_shared_store
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:  # no redis-py means no shared store either
+    class WatchError(Exception):
+        pass
+
+logger = logging.getLogger(__name__)
+
+CONV_CACHE = os.getenv("CONV_CACHE", "auto").strip().lower()
+CONV_CACHE_MAX = int(os.getenv("CONV_CACHE_MAX", "2000"))
+CONV_CACHE_TTL = int(os.getenv("CONV_CACHE_TTL", "1800"))
+CONV_CACHE_WINDOW = int(os.getenv("CONV_CACHE_WINDOW", "8"))
+CONV_CACHE_OWNER_TTL = int(os.getenv("CONV_CACHE_OWNER_TTL", "60"))
+
+# same default as gunicorn.conf.py
+_SINGLE_WORKER = int(os.getenv("WEB_CONCURRENCY", os.getenv("GUNICORN_WORKERS", "2"))) == 1
+
+
+class ConversationCache:
+    def __init__(self, maxsize: int = CONV_CACHE_MAX, ttl: float = CONV_CACHE_TTL,
+                 window: int = CONV_CACHE_WINDOW, mode: str = CONV_CACHE,
+                 owner_ttl: float = CONV_CACHE_OWNER_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.owner_ttl = owner_ttl
+        self.window = window
+        self.mode = mode
+        # (conv_id, owner) -> [expires_at, window list or None (ownership only)]
+        self._data: "OrderedDict[tuple[str, str], list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "window_hits": 0, "misses": 0, "appends": 0,
+                      "evictions": 0, "shared_errors": 0}
+
+    def _bump(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def _shared(self):
+        return get_shared_store() if self.mode == "auto" else None
+
+    def _local_window(self) -> bool:
+        """May this worker keep windows in memory (nobody else writes to them)?"""
+        return self.mode == "local" or (self.mode == "auto" and _SINGLE_WORKER)
+
+    @staticmethod
+    def _key(conv_id, owner) -> tuple[str, str]:
+        return str(conv_id), str(owner)
+
+    @staticmethod
+    def _shared_keys(key) -> tuple[str, str]:
+        # (marker: "the window below is complete", the window as a list of JSON messages)
+        return f"conv:own:{key[0]}:{key[1]}", f"conv:win:{key[0]}:{key[1]}"
+
+    def _trim(self, history) -> list[dict]:
+        return [{"role": m.get("role"), "content": m.get("content")} for m in history][-self.window:]
+
+    # ---------- reading ----------
+
+    def lookup(self, conv_id, owner) -> tuple[bool, list[dict] | None]:
+        """
+        (known_owned, window). known_owned=False means "ask the database";
+        window is None when it isn't cached (read it from the database).
+        """
+        if self.mode == "off" or not conv_id or not owner:
+            return False, None
+        key = self._key(conv_id, owner)
+
+        store = self._shared()
+        if store is not None:
+            own_key, win_key = self._shared_keys(key)
+            try:
+                pipe = store.pipeline(transaction=True)
+                pipe.exists(own_key)
+                pipe.lrange(win_key, 0, -1)
+                owned, items = pipe.execute()
+            except Exception:
+                logger.warning("conversation cache: shared read failed", exc_info=True)
+                self._bump("shared_errors")
+                owned, items = 0, []
+            if not owned:
+                self._bump("misses")
+                return False, None
+            self._bump("window_hits")
+            return True, [json.loads(x) for x in items]
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.time():
+                self._data.pop(key, None)
+                self.stats["misses"] += 1
+                return False, None
+            if item[1] is not None:
+                item[0] = time.time() + self.ttl   # ownership-only entries don't slide: re-checked every owner_ttl
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            if item[1] is not None:
+                self.stats["window_hits"] += 1
+                return True, list(item[1])
+            return True, None
+
+    # ---------- writing ----------
+
+    def remember(self, conv_id, owner, history: list[dict] | None = None):
+        """
+        Record that `owner` owns the conversation, and its window if we have it
+        (read from the database). In the shared store an existing window wins:
+        it has every append since it was seeded, so add to it with append().
+        """
+        if self.mode == "off" or not conv_id or not owner:
+            return
+        key = self._key(conv_id, owner)
+        window = self._trim(history) if history is not None else None
+
+        store = self._shared()
+        if store is not None:
+            # everything lives in the shared store, so a delete on one worker is seen by all
+            if window is not None:
+                own_key, win_key = self._shared_keys(key)
+                try:
+                    with store.pipeline(transaction=True) as pipe:
+                        # an append (or another seed) between here and EXEC aborts this one
+                        pipe.watch(own_key, win_key)
+                        if pipe.exists(own_key):
+                            return
+                        pipe.multi()
+                        pipe.delete(win_key)   # stray appends made while nothing was seeded
+                        if window:
+                            pipe.rpush(win_key, *[json.dumps(m) for m in window])
+                            pipe.expire(win_key, int(self.ttl))
+                        pipe.set(own_key, 1, ex=int(self.ttl))
+                        pipe.execute()
+                except WatchError:
+                    pass   # someone else seeded or appended first; theirs is newer
+                except Exception:
+                    logger.warning("conversation cache: shared write failed", exc_info=True)
+                    self._bump("shared_errors")
+                    self.forget(conv_id, owner)
+            return
+
+        keep_window = self._local_window()
+        with self._lock:
+            ttl = self.ttl if keep_window else self.owner_ttl
+            self._data[key] = [time.time() + ttl, window if keep_window else None]
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def append(self, conv_id, owner, role: str, content: str):
+        """Add a message that was just written to the database to the cached window (if any)."""
+        if self.mode == "off" or not conv_id or not owner:
+            return
+        key = self._key(conv_id, owner)
+        msg = {"role": role, "content": content}
+
+        store = self._shared()
+        if store is not None:
+            own_key, win_key = self._shared_keys(key)
+            try:
+                # one MULTI: concurrent appends from other workers are never lost
+                pipe = store.pipeline(transaction=True)
+                pipe.rpush(win_key, json.dumps(msg))
+                pipe.ltrim(win_key, -self.window, -1)
+                pipe.expire(win_key, int(self.ttl))
+                pipe.expire(own_key, int(self.ttl))
+                pipe.execute()
+                self._bump("appends")
+            except Exception:
+                # a half-applied append would leave a wrong window: drop it instead
+                logger.warning("conversation cache: shared append failed", exc_info=True)
+                self._bump("shared_errors")
+                self.forget(conv_id, owner)
+            return
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] is not None:
+                item[1] = (item[1] + [msg])[-self.window:]
+                item[0] = time.time() + self.ttl
+                self.stats["appends"] += 1
+
+    def forget(self, conv_id, owner=None):
+        """Drop a conversation (deleted, or its window can no longer be trusted)."""
+        cid = str(conv_id)
+        with self._lock:
+            for key in [k for k in self._data if k[0] == cid and (owner is None or k[1] == str(owner))]:
+                del self._data[key]
+        store = self._shared()
+        if store is not None and owner is not None:
+            try:
+                store.delete(*self._shared_keys(self._key(conv_id, owner)))
+            except Exception:
+                logger.warning("conversation cache: shared delete failed", exc_info=True)
+                self._bump("shared_errors")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            s = {**self.stats, "size": len(self._data)}
+        store = self._shared()
+        s.update(maxsize=self.maxsize, ttl=self.ttl, owner_ttl=self.owner_ttl, window=self.window, mode=self.mode,
+                 where=("shared" if store is not None else "local" if self._local_window() else "ownership-only"))
+        return s
+
+
+conversation_cache = ConversationCache()
@@ -0,0 +1,276 @@
+# conversation_summary.py
+#
+# Rolling summaries for long chats.
+#
+# /api/ask only sends the last few messages to the model (see chat_context.py),
+# so a long conversation forgets how it started. This keeps a short summary of
+# everything older than that window on the conversation row, and /api/ask
+# sends it in place of the dropped turns: the prompt stays the same size
+# however long the conversation gets.
+#
+# The summary is brought up to date in the background, every
+# CHAT_SUMMARY_EVERY replies (per worker): the messages that have left the
+# window since the last update are folded into the old summary with one cheap
+# model call. The turn itself never waits for it.
+#
+# Needs two columns (run once in the Supabase SQL editor):
+#
+#   alter table conversations
+#     add column if not exists summary text,
+#     add column if not exists summary_upto timestamptz;  -- last message folded in
+#
+# Without them summaries are switched off (logged once) and chat works as before.
+#
+#   CHAT_SUMMARY          1/0                                   (default 1)
+#   CHAT_SUMMARY_EVERY    replies between updates               (default 4)
+#   CHAT_SUMMARY_WINDOW   messages kept verbatim, not folded    (default 8, as /api/ask)
+#   CHAT_SUMMARY_TOKENS   target summary length                 (default 300)
+#   CHAT_SUMMARY_WORKERS  background threads per worker         (default 2)
+#   CHAT_SUMMARY_TTL      seconds a summary is cached           (default 1800)
+#   CHAT_SUMMARY_MODEL    (app.py) model that writes them       (default gpt-4o-mini)
+
+import os, json, time, threading, logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import chat_context
+from chat_writer import chat_writer
+from shared_store import get_shared_store
+
+logger = logging.getLogger(__name__)
+
+CHAT_SUMMARY = os.getenv("CHAT_SUMMARY", "1") not in ("0", "false", "no")
+CHAT_SUMMARY_EVERY = int(os.getenv("CHAT_SUMMARY_EVERY", "4"))
+CHAT_SUMMARY_WINDOW = int(os.getenv("CHAT_SUMMARY_WINDOW", "8"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+CHAT_SUMMARY_WORKERS = int(os.getenv("CHAT_SUMMARY_WORKERS", "2"))
+CHAT_SUMMARY_TTL = int(os.getenv("CHAT_SUMMARY_TTL", "1800"))
+
+_FOLD_MAX = 200          # messages folded per update
+_FOLD_MSG_TOKENS = 400   # each one cut to this before it goes to the model
+_CACHE_MAX = 2000
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a career-coaching chat between a user and an assistant. "
+    "Update the summary with the new messages. Keep what matters for the rest of the conversation: "
+    "the user's goals, background, roles and companies discussed, decisions, advice already given and open questions. "
+    "Drop small talk. Plain prose or short bullets, at most {words} words. Reply with the summary only."
+)
+
+
+class ConversationSummaries:
+    def __init__(self, every: int = CHAT_SUMMARY_EVERY, window: int = CHAT_SUMMARY_WINDOW,
+                 target_tokens: int = CHAT_SUMMARY_TOKENS, enabled: bool = CHAT_SUMMARY):
+        self.every = max(1, every)
+        self.window = window
+        self.target_tokens = target_tokens
+        self.enabled = enabled
+        self._cache: "OrderedDict[str, tuple[float, str]]" = OrderedDict()   # conv -> (expires, summary)
+        self._turns: dict[str, int] = {}
+        self._inflight: set[str] = set()
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self.stats = {"updates": 0, "skipped": 0, "errors": 0, "messages_folded": 0,
+                      "summary_tokens": 0, "update_ms": 0.0, "cache_hits": 0, "cache_misses": 0}
+
+    def _bump(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def _disable(self, exc):
+        if self.enabled:
+            self.enabled = False
+            logger.warning("conversation summaries switched off (conversations.summary / summary_upto missing): %s", exc)
+
+    @staticmethod
+    def _missing_column(exc) -> bool:
+        # Postgres undefined_column, or PostgREST not knowing the column
+        code = str(getattr(exc, "code", "") or "")
+        return code in ("42703", "PGRST204") or "42703" in str(exc) or "PGRST204" in str(exc)
+
+    def _read_failed(self, exc, what: str):
+        """Only a missing column switches summaries off; anything else is a blip."""
+        if self._missing_column(exc):
+            self._disable(exc)
+        else:
+            self._bump("errors")
+            logger.warning("conversation summary: %s failed: %s", what, exc)
+
+    # ---------- cached summary ----------
+
+    def _cache_put(self, conv_id: str, summary: str):
+        with self._lock:
+            self._cache[conv_id] = (time.time() + CHAT_SUMMARY_TTL, summary)
+            self._cache.move_to_end(conv_id)
+            while len(self._cache) > _CACHE_MAX:
+                self._cache.popitem(last=False)
+        store = get_shared_store()
+        if store is not None:
+            try:
+                store.set(f"conv:sum:{conv_id}", json.dumps(summary), ex=CHAT_SUMMARY_TTL)
+            except Exception:
+                logger.warning("conversation summary: shared write failed", exc_info=True)
+
+    def get(self, client, conv_id) -> str:
+        """The conversation's summary ('' if it has none yet); cached, read from the row on a miss."""
+        if not self.enabled or not conv_id:
+            return ""
+        cid = str(conv_id)
+        store = get_shared_store()
+        if store is not None:
+            try:
+                raw = store.get(f"conv:sum:{cid}")
+                if raw is not None:
+                    self._bump("cache_hits")
+                    return json.loads(raw)
+            except Exception:
+                logger.warning("conversation summary: shared read failed", exc_info=True)
+        else:
+            with self._lock:
+                item = self._cache.get(cid)
+                if item is not None and item[0] > time.time():
+                    self.stats["cache_hits"] += 1
+                    return item[1]
+        self._bump("cache_misses")
+        try:
+            rows = client.table("conversations").select("summary").eq("id", cid).limit(1).execute().data or []
+        except Exception as e:
+            self._read_failed(e, "read")
+            return ""
+        summary = (rows[0].get("summary") if rows else "") or ""
+        self._cache_put(cid, summary)
+        return summary
+
+    def remember(self, conv_id, summary: str = ""):
+        """A conversation we know the summary of (e.g. one just created: none)."""
+        if self.enabled and conv_id:
+            self._cache_put(str(conv_id), summary)
+
+    def forget(self, conv_id):
+        cid = str(conv_id)
+        with self._lock:
+            self._cache.pop(cid, None)
+            self._turns.pop(cid, None)
+        store = get_shared_store()
+        if store is not None:
+            try:
+                store.delete(f"conv:sum:{cid}")
+            except Exception:
+                logger.warning("conversation summary: shared delete failed", exc_info=True)
+
+    # ---------- background updates ----------
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # per process: a pool inherited through fork has no threads behind it
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=CHAT_SUMMARY_WORKERS,
+                                                    thread_name_prefix="chat-summary")
+                    self._pool_pid = os.getpid()
+                    self._inflight = set()
+        return self._pool
+
+    def note_turn(self, client, conv_id, complete) -> bool:
+        """
+        Count a finished reply; every `every` replies schedule an update.
+        `complete(messages) -> str` runs the model. Returns True if scheduled.
+        """
+        if not self.enabled or not conv_id:
+            return False
+        cid = str(conv_id)
+        with self._lock:
+            n = self._turns.get(cid, 0) + 1
+            self._turns[cid] = n
+            if len(self._turns) > 10 * _CACHE_MAX:
+                for k in list(self._turns)[:5 * _CACHE_MAX]:
+                    del self._turns[k]
+            if n % self.every or cid in self._inflight:
+                return False
+        pool = self._executor()
+        with self._lock:
+            self._inflight.add(cid)
+        pool.submit(self._run, client, cid, complete)
+        return True
+
+    def _run(self, client, cid, complete):
+        try:
+            self.update(client, cid, complete)
+        except Exception:
+            self._bump("errors")
+            logger.exception("conversation summary: update failed for %s", cid)
+        finally:
+            with self._lock:
+                self._inflight.discard(cid)
+
+    def update(self, client, conv_id, complete) -> bool:
+        """Fold the messages that left the window into the summary. True if the row was updated."""
+        if not self.enabled:
+            return False
+        cid = str(conv_id)
+        t0 = time.monotonic()
+        try:
+            row = (client.table("conversations").select("summary,summary_upto")
+                   .eq("id", cid).limit(1).execute().data or [])
+        except Exception as e:
+            self._read_failed(e, "update read")
+            return False
+        if not row:
+            return False
+        old, upto = row[0].get("summary") or "", row[0].get("summary_upto")
+
+        q = client.table("conversation_messages").select("role,content,created_at").eq("conversation_id", cid)
+        if upto:
+            q = q.gt("created_at", upto)
+        msgs = q.order("created_at").limit(_FOLD_MAX + self.window).execute().data or []
+
+        # rows this worker hasn't written yet are the newest; they count towards the window
+        keep = max(0, self.window - len(chat_writer.pending_for(cid)))
+        fold = msgs[:max(0, len(msgs) - keep)][:_FOLD_MAX]
+        if len(fold) < self.every:
+            self._bump("skipped")
+            return False
+
+        summary = self._summarize(old, fold, complete)
+        if not summary:
+            self._bump("skipped")
+            return False
+
+        # only if nobody else moved it on meanwhile (another worker, same conversation)
+        u = client.table("conversations").update({"summary": summary, "summary_upto": fold[-1]["created_at"]}).eq("id", cid)
+        u = u.eq("summary_upto", upto) if upto else u.is_("summary_upto", "null")
+        if not (u.execute().data or []):
+            self._bump("skipped")
+            self.forget(cid)   # re-read the winner's summary next turn
+            return False
+
+        self._cache_put(cid, summary)
+        self._bump("updates")
+        self._bump("messages_folded", len(fold))
+        self._bump("summary_tokens", chat_context.count_tokens(summary))
+        self._bump("update_ms", (time.monotonic() - t0) * 1000)
+        return True
+
+    def _summarize(self, old: str, fold: list[dict], complete) -> str:
+        lines = []
+        for m in fold:
+            text = chat_context.truncate_tokens(m.get("content") or "", _FOLD_MSG_TOKENS)
+            lines.append(f"{(m.get('role') or 'user').upper()}: {text}")
+        prompt = (f"Current summary:\n{old or '(none yet)'}\n\nNew messages:\n" + "\n\n".join(lines))
+        msgs = [{"role": "system", "content": SUMMARY_PROMPT.format(words=int(self.target_tokens * 0.75))},
+                {"role": "user", "content": prompt}]
+        summary = (complete(msgs) or "").strip()
+        # a runaway reply shouldn't undo the point of having a summary
+        return chat_context.truncate_tokens(summary, self.target_tokens * 2)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            s = {**self.stats, "cached": len(self._cache), "inflight": len(self._inflight)}
+        s["update_ms"] = round(s["update_ms"], 1)
+        s["avg_summary_tokens"] = round(s["summary_tokens"] / s["updates"], 1) if s["updates"] else 0.0
+        s.update(enabled=self.enabled, every=self.every, window=self.window)
+        return s
+
+
+conversation_summaries = ConversationSummaries()
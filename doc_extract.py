@@ -0,0 +1,337 @@
+# doc_extract.py
+#
+# The one place uploaded documents are turned into text. /api/upload, the
+# resume analyser / optimiser and the batch analyser all go through
+# extract(), so a fix or speed-up here lands everywhere.
+#
+#   1. size check before anything is parsed
+#   2. format from the magic bytes (the filename is only a hint: a PDF saved
+#      as "cv.docx" is still read as a PDF)
+#   3. PDFs are read page by page, only up to DOC_MAX_PAGES, and reading stops
+#      once `max_chars` of text has been collected
+#   4. only pages without a text layer go to OCR (ocr_pool); a mixed PDF no
+#      longer gets OCR'd end to end, or not at all
+#   5. the result is cached by content hash in extract_cache
+#
+# Knobs (env):
+#   DOC_MAX_MB           largest document accepted                    (default 10)
+#   DOC_MAX_PAGES        PDF pages read; the rest is ignored          (default 30)
+#   DOC_MIN_PAGE_CHARS   a PDF page with less text than this has no
+#                        usable text layer and is OCR'd               (default 25)
+#   DOC_MAX_IMAGE_MP     largest image (megapixels) sent to OCR       (default 40)
+
+import io, os, re, zipfile, tempfile, logging
+from contextlib import contextmanager
+
+import extract_cache
+import ocr_pool
+from ocr_pool import OcrBusy
+
+logger = logging.getLogger(__name__)
+
+DOC_MAX_BYTES = int(float(os.getenv("DOC_MAX_MB", "10")) * 1024 * 1024)
+DOC_MAX_PAGES = int(os.getenv("DOC_MAX_PAGES", "30"))
+DOC_MIN_PAGE_CHARS = int(os.getenv("DOC_MIN_PAGE_CHARS", "25"))
+DOC_MAX_IMAGE_PIXELS = int(float(os.getenv("DOC_MAX_IMAGE_MP", "40")) * 1_000_000)
+
+KINDS = ("pdf", "docx", "doc", "rtf", "image", "text")
+
+class ExtractionRejected(ValueError):
+    """The document is refused before any heavy work (too big, wrong type, locked)."""
+
+    def __init__(self, message: str, status: int = 400, error: str = "bad_file"):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.error = error
+
+
+# ---------- sniffing ----------
+
+def _ext(filename: str) -> str:
+    name = (filename or "").lower()
+    return name.rsplit(".", 1)[1] if "." in name else ""
+
+
+def sniff(head: bytes, filename: str = "", zip_names=None) -> str | None:
+    """
+    Kind of a document from its first bytes (see KINDS). `zip_names` (the
+    member list of a zip) tells a .docx apart from any other zip; without it
+    the filename decides. None = unsupported.
+    """
+    head = head or b""
+    if head.startswith(b"%PDF") or b"%PDF-" in head[:1024]:   # some writers put junk before the header
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        if zip_names is None:
+            return "docx" if _ext(filename) == "docx" else None
+        return "docx" if "word/document.xml" in zip_names else None
+    if head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):   # OLE2: legacy Word .doc
+        return "doc"
+    if head.startswith(b"{\\rtf"):
+        return "rtf"
+    if (head.startswith(b"\x89PNG") or head.startswith(b"\xff\xd8\xff")
+            or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+            or (head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"heif", b"mif1", b"msf1"))):
+        return "image"
+    if head and b"\x00" not in head[:1024]:
+        return "text"   # no binary signature and no NULs: plain text, whatever the name says
+    return None
+
+
+@contextmanager
+def _opened(source):
+    """A seekable binary file object for a path, bytes, or stream (streams are rewound after)."""
+    if isinstance(source, (bytes, bytearray)):
+        yield io.BytesIO(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            yield fh
+    else:
+        source.seek(0)
+        try:
+            yield source
+        finally:
+            source.seek(0)
+
+
+@contextmanager
+def _as_path(source, suffix=""):
+    """A filesystem path for the source (pdf2image / OCR need one); temp copy if it isn't a file already."""
+    if isinstance(source, (str, os.PathLike)):
+        yield os.fspath(source)
+        return
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    try:
+        with tmp, _opened(source) as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                tmp.write(chunk)
+        yield tmp.name
+    finally:
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+
+
+def _size(fh) -> int:
+    fh.seek(0, os.SEEK_END)
+    size = fh.tell()
+    fh.seek(0)
+    return size
+
+
+def _digest(source) -> str:
+    if isinstance(source, (bytes, bytearray)):
+        return extract_cache.digest_bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        return extract_cache.digest_file(source)
+    return extract_cache.digest_stream(source)
+
+
+def detect(source, filename: str = "", max_bytes: int | None = None) -> str:
+    """
+    Size-check and sniff a document without parsing it. Returns its kind or
+    raises ExtractionRejected (413 too big / 400 unsupported).
+    """
+    max_bytes = DOC_MAX_BYTES if max_bytes is None else max_bytes
+    with _opened(source) as fh:
+        size = _size(fh)
+        if max_bytes and size > max_bytes:
+            raise ExtractionRejected(f"Max file size is {max_bytes // (1024 * 1024)} MB", 413, "too_large")
+        if not size:
+            raise ExtractionRejected("The file is empty", 400, "empty")
+        head = fh.read(2048)
+        fh.seek(0)
+        names = None
+        if head.startswith(b"PK\x03\x04"):
+            try:
+                names = set(zipfile.ZipFile(fh).namelist())
+            except zipfile.BadZipFile:
+                names = set()
+            fh.seek(0)
+    kind = sniff(head, filename, names)
+    if kind is None:
+        raise ExtractionRejected("Unsupported file type", 400, "bad_type")
+    return kind
+
+
+# ---------- extractors ----------
+
+@contextmanager
+def _pdf_pages(fh):
+    """(page_count, page_text(i)) — pypdf, or pdfplumber if pypdf can't open the file."""
+    pages = None
+    try:
+        try:
+            from pypdf import PdfReader
+        except ImportError:   # older deploys only have PyPDF2
+            from PyPDF2 import PdfReader
+        reader = PdfReader(fh)
+        if reader.is_encrypted:
+            try:
+                ok = reader.decrypt("")   # "owner password only" PDFs open with an empty password
+            except Exception:
+                ok = 0
+            if not ok:
+                raise ExtractionRejected("This PDF is password protected", 400, "encrypted")
+        pages = len(reader.pages), lambda i: reader.pages[i].extract_text() or ""
+    except ExtractionRejected:
+        raise
+    except Exception:
+        logger.info("pypdf could not open the PDF, trying pdfplumber", exc_info=True)
+    if pages is not None:
+        yield pages
+        return
+    fh.seek(0)
+    import pdfplumber
+    with pdfplumber.open(fh) as pdf:   # closed once the pages are read: file handle + page cache
+        yield len(pdf.pages), lambda i: pdf.pages[i].extract_text() or ""
+
+
+def _extract_pdf(source, ocr: bool, owner, max_chars: int | None, max_pages: int):
+    with _opened(source) as fh, _pdf_pages(fh) as (page_count, page_text):
+        texts, blank, total = {}, [], 0
+        for i in range(min(page_count, max_pages)):
+            try:
+                t = page_text(i)
+            except Exception:
+                logger.warning("pdf page %d: text extraction failed", i + 1, exc_info=True)
+                t = ""
+            texts[i + 1] = t
+            if len(t.strip()) < DOC_MIN_PAGE_CHARS:
+                blank.append(i + 1)
+            total += len(t)
+            if max_chars and total >= max_chars:
+                break   # enough text for the caller; don't parse (or OCR) the rest
+    if page_count > max_pages:
+        logger.info("pdf: %d pages, only the first %d read", page_count, max_pages)
+
+    method, conf, partial, ocr_stats = "pypdf", None, False, []
+    if ocr and blank:
+        try:
+            with _as_path(source, ".pdf") as path:
+                res = ocr_pool.ocr_pdf(path, page_count=page_count, owner=owner, pages=blank)
+            for p, t in res["by_page"].items():
+                if len(t.strip()) > len(texts.get(p, "").strip()):
+                    texts[p] = t
+            method = "tesseract" if len(blank) == len(texts) else "pypdf+tesseract"
+            conf, partial = res["confidence"], bool(res["timed_out"])
+            ocr_stats = res.get("page_stats") or []
+        except OcrBusy:
+            raise
+        except Exception:
+            # no poppler / tesseract here: keep whatever the text layer gave us
+            logger.warning("pdf OCR failed for %d page(s)", len(blank), exc_info=True)
+
+    text = "\n".join(texts[p] for p in sorted(texts)).strip()
+    return {"text": text, "method": method, "pages": page_count, "confidence": conf,
+            "ocr_pages": blank if ocr else [], "ocr_stats": ocr_stats, "partial": partial}
+
+
+def _extract_docx(source):
+    import docx2txt   # body, tables, headers and footers, in document order
+    with _opened(source) as fh:
+        return {"text": (docx2txt.process(fh) or "").strip(), "method": "docx2txt"}
+
+
+def _extract_rtf(source):
+    with _opened(source) as fh:
+        raw = fh.read().decode(errors="ignore")
+    return {"text": re.sub(r"{\\.*?}|\\[a-z]+\d* ?|[{}]", " ", raw).strip(), "method": "rtf"}
+
+
+def _extract_image(source, ocr: bool, owner, image_fallback):
+    from PIL import Image
+    with _opened(source) as fh:
+        try:
+            with Image.open(fh) as img:   # header only, pixels are not decoded here
+                w, h = img.size
+        except Image.DecompressionBombError:
+            w = h = DOC_MAX_IMAGE_PIXELS
+        except Exception:
+            w = h = 0   # unknown to this Pillow (e.g. HEIC without pillow-heif): let OCR decide
+    if w * h > DOC_MAX_IMAGE_PIXELS:
+        raise ExtractionRejected("The image is too large to read", 413, "too_large")
+    if not ocr:
+        return {"text": "", "method": "none", "pages": 1}
+
+    with _as_path(source) as path:
+        try:
+            res = ocr_pool.ocr_image(path, owner=owner)
+            text = (res["text"] or "").strip()
+            if text:
+                return {"text": text, "method": "tesseract", "pages": 1, "confidence": res["confidence"],
+                        "ocr_stats": res.get("page_stats") or [], "partial": bool(res["timed_out"])}
+        except OcrBusy:
+            raise
+        except Exception as e:
+            if type(e).__name__ == "TesseractNotFoundError":
+                logger.info("Tesseract binary not found; using the fallback OCR")
+            else:
+                logger.warning("Tesseract OCR failed", exc_info=True)
+        if image_fallback is None:
+            return {"text": "", "method": "tesseract", "pages": 1}
+        return {"text": (image_fallback(path) or "").strip(), "method": "openai_vision", "pages": 1}
+
+
+def _extract_text(source):
+    with _opened(source) as fh:
+        return {"text": fh.read().decode(errors="ignore").strip(), "method": "text"}
+
+
+# ---------- entry point ----------
+
+def extract(source, filename: str = "", *, kind: str | None = None, owner=None, ocr: bool = True,
+            max_chars: int | None = None, max_pages: int | None = None, max_bytes: int | None = None,
+            image_fallback=None) -> dict:
+    """
+    Text of an uploaded document. `source` is a path, bytes, or a seekable
+    binary stream (left rewound). `kind` skips sniffing when the caller
+    already knows it.
+
+      ocr             OCR pages without a text layer / images (ocr_pool). Off for
+                      the ATS scorer, which should see what an ATS parser sees.
+      max_chars       stop reading PDF pages once this much text is in
+      image_fallback  fn(path) -> text, used when Tesseract gives nothing
+
+    Returns {"text", "kind", "method", "pages", "confidence", "ocr_pages", "ocr_stats", "cached"};
+    ocr_stats has timing / confidence / engine per OCR'd page.
+    Raises ExtractionRejected before parsing, OcrBusy when the OCR pool is
+    full, and whatever the parser raises for a corrupt file.
+    """
+    max_pages = DOC_MAX_PAGES if max_pages is None else max_pages
+    kind = kind or detect(source, filename, max_bytes)
+    if kind not in KINDS:
+        raise ExtractionRejected("Unsupported file type", 400, "bad_type")
+    if kind == "doc":
+        # legacy binary Word (OLE2): nothing here reads it, so say so instead of returning no text
+        raise ExtractionRejected("Old Word .doc files aren't supported. Please upload a .docx or PDF.",
+                                 400, "unsupported_format")
+    if kind == "text":
+        return {"kind": kind, "pages": None, "confidence": None, "ocr_pages": [], "ocr_stats": [], "cached": False,
+                **_extract_text(source)}
+
+    # what changes the output changes the key
+    key = f"doc-{kind}" + ("" if ocr else "-nocr") + (f"-c{max_chars}" if max_chars else "") \
+        + (f"-p{max_pages}" if kind == "pdf" else "") + ("-fb" if image_fallback and kind == "image" else "")
+    digest = _digest(source)
+    hit = extract_cache.get(digest, key)
+    if hit is not None:
+        return {"text": hit["text"], "kind": kind, "method": hit.get("method"), "pages": hit.get("pages"),
+                "confidence": hit.get("confidence"), "ocr_pages": [], "ocr_stats": [], "cached": True}
+
+    if kind == "pdf":
+        out = _extract_pdf(source, ocr, owner, max_chars, max_pages)
+    elif kind == "docx":
+        out = _extract_docx(source)
+    elif kind == "rtf":
+        out = _extract_rtf(source)
+    else:
+        out = _extract_image(source, ocr, owner, image_fallback)
+
+    if not out.get("partial"):   # an OCR run that timed out halfway is worth retrying
+        extract_cache.put(digest, key, out["text"], out["method"], out.get("pages"), out.get("confidence"))
+    return {"text": out["text"], "kind": kind, "method": out["method"], "pages": out.get("pages"),
+            "confidence": out.get("confidence"), "ocr_pages": out.get("ocr_pages", []),
+            "ocr_stats": out.get("ocr_stats", []), "cached": False}
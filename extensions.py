@@ -21,3 +21,19 @@ def init_openai():
     if not api_key:
         raise RuntimeError("Missing OPENAI_API_KEY")
     return OpenAI(api_key=api_key)
+
+# 4) Throwaway client for auth calls that set a session (sign_in / sign_up).
+#    supabase-py keeps the signed-in session on the client it was called on and
+#    uses that user's token for later table() calls, so doing this on the shared
+#    app-wide client would leak one user's session into other requests once they
+#    run concurrently (threads / gevent).
+def init_auth_client():
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        raise RuntimeError("Missing SUPABASE_URL or SUPABASE_KEY")
+    try:
+        from supabase import ClientOptions
+        return create_client(url, key, options=ClientOptions(persist_session=False, auto_refresh_token=False))
+    except ImportError:  # older supabase-py
+        return create_client(url, key)
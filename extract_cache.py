@@ -0,0 +1,170 @@
+# extract_cache.py
+#
+# Content-addressed cache for text extracted from uploaded documents.
+# People upload the same CV again and again (/api/upload, /api/resume-analysis,
+# /api/optimize-resume), and every upload used to re-run pypdf / docx / Tesseract
+# / OpenAI vision OCR. Entries are keyed by the SHA-256 of the file bytes plus
+# the extractor that produced them, and hold the extracted text together with
+# how it was obtained (method, page count, OCR confidence).
+#
+# Entries live on local disk so every worker (and the batch / OCR pools) on a
+# box share them. The directory is kept under EXTRACT_CACHE_MAX_MB by dropping
+# the least recently used files (hits refresh the mtime).
+#
+#   EXTRACT_CACHE_DIR      (default: <tmp>/jobcus_extract_cache)
+#   EXTRACT_CACHE_MAX_MB   (default 200; 0 disables the cache)
+
+import os, json, time, hashlib, tempfile, threading, logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("EXTRACT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "jobcus_extract_cache")
+MAX_BYTES = int(float(os.getenv("EXTRACT_CACHE_MAX_MB", "200")) * 1024 * 1024)
+VERSION = 1   # bump when an extractor changes its output, old entries are then ignored
+
+_lock = threading.Lock()
+_approx_size = None   # bytes on disk, estimated; None = not scanned yet
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+
+def enabled() -> bool:
+    return MAX_BYTES > 0
+
+
+def digest_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def digest_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def digest_stream(f) -> str:
+    """Hash a seekable binary stream in chunks and rewind it."""
+    h = hashlib.sha256()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+        h.update(chunk)
+    f.seek(0)
+    return h.hexdigest()
+
+
+def _path(digest: str, extractor: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in extractor)
+    return os.path.join(CACHE_DIR, digest[:2], f"{digest}.{safe}.v{VERSION}.json")
+
+
+def get(digest: str, extractor: str) -> dict | None:
+    """{"text", "method", "pages", "confidence", "created"} or None."""
+    if not enabled():
+        return None
+    p = _path(digest, extractor)
+    try:
+        with open(p, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        os.utime(p)   # LRU: a hit makes the entry young again
+    except FileNotFoundError:
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    except Exception:
+        logger.warning("extract cache: unreadable entry %s", p, exc_info=True)
+        with _lock:
+            _stats["errors"] += 1
+        return None
+    with _lock:
+        _stats["hits"] += 1
+    return entry
+
+
+def put(digest: str, extractor: str, text: str, method: str,
+        pages: int | None = None, confidence: float | None = None) -> None:
+    if not enabled() or not (text or "").strip():
+        return   # never cache failures: the next upload should try again
+    entry = {"text": text, "method": method, "pages": pages, "confidence": confidence,
+             "created": time.time()}
+    p = _path(digest, extractor)
+    try:
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(p), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, p)   # atomic: readers never see half an entry
+        size = os.path.getsize(p)
+    except Exception:
+        logger.warning("extract cache: write failed", exc_info=True)
+        with _lock:
+            _stats["errors"] += 1
+        return
+    _after_write(size)
+
+
+def _after_write(size: int):
+    global _approx_size
+    with _lock:
+        _stats["writes"] += 1
+        if _approx_size is not None:
+            _approx_size += size
+        over = _approx_size is None or _approx_size > MAX_BYTES
+    if over:
+        _evict()
+
+
+def _evict():
+    """Drop the least recently used entries until the cache is back under 90% of its budget."""
+    global _approx_size
+    files = []
+    for root, _dirs, names in os.walk(CACHE_DIR):
+        for n in names:
+            p = os.path.join(root, n)
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:
+                continue   # another worker got there first
+            if n.endswith(".tmp") and time.time() - st.st_mtime < 600:
+                continue   # someone is still writing it
+            files.append((st.st_mtime, st.st_size, p))
+    total = sum(s for _m, s, _p in files)
+    removed = 0
+    if total > MAX_BYTES:
+        target = int(MAX_BYTES * 0.9)
+        for _mtime, size, p in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(p)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                total -= size
+            except OSError:
+                pass
+    with _lock:
+        _approx_size = total
+        _stats["evictions"] += removed
+
+
+def cached_extract(digest: str, extractor: str, fn):
+    """
+    Return the cached text for (digest, extractor) or run `fn()` and store it.
+    `fn` returns the text, or (text, method, pages, confidence).
+    """
+    hit = get(digest, extractor)
+    if hit is not None:
+        return hit["text"]
+    out = fn()
+    text, method, pages, conf = (out, extractor, None, None) if isinstance(out, str) else out
+    put(digest, extractor, text, method, pages, conf)
+    return text
+
+
+def stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+        s["approx_bytes"] = _approx_size
+    s.update(dir=CACHE_DIR, max_bytes=MAX_BYTES)
+    return s
@@ -0,0 +1,39 @@
+# gunicorn.conf.py
+#
+# Nearly every request spends its time waiting on Supabase, OpenAI, the job
+# APIs, Resend or Turnstile, so the worker class matters more than the
+# worker count. Pick a profile with GUNICORN_WORKER_CLASS:
+#
+#   gthread  GUNICORN_THREADS threads per worker (default)
+#   gevent   cooperative workers; each one keeps up to GUNICORN_WORKER_CONNECTIONS
+#            requests in flight while they wait on the network (opt-in)
+#   sync     the old setup: one request per worker at a time
+#
+# gevent is opt-in only. Its monkey-patched threading/queue also drive the
+# spawn process pools (batch ATS scoring in blueprints/resumes.py, OCR in
+# ocr_pool.py), whose management threads are a known place for gevent to
+# stall, and CPU-heavy work still blocks the whole worker. Load-test uploads
+# and streamed /api/ask together before switching a deploy over.
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", os.getenv("GUNICORN_WORKERS", "2")))
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "").strip().lower() or "gthread"
+
+threads = int(os.getenv("GUNICORN_THREADS", "8"))                          # gthread
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))  # gevent
+
+# streamed chat replies and OCR can legitimately run for a while
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# don't preload: the gevent worker has to monkey-patch before the app (and
+# its Supabase/OpenAI/httpx clients) is imported, and background threads
+# (usage/session caches) must start in the worker, not the master
+preload_app = False
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG") or None
+loglevel = os.getenv("GUNICORN_LOGLEVEL", "info")
@@ -0,0 +1,172 @@
+# http_pool.py
+#
+# One pooled HTTP client per worker process for every outbound call
+# (Adzuna, Remotive, JSearch, Resend, Turnstile, Supabase auth REST).
+# Connections are kept alive between requests, so only the first call to a
+# host pays for DNS + TCP + TLS. HTTP/2 is used when `h2` is installed.
+#
+# Knobs (env):
+#   HTTP_MAX_CONNECTIONS     total sockets per worker            (default 50)
+#   HTTP_MAX_KEEPALIVE       idle sockets kept around            (default 20)
+#   HTTP_MAX_PER_HOST        concurrent requests per host        (default 16)
+#   HTTP_RETRIES             extra attempts on transient errors  (default 2)
+#
+# Retries: GET/HEAD retry on transport errors and 429/502/503/504; other
+# methods only retry when the connection itself failed (nothing was sent),
+# so an email is never delivered twice. Backoff is exponential with jitter
+# and honours Retry-After (capped).
+
+import os, time, random, threading, logging
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "16"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+DEFAULT_TIMEOUT = (5, 15)  # connect, read — same as the old requests calls
+
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT = {"GET", "HEAD", "OPTIONS"}
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 3.0
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+_client: httpx.Client | None = None
+_client_pid = None
+_lock = threading.Lock()
+_host_slots: dict[str, threading.BoundedSemaphore] = {}
+_stats: dict[str, dict] = {}
+
+
+def client() -> httpx.Client:
+    """The worker's shared client (rebuilt after fork, never shared across processes)."""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = httpx.Client(
+                http2=HTTP2,
+                follow_redirects=True,
+                timeout=_timeout(DEFAULT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE,
+                    keepalive_expiry=30,
+                ),
+                headers={"User-Agent": "Jobcus/1.0"},
+            )
+            _client_pid = os.getpid()
+            _host_slots.clear()
+    return _client
+
+
+def _timeout(t) -> httpx.Timeout:
+    """Accept requests-style timeouts: a number or a (connect, read) tuple."""
+    if isinstance(t, httpx.Timeout):
+        return t
+    if isinstance(t, (tuple, list)):
+        connect, read = t
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(t)
+
+
+def _slot(host: str) -> threading.BoundedSemaphore:
+    sem = _host_slots.get(host)
+    if sem is None:
+        with _lock:
+            sem = _host_slots.setdefault(host, threading.BoundedSemaphore(MAX_PER_HOST))
+    return sem
+
+
+def _record(host: str, ms: float, ok: bool, retried: int):
+    with _lock:
+        s = _stats.setdefault(host, {"requests": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0})
+        s["requests"] += 1
+        s["errors"] += 0 if ok else 1
+        s["retries"] += retried
+        s["total_ms"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+
+
+def _backoff(attempt: int, retry_after: str | None = None) -> float:
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_CAP)
+        except ValueError:
+            pass
+    return min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+def request(method: str, url: str, *, timeout=None, retries: int | None = None, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared pool. Same call shape as requests /
+    httpx (params=, json=, data=, headers=); raises httpx errors after the
+    last attempt.
+    """
+    method = method.upper()
+    retries = RETRIES if retries is None else retries
+    host = urlsplit(url).netloc
+    if timeout is not None:
+        kwargs["timeout"] = _timeout(timeout)
+
+    attempt, t0 = 0, time.monotonic()
+    while True:
+        try:
+            with _slot(host):
+                resp = client().request(method, url, **kwargs)
+            if resp.status_code in RETRY_STATUSES and method in IDEMPOTENT and attempt < retries:
+                time.sleep(_backoff(attempt, resp.headers.get("Retry-After")))
+                attempt += 1
+                continue
+            _record(host, (time.monotonic() - t0) * 1000, resp.status_code < 500, attempt)
+            return resp
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            retryable = True
+            err = e
+        except httpx.TransportError as e:
+            # the request may have reached the server; only safe to repeat reads
+            retryable = method in IDEMPOTENT
+            err = e
+        if not retryable or attempt >= retries:
+            _record(host, (time.monotonic() - t0) * 1000, False, attempt)
+            raise err
+        logger.info("http_pool: %s %s failed (%s), retrying", method, host, type(err).__name__)
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> httpx.Response:
+    return request("POST", url, **kwargs)
+
+
+def stats() -> dict:
+    """Per-host counters plus what the connection pool currently holds."""
+    with _lock:
+        hosts = {
+            h: {**s, "avg_ms": round(s["total_ms"] / s["requests"], 1) if s["requests"] else 0.0}
+            for h, s in _stats.items()
+        }
+    pool = {"http2": HTTP2, "max_connections": MAX_CONNECTIONS, "max_keepalive": MAX_KEEPALIVE,
+            "max_per_host": MAX_PER_HOST}
+    try:
+        # httpcore internals; best effort only
+        conns = client()._transport._pool.connections
+        pool["open"] = len(conns)
+        pool["idle"] = sum(1 for c in conns if c.is_idle())
+    except Exception:
+        pass
+    return {"pool": pool, "hosts": hosts}
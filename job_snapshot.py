@@ -0,0 +1,249 @@
+# job_snapshot.py
+#
+# Pre-aggregated job-market numbers for the Job Insights endpoints
+# (/api/salary, /api/job-count, /api/skills, /api/locations).
+#
+# A background ingester pulls Adzuna once per (role, location) in the grid,
+# reduces each result page to a handful of numbers (salary percentiles,
+# posting count, skill mentions, top locations) and writes them into a
+# versioned SQLite file. Every worker keeps the latest version in memory, so
+# serving is a dict lookup. The file is shared by all workers on the box; a
+# lock file makes sure only one of them ingests at a time.
+#
+#   JOB_SNAPSHOT_PATH       sqlite file      (default: <tmp>/jobcus_job_snapshot.sqlite)
+#   JOB_SNAPSHOT_INTERVAL   seconds between ingestions (default 3600)
+#   JOB_SNAPSHOT_LOCATIONS  comma list of locations to pre-aggregate
+#   JOB_SNAPSHOT_KEEP       how many old versions to keep (default 3)
+
+import os, json, time, sqlite3, tempfile, threading, logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl  # POSIX only; without it every worker may ingest
+except ImportError:
+    fcntl = None
+
+import http_pool
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv("JOB_SNAPSHOT_PATH") or os.path.join(tempfile.gettempdir(), "jobcus_job_snapshot.sqlite")
+SNAPSHOT_INTERVAL = int(os.getenv("JOB_SNAPSHOT_INTERVAL", "3600"))
+SNAPSHOT_LOCATIONS = [l.strip() for l in os.getenv("JOB_SNAPSHOT_LOCATIONS", "London,Manchester,Birmingham").split(",") if l.strip()]
+SNAPSHOT_KEEP = int(os.getenv("JOB_SNAPSHOT_KEEP", "3"))
+RELOAD_CHECK_SECONDS = 5
+
+_SCHEMA = """
+create table if not exists snapshots (
+    version    integer primary key,
+    created_at real not null,
+    cells      integer not null
+);
+create table if not exists cells (
+    version  integer not null,
+    role     text not null,      -- normalised ('' = all roles)
+    location text not null,      -- normalised ('' = anywhere)
+    data     text not null,      -- json: count, n, p25, p50, p75, skills, locations
+    primary key (version, role, location)
+);
+"""
+
+
+def _norm(s) -> str:
+    return (s or "").strip().lower()
+
+
+def _percentile(sorted_vals: list[float], q: float) -> int:
+    if not sorted_vals:
+        return 0
+    i = (len(sorted_vals) - 1) * q
+    lo, hi = int(i), min(int(i) + 1, len(sorted_vals) - 1)
+    return int(sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (i - lo))
+
+
+def summarize(results: list[dict], total: int | None, keywords: list[str]) -> dict:
+    """Reduce one Adzuna result page to the numbers the charts need."""
+    salaries = []
+    for it in results:
+        mn, mx = it.get("salary_min"), it.get("salary_max")
+        if isinstance(mn, (int, float)) and isinstance(mx, (int, float)) and 0 < mn <= mx:
+            salaries.append((mn + mx) / 2.0)
+        elif isinstance(mx, (int, float)) and mx > 0:
+            salaries.append(float(mx))
+        elif isinstance(mn, (int, float)) and mn > 0:
+            salaries.append(float(mn))
+    salaries.sort()
+
+    n = len(results) or 1
+    skills = {}
+    lowered = [((it.get("title") or "") + " " + (it.get("description") or "")).lower() for it in results]
+    for k in keywords:
+        kl = k.lower()
+        skills[k] = int(round(100 * sum(1 for t in lowered if kl in t) / n))
+
+    locs = Counter()
+    for it in results:
+        name = (it.get("location") or {}).get("display_name")
+        if name:
+            locs[name.split(",")[0].strip()] += 1
+
+    return {
+        "count": int(total if total is not None else len(results)),
+        "n": len(salaries),
+        "p25": _percentile(salaries, 0.25),
+        "p50": _percentile(salaries, 0.50),
+        "p75": _percentile(salaries, 0.75),
+        "skills": skills,
+        "locations": locs.most_common(6),
+    }
+
+
+class JobSnapshotStore:
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self.version = 0
+        self.created_at = 0.0
+        self._cells: dict[tuple[str, str], dict] = {}
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=10)
+        con.execute("pragma journal_mode=wal")
+        con.executescript(_SCHEMA)
+        return con
+
+    # ---------- reading ----------
+
+    def _maybe_reload(self):
+        now = time.time()
+        if now - self._checked < RELOAD_CHECK_SECONDS:
+            return
+        with self._lock:
+            if now - self._checked < RELOAD_CHECK_SECONDS:
+                return
+            self._checked = now
+            if not os.path.exists(self.path):
+                return
+            try:
+                con = self._connect()
+                try:
+                    row = con.execute("select version, created_at from snapshots order by version desc limit 1").fetchone()
+                    if not row or row[0] == self.version:
+                        return
+                    cells = {
+                        (r, l): json.loads(d)
+                        for r, l, d in con.execute("select role, location, data from cells where version = ?", (row[0],))
+                    }
+                finally:
+                    con.close()
+                self._cells, self.version, self.created_at = cells, row[0], row[1]
+            except Exception:
+                logger.warning("job snapshot reload failed", exc_info=True)
+
+    def lookup(self, role, location) -> dict | None:
+        """Aggregates for (role, location), or None when the snapshot doesn't cover it."""
+        self._maybe_reload()
+        return self._cells.get((_norm(role), _norm(location)))
+
+    # ---------- writing ----------
+
+    def write(self, cells: dict[tuple[str, str], dict]) -> int:
+        con = self._connect()
+        try:
+            with con:
+                row = con.execute("select coalesce(max(version), 0) from snapshots").fetchone()
+                version = int(row[0]) + 1
+                con.executemany(
+                    "insert into cells (version, role, location, data) values (?, ?, ?, ?)",
+                    [(version, r, l, json.dumps(d)) for (r, l), d in cells.items()],
+                )
+                con.execute("insert into snapshots (version, created_at, cells) values (?, ?, ?)",
+                            (version, time.time(), len(cells)))
+                con.execute("delete from cells where version <= ?", (version - SNAPSHOT_KEEP,))
+                con.execute("delete from snapshots where version <= ?", (version - SNAPSHOT_KEEP,))
+            return version
+        finally:
+            con.close()
+            self._checked = 0.0  # pick the new version up on the next lookup
+
+    def ingest(self, titles: list[str], keywords: list[str], app_id: str, app_key: str,
+               api_url: str = "https://api.adzuna.com/v1/api/jobs", locations: list[str] | None = None) -> int | None:
+        """Pull every (role, location) in the grid concurrently and store a new version."""
+        locations = [""] + list(SNAPSHOT_LOCATIONS if locations is None else locations)
+        grid = [(t, l) for t in [""] + list(titles) for l in locations]
+
+        def _pull(cell):
+            role, loc = cell
+            params = {"app_id": app_id, "app_key": app_key, "results_per_page": 50,
+                      "content-type": "application/json"}
+            if role:
+                params["what"] = role
+            if loc:
+                params["where"] = loc
+            r = http_pool.get(f"{api_url}/gb/search/1", params=params, timeout=(5, 20))
+            r.raise_for_status()
+            data = r.json() or {}
+            return summarize(data.get("results") or [], data.get("count"), keywords)
+
+        cells = {}
+        with ThreadPoolExecutor(max_workers=6, thread_name_prefix="job-snapshot") as pool:
+            for (role, loc), fut in [(c, pool.submit(_pull, c)) for c in grid]:
+                try:
+                    cells[(_norm(role), _norm(loc))] = fut.result()
+                except Exception as e:
+                    logger.warning("job snapshot: %s / %s failed: %s", role or "*", loc or "*", e)
+        if not cells:
+            return None
+        version = self.write(cells)
+        logger.info("job snapshot v%s written (%d cells)", version, len(cells))
+        return version
+
+    # ---------- background ingestion ----------
+
+    def _try_lock(self):
+        if fcntl is None:
+            return True
+        fh = open(self.path + ".lock", "w")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fh
+        except OSError:
+            fh.close()
+            return None
+
+    def _due(self) -> bool:
+        self._maybe_reload()
+        return time.time() - self.created_at >= SNAPSHOT_INTERVAL
+
+    def start(self, ingest_kwargs: dict):
+        """Start the ingestion loop in this worker (idempotent, fork-aware)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+            def _loop():
+                while True:
+                    try:
+                        if self._due():
+                            lock = self._try_lock()
+                            if lock:
+                                try:
+                                    self._checked = 0.0
+                                    if self._due():  # another worker may have just finished
+                                        self.ingest(**ingest_kwargs)
+                                finally:
+                                    if lock is not True:
+                                        lock.close()
+                    except Exception:
+                        logger.exception("job snapshot ingestion failed")
+                    time.sleep(min(60, SNAPSHOT_INTERVAL))
+
+            self._thread = threading.Thread(target=_loop, name="job-snapshot", daemon=True)
+            self._thread.start()
@@ -1,8 +1,13 @@
 from __future__ import annotations
+import logging, threading
 from dataclasses import dataclass
 from datetime import date, datetime
 from typing import Optional
 
+from usage_cache import wrap_if_enabled
+
+logger = logging.getLogger(__name__)
+
 # ---------- Plan config ----------
 
 @dataclass(frozen=True)
@@ -48,6 +53,12 @@ PLAN_QUOTAS = {
         # ⬇️ (Optional) add hourly/daily for analyzer if you’ll enforce them
         "resume_analyzer_hour": Quota("hour", 2),
         "resume_analyzer_day":  Quota("day", 4),
+
+        # batch ranking (/api/resume-analysis/batch) counts once per batch
+        "resume_batch":       Quota("month", 0),
+
+        # images OpenAI vision had to read because Tesseract got nothing (/api/upload)
+        "ocr_vision_day":     Quota("day", 3),
     },
 
     "weekly": {
@@ -63,6 +74,10 @@ PLAN_QUOTAS = {
         "chat_messages_day":  Quota("day", 80),
         "chat_words_hour":    Quota("hour", 3000),
         "chat_words_day":     Quota("day", 15000),
+
+        "resume_batch":       Quota("month", 0),
+
+        "ocr_vision_day":     Quota("day", 10),
     },
 
     "standard": {
@@ -80,6 +95,10 @@ PLAN_QUOTAS = {
 
         "resume_analyzer_hour": Quota("hour", 6),
         "resume_analyzer_day":  Quota("day", 20),
+
+        "resume_batch":       Quota("month", 5),
+
+        "ocr_vision_day":     Quota("day", 30),
     },
 
     "premium": {
@@ -97,6 +116,10 @@ PLAN_QUOTAS = {
 
         "resume_analyzer_hour": Quota("hour", None),
         "resume_analyzer_day":  Quota("day", None),
+
+        "resume_batch":       Quota("month", 20),
+
+        "ocr_vision_day":     Quota("day", 100),
     },
 
     "employer_jd": {
@@ -114,6 +137,11 @@ PLAN_QUOTAS = {
         "skill_gap":           Quota("month", 0),
         "interview_coach":     Quota("month", 0),
         "resume_builder":      Quota("month", 0),
+
+        # ...but ranking applicant CVs against a JD is exactly what they're here for
+        "resume_batch":        Quota("month", 30),
+
+        "ocr_vision_day":      Quota("day", 20),
     },
 }
 
@@ -126,6 +154,8 @@ FEATURE_FLAGS = {
         "optimize_ai":     False,
         "downloads":       False,
         "job_insights":    "basic",
+        "resume_batch_max_files": 0,   # files per /api/resume-analysis/batch call (0 = not included)
+        "chat_context_tokens": 3000,   # prompt budget per chat turn (chat_context.py)
     },
     "weekly": {
         "has_chat":       True,
@@ -134,6 +164,8 @@ FEATURE_FLAGS = {
         "optimize_ai":     False,
         "downloads":       False,
         "job_insights":    "full",
+        "resume_batch_max_files": 0,
+        "chat_context_tokens": 4000,
     },
     "standard": {
         "has_chat":       True,
@@ -142,6 +174,8 @@ FEATURE_FLAGS = {
         "optimize_ai":     True,
         "downloads":       True,
         "job_insights":    "full",
+        "resume_batch_max_files": 50,
+        "chat_context_tokens": 6000,
     },
     "premium": {
         "has_chat":       True,
@@ -150,6 +184,8 @@ FEATURE_FLAGS = {
         "optimize_ai":     True,
         "downloads":       True,
         "job_insights":    "full",
+        "resume_batch_max_files": 100,
+        "chat_context_tokens": 12000,
     },
     "employer_jd": {
         "has_chat":       True,    # limited chat enabled
@@ -158,6 +194,8 @@ FEATURE_FLAGS = {
         "optimize_ai":     False,
         "downloads":       True,
         "job_insights":    "basic",
+        "resume_batch_max_files": 500,
+        "chat_context_tokens": 4000,
     },
 }
 
@@ -197,6 +235,301 @@ def has_chat(plan: str) -> bool:
     return bool(FEATURE_FLAGS.get((plan or "free").lower(), {}).get("cloud_history", False) or True)
     # ↑ or add an explicit FEATURE_FLAGS[plan]["has_chat"] if you prefer
 
+# ---------- Counter backends ----------
+#
+# Check-and-increment must be ONE statement on the database, otherwise two
+# gunicorn workers can both read `used=14` and both pass a limit of 15.
+# Create this function once in the Supabase SQL editor (use `uuid` for
+# p_user_id if usage_counters.user_id is a uuid column):
+#
+#   create or replace function usage_incr_if_below(
+#       p_user_id text, p_feature text, p_kind text, p_key text,
+#       p_amount int, p_limit int
+#   ) returns table (allowed boolean, used int)
+#   language plpgsql as $$
+#   begin
+#     return query
+#       insert into usage_counters as u (user_id, feature, period_kind, period_key, count)
+#       select p_user_id, p_feature, p_kind, p_key, p_amount
+#       where p_limit is null or p_amount <= p_limit     -- a new row must respect the limit too
+#       on conflict (user_id, feature, period_kind, period_key)
+#       do update set count = u.count + excluded.count
+#       where p_limit is null or u.count + excluded.count <= p_limit
+#       returning true, u.count;
+#     if not found then
+#       return query
+#         select false, coalesce((select u.count from usage_counters u
+#           where u.user_id = p_user_id and u.feature = p_feature
+#             and u.period_kind = p_kind and u.period_key = p_key), 0);
+#     end if;
+#   end $$;
+#
+# Several windows for one request (e.g. chat_messages + _hour + _day) are
+# checked and bumped together, all-or-nothing, by a second function:
+#
+#   create or replace function usage_incr_many_if_below(p_user_id text, p_items jsonb)
+#   returns table (feature text, allowed boolean, used int)
+#   language plpgsql as $$
+#   #variable_conflict use_column
+#   declare ok boolean;
+#   begin
+#     insert into usage_counters (user_id, feature, period_kind, period_key, count)
+#     select p_user_id, i->>'feature', i->>'kind', i->>'key', 0
+#     from jsonb_array_elements(p_items) i
+#     on conflict (user_id, feature, period_kind, period_key) do nothing;
+#
+#     perform 1 from usage_counters u join jsonb_array_elements(p_items) i
+#       on u.feature = i->>'feature' and u.period_kind = i->>'kind' and u.period_key = i->>'key'
+#     where u.user_id = p_user_id
+#     for update of u;
+#
+#     select bool_and(i->>'limit' is null
+#                     or u.count + (i->>'amount')::int <= (i->>'limit')::int)
+#       into ok
+#     from usage_counters u join jsonb_array_elements(p_items) i
+#       on u.feature = i->>'feature' and u.period_kind = i->>'kind' and u.period_key = i->>'key'
+#     where u.user_id = p_user_id;
+#
+#     if ok then
+#       update usage_counters u set count = u.count + (i->>'amount')::int
+#       from jsonb_array_elements(p_items) i
+#       where u.user_id = p_user_id and u.feature = i->>'feature'
+#         and u.period_kind = i->>'kind' and u.period_key = i->>'key';
+#     end if;
+#
+#     return query
+#       select u.feature, ok, u.count from usage_counters u join jsonb_array_elements(p_items) i
+#         on u.feature = i->>'feature' and u.period_kind = i->>'kind' and u.period_key = i->>'key'
+#       where u.user_id = p_user_id;
+#   end $$;
+#
+# Until the functions exist we fall back to the old read-then-upsert path
+# (batched: one select + one multi-row upsert for the *_many variant).
+
+def _first_row(data) -> dict | None:
+    if isinstance(data, list):
+        return data[0] if data else None
+    if isinstance(data, dict):
+        return data
+    return None
+
+
+def _is_missing_function(exc: Exception) -> bool:
+    msg = str(exc).lower()
+    return "pgrst202" in msg or "could not find the function" in msg
+
+
+# One counter window inside a batched check: (feature, kind, key, amount, limit)
+CounterItem = tuple[str, str, str, int, Optional[int]]
+
+def _first_over_limit(items: list[CounterItem], counts: list[int]) -> int | None:
+    """Index of the first item that would exceed its limit, or None if all fit."""
+    for i, ((_f, _k, _key, amount, limit), used) in enumerate(zip(items, counts)):
+        if limit is not None and used + amount > limit:
+            return i
+    return None
+
+
+class SupabaseCounterBackend:
+    """Counters stored in the `usage_counters` table."""
+
+    RPC_INCR = "usage_incr_if_below"
+    RPC_INCR_MANY = "usage_incr_many_if_below"
+
+    def __init__(self, client):
+        self.client = client
+        # each flips off once if its SQL function isn't deployed; the other keeps being used
+        self._rpc_ok = {self.RPC_INCR: True, self.RPC_INCR_MANY: True}
+
+    def get_count(self, user_id: str, feature: str, kind: str, key: str) -> int:
+        r = (
+            self.client.table("usage_counters")
+            .select("count")
+            .eq("user_id", user_id)
+            .eq("feature", feature)
+            .eq("period_kind", kind)
+            .eq("period_key", key)
+            .limit(1)
+            .execute()
+        )
+        row = _first_row(getattr(r, "data", None))
+        return int((row or {}).get("count") or 0)
+
+    def set_count(self, user_id: str, feature: str, kind: str, key: str, count: int) -> None:
+        (
+            self.client.table("usage_counters")
+            .upsert(
+                {
+                    "user_id": user_id,
+                    "feature": feature,
+                    "period_kind": kind,
+                    "period_key": key,
+                    "count": count,
+                },
+                on_conflict="user_id,feature,period_kind,period_key",
+            )
+            .execute()
+        )
+
+    def incr_if_below(
+        self, user_id: str, feature: str, kind: str, key: str, amount: int, limit: int | None
+    ) -> tuple[bool, int]:
+        """Add `amount` unless that would exceed `limit`. Returns (allowed, count)."""
+        if self._rpc_ok[self.RPC_INCR]:
+            try:
+                r = self.client.rpc(self.RPC_INCR, {
+                    "p_user_id": user_id,
+                    "p_feature": feature,
+                    "p_kind": kind,
+                    "p_key": key,
+                    "p_amount": amount,
+                    "p_limit": limit,
+                }).execute()
+                row = _first_row(getattr(r, "data", None))
+                if row is not None:
+                    return bool(row.get("allowed")), int(row.get("used") or 0)
+            except Exception as e:
+                if not _is_missing_function(e):
+                    raise
+                logger.warning("%s() is not deployed; using read-then-write counters", self.RPC_INCR)
+                self._rpc_ok[self.RPC_INCR] = False
+
+        used = self.get_count(user_id, feature, kind, key)
+        if limit is not None and used + amount > limit:
+            return False, used
+        self.set_count(user_id, feature, kind, key, used + amount)
+        return True, used + amount
+
+    def incr_many_if_below(
+        self, user_id: str, items: list[CounterItem]
+    ) -> tuple[bool, list[int], int | None]:
+        """
+        Add every item's amount, or none of them. Returns (allowed, counts, denied_index);
+        counts are post-increment when allowed, current values otherwise.
+        """
+        if not items:
+            return True, [], None
+        if self._rpc_ok[self.RPC_INCR_MANY]:
+            try:
+                r = self.client.rpc(self.RPC_INCR_MANY, {
+                    "p_user_id": user_id,
+                    "p_items": [
+                        {"feature": f, "kind": k, "key": key, "amount": amount, "limit": limit}
+                        for (f, k, key, amount, limit) in items
+                    ],
+                }).execute()
+                rows = getattr(r, "data", None) or []
+                if isinstance(rows, list) and rows:
+                    by_feature = {row.get("feature"): int(row.get("used") or 0) for row in rows}
+                    counts = [by_feature.get(f, 0) for (f, *_rest) in items]
+                    if all(row.get("allowed") for row in rows):
+                        return True, counts, None
+                    return False, counts, _first_over_limit(items, counts)
+            except Exception as e:
+                if not _is_missing_function(e):
+                    raise
+                logger.warning("%s() is not deployed; using read-then-write counters", self.RPC_INCR_MANY)
+                self._rpc_ok[self.RPC_INCR_MANY] = False
+
+        # one batched read, of the current periods only (not every period the account ever had) ...
+        r = (
+            self.client.table("usage_counters")
+            .select("feature,period_kind,period_key,count")
+            .eq("user_id", user_id)
+            .in_("feature", sorted({f for (f, *_rest) in items}))
+            .in_("period_key", sorted({key for (_f, _k, key, _a, _l) in items}))
+            .execute()
+        )
+        current = {
+            (row.get("feature"), row.get("period_kind"), row.get("period_key")): int(row.get("count") or 0)
+            for row in (getattr(r, "data", None) or [])
+        }
+        counts = [current.get((f, k, key), 0) for (f, k, key, _a, _l) in items]
+        denied = _first_over_limit(items, counts)
+        if denied is not None:
+            return False, counts, denied
+
+        # ... and one multi-row write
+        new_counts = [used + item[3] for item, used in zip(items, counts)]
+        (
+            self.client.table("usage_counters")
+            .upsert(
+                [
+                    {
+                        "user_id": user_id,
+                        "feature": f,
+                        "period_kind": k,
+                        "period_key": key,
+                        "count": n,
+                    }
+                    for (f, k, key, _a, _l), n in zip(items, new_counts)
+                ],
+                on_conflict="user_id,feature,period_kind,period_key",
+            )
+            .execute()
+        )
+        return True, new_counts, None
+
+
+class LocalCounterBackend:
+    """Thread-safe in-memory counters. Stand-in for tests and local development."""
+
+    def __init__(self):
+        self._counts: dict[tuple[str, str, str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def get_count(self, user_id: str, feature: str, kind: str, key: str) -> int:
+        with self._lock:
+            return self._counts.get((user_id, feature, kind, key), 0)
+
+    def set_count(self, user_id: str, feature: str, kind: str, key: str, count: int) -> None:
+        with self._lock:
+            self._counts[(user_id, feature, kind, key)] = int(count)
+
+    def incr_if_below(
+        self, user_id: str, feature: str, kind: str, key: str, amount: int, limit: int | None
+    ) -> tuple[bool, int]:
+        k = (user_id, feature, kind, key)
+        with self._lock:
+            used = self._counts.get(k, 0)
+            if limit is not None and used + amount > limit:
+                return False, used
+            self._counts[k] = used + amount
+            return True, used + amount
+
+    def incr_many_if_below(
+        self, user_id: str, items: list[CounterItem]
+    ) -> tuple[bool, list[int], int | None]:
+        keys = [(user_id, f, k, key) for (f, k, key, _a, _l) in items]
+        with self._lock:
+            counts = [self._counts.get(k, 0) for k in keys]
+            denied = _first_over_limit(items, counts)
+            if denied is not None:
+                return False, counts, denied
+            for k, item, used in zip(keys, items, counts):
+                self._counts[k] = used + item[3]
+            return True, [self._counts[k] for k in keys], None
+
+
+# id(client) -> (client, backend); the client is kept to detect id reuse
+_BACKENDS: dict[int, tuple[object, object]] = {}
+
+def counter_backend(client):
+    """
+    Resolve the counter backend for `client`. Anything that already speaks the
+    backend protocol (e.g. LocalCounterBackend) is used as-is; a Supabase client
+    is wrapped once and reused, behind the write-behind cache when USAGE_CACHE
+    is on (see usage_cache.py).
+    """
+    if hasattr(client, "incr_if_below"):
+        return client
+    cached = _BACKENDS.get(id(client))
+    if cached is None or cached[0] is not client:
+        backend = wrap_if_enabled(SupabaseCounterBackend(client))
+        cached = _BACKENDS[id(client)] = (client, backend)
+    return cached[1]
+
+
 # ---------- Counters ----------
 
 def get_usage_count(supabase_admin, user_id: str, feature: str, kind: str, key: str) -> int:
@@ -204,41 +537,13 @@ def get_usage_count(supabase_admin, user_id: str, feature: str, kind: str, key:
     Read the current usage count for (user_id, feature, kind, key).
     Defensive against SDK returning list or dict.
     """
-    r = (
-        supabase_admin.table("usage_counters")
-        .select("count")
-        .eq("user_id", user_id)
-        .eq("feature", feature)
-        .eq("period_kind", kind)
-        .eq("period_key", key)
-        .limit(1)
-        .execute()
-    )
-    data = getattr(r, "data", None)
-    if isinstance(data, list) and data:
-        return int(data[0].get("count") or 0)
-    if isinstance(data, dict):
-        return int(data.get("count") or 0)
-    return 0
+    return counter_backend(supabase_admin).get_count(user_id, feature, kind, key)
 
 
 def increment_usage(
     supabase_admin, user_id: str, feature: str, kind: str, key: str, new_count: int
 ) -> None:
-    (
-        supabase_admin.table("usage_counters")
-        .upsert(
-            {
-                "user_id": user_id,
-                "feature": feature,
-                "period_kind": kind,
-                "period_key": key,
-                "count": new_count,
-            },
-            on_conflict="user_id,feature,period_kind,period_key",
-        )
-        .execute()
-    )
+    counter_backend(supabase_admin).set_count(user_id, feature, kind, key, new_count)
 
 
 # ---------- Public API ----------
@@ -258,7 +563,8 @@ def check_and_increment(
 ) -> tuple[bool, dict]:
     """
     Returns (allowed: bool, payload: dict).
-    If allowed=True, this function has already incremented the counter atomically for the current period.
+    If allowed=True, this function has already incremented the counter atomically for the current period
+    (a single `usage_incr_if_below` round trip).
     """
     f = _normalize_feature(feature)
     q = quota_for(plan, f)
@@ -269,8 +575,14 @@ def check_and_increment(
     if q.limit is None:
         return True, {"limit": None}
 
-    used = get_usage_count(supabase_admin, user_id, f, kind, key)
-    if used >= q.limit:
+    if q.limit <= 0:
+        # not included in the plan; a fresh period row would accept the insert, so refuse up front
+        allowed, used = False, 0
+    else:
+        allowed, used = counter_backend(supabase_admin).incr_if_below(
+            user_id, f, kind, key, 1, q.limit
+        )
+    if not allowed:
         return False, {
             "error": "quota_exceeded",
             "feature": f,
@@ -280,9 +592,8 @@ def check_and_increment(
             "message": "You’ve reached your plan limit for this feature.",
         }
 
-    increment_usage(supabase_admin, user_id, f, kind, key, used + 1)
     return True, {
-        "used": used + 1,
+        "used": used,
         "limit": q.limit,
         "period_kind": kind,
         "period_key": key,
@@ -290,6 +601,50 @@ def check_and_increment(
     }
 
 
+def check_and_increment_many(
+    supabase_admin, user_id: str, plan: str, features: list[str]
+) -> tuple[bool, dict]:
+    """
+    Check and increment several quota windows for one request (e.g. chat_messages,
+    chat_messages_hour, chat_messages_day) in one batched operation, all-or-nothing.
+
+    Returns (allowed, payload). On denial nothing is counted and the payload has the
+    same shape as check_and_increment's, for the first window that is over its limit.
+    On success payload["features"] maps each feature to its usage info.
+    """
+    items: list[CounterItem] = []
+    unlimited: dict[str, dict] = {}
+    for feature in features:
+        f = _normalize_feature(feature)
+        q = quota_for(plan, f)
+        if q.limit is None:
+            unlimited[f] = {"limit": None}
+            continue
+        items.append((f, q.period_kind, period_key(q.period_kind), 1, q.limit))
+
+    # a window that can't take even this one use is denied without touching the counters
+    over = next((i for i, item in enumerate(items) if item[3] > item[4]), None)
+    if over is not None:
+        allowed, counts, denied = False, [0] * len(items), over
+    else:
+        allowed, counts, denied = counter_backend(supabase_admin).incr_many_if_below(user_id, items)
+    if not allowed:
+        f, kind, key, _amount, limit = items[denied if denied is not None else 0]
+        return False, {
+            "error": "quota_exceeded",
+            "feature": f,
+            "limit": limit,
+            "period_kind": kind,
+            "period_key": key,
+            "message": "You’ve reached your plan limit for this feature.",
+        }
+
+    out = dict(unlimited)
+    for (f, kind, key, _amount, limit), used in zip(items, counts):
+        out[f] = {"used": used, "limit": limit, "period_kind": kind, "period_key": key, "feature": f}
+    return True, {"features": out}
+
+
 def check_and_add(
     supabase_admin, user_id: str, plan: str, feature: str,
     amount: int, period_kind_override: str | None = None, limit_override: int | None = None
@@ -308,8 +663,13 @@ def check_and_add(
         # Unlimited for this feature
         return True, {"limit": None, "period_kind": kind, "period_key": key, "feature": f}
 
-    used = get_usage_count(supabase_admin, user_id, f, kind, key)
-    if used + amount > limit:
+    backend = counter_backend(supabase_admin)
+    if amount > limit:
+        # a fresh counter would accept the insert, so refuse up front
+        allowed, used = False, backend.get_count(user_id, f, kind, key)
+    else:
+        allowed, used = backend.incr_if_below(user_id, f, kind, key, amount, limit)
+    if not allowed:
         return False, {
             "error": "quota_exceeded",
             "feature": f,
@@ -321,9 +681,8 @@ def check_and_add(
             "message": "You’ve reached your plan limit for this feature.",
         }
 
-    increment_usage(supabase_admin, user_id, f, kind, key, used + amount)
     return True, {
-        "used": used + amount,
+        "used": used,
         "limit": limit,
         "period_kind": kind,
         "period_key": key,
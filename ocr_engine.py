@@ -0,0 +1,172 @@
+# ocr_engine.py
+#
+# Tesseract behind one call, for the ocr_pool worker processes.
+#
+# pytesseract starts a new `tesseract` process for every image, which then
+# reloads the language model (~100-200 ms before any recognition happens).
+# With tesserocr installed (`pip install tesserocr`, links libtesseract) each
+# pool process keeps one warm TessBaseAPI and reuses it for every page; without
+# it we fall back to pytesseract as before.
+#
+# Images are also cheaper to feed in: a 12 MP phone photo is decoded at a
+# reduced scale where the codec allows it (JPEG draft mode decodes at 1/2, 1/4
+# or 1/8 directly), shrunk so its long edge is at most OCR_PHOTO_EDGE (plenty
+# for CV body text), and cropped to the region that actually has ink before
+# the median filter runs. Rendered PDF pages are capped at OCR_MAX_EDGE.
+#
+# Knobs (env):
+#   OCR_ENGINE     auto | tesserocr | pytesseract                 (default auto)
+#   OCR_LANG       tesseract language(s)                          (default eng)
+#   OCR_MAX_EDGE   longest side of a rendered page, px            (default 3300, ~A4 at 300 dpi)
+#   OCR_PHOTO_EDGE longest side of an uploaded image, px          (default 2000)
+#   OCR_CROP       crop to the text region (1/0)                  (default 1)
+
+import os, math, time, logging
+
+logger = logging.getLogger(__name__)
+
+OCR_ENGINE = (os.getenv("OCR_ENGINE") or "auto").strip().lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_MAX_EDGE = int(os.getenv("OCR_MAX_EDGE", "3300"))
+# 2000 rather than e.g. 2200 so a 4032x3024 photo still qualifies for 1/2-scale JPEG decoding
+OCR_PHOTO_EDGE = int(os.getenv("OCR_PHOTO_EDGE", "2000"))
+OCR_CROP = os.getenv("OCR_CROP", "1") not in ("0", "false", "no")
+
+_CROP_PROBE = 400      # the ink box is found on a thumbnail this big
+_CROP_MARGIN = 0.02    # of the image size, kept around the ink box
+
+
+class _TesserocrEngine:
+    """One warm TessBaseAPI per process; pages only pay for recognition."""
+    name = "tesserocr"
+
+    def __init__(self):
+        from tesserocr import PyTessBaseAPI
+        self._api = PyTessBaseAPI(lang=OCR_LANG)
+
+    def recognize(self, img):
+        self._api.SetImage(img)
+        text = self._api.GetUTF8Text() or ""
+        return text.strip(), float(self._api.MeanTextConf() or 0)
+
+
+class _PytesseractEngine:
+    """A tesseract subprocess per image (the old behaviour)."""
+    name = "pytesseract"
+
+    def recognize(self, img):
+        import pytesseract
+        d = pytesseract.image_to_data(img, lang=OCR_LANG, output_type=pytesseract.Output.DICT)
+        lines, confs = {}, []
+        for i, word in enumerate(d.get("text") or []):
+            word = (word or "").strip()
+            if not word:
+                continue
+            try:
+                c = float(d["conf"][i])
+            except (TypeError, ValueError):
+                c = -1.0
+            if c >= 0:
+                confs.append(c)
+            key = (d["block_num"][i], d["par_num"][i], d["line_num"][i])
+            lines.setdefault(key, []).append(word)
+
+        out, prev_par = [], None
+        for (block, par, _line), words in sorted(lines.items()):
+            if prev_par is not None and (block, par) != prev_par:
+                out.append("")  # blank line between paragraphs, like image_to_string
+            out.append(" ".join(words))
+            prev_par = (block, par)
+        return "\n".join(out).strip(), (sum(confs) / len(confs) if confs else 0.0)
+
+
+_engine = None
+_engine_pid = None
+
+
+def engine():
+    """This process's engine, created on first use (pool processes are long-lived)."""
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        _engine = None
+        if OCR_ENGINE in ("auto", "tesserocr"):
+            try:
+                _engine = _TesserocrEngine()
+            except Exception as e:
+                if OCR_ENGINE == "tesserocr":
+                    raise
+                logger.info("tesserocr not available (%s); using pytesseract", e)
+        _engine = _engine or _PytesseractEngine()
+        _engine_pid = os.getpid()
+    return _engine
+
+
+def _reset_engine():
+    global _engine
+    _engine = None
+
+
+# ---------- preprocessing ----------
+
+def _crop_to_text(g):
+    """Crop a grayscale page to the bounding box of its dark pixels, if that saves anything."""
+    probe = g.copy()
+    probe.thumbnail((_CROP_PROBE, _CROP_PROBE))
+    bbox = probe.point(lambda p: 255 if p < 128 else 0).getbbox()
+    if not bbox:
+        return g
+    sx, sy = g.width / probe.width, g.height / probe.height
+    mx, my = int(g.width * _CROP_MARGIN), int(g.height * _CROP_MARGIN)
+    box = (max(0, int(bbox[0] * sx) - mx), max(0, int(bbox[1] * sy) - my),
+           min(g.width, int(bbox[2] * sx) + mx), min(g.height, int(bbox[3] * sy) + my))
+    if (box[2] - box[0]) * (box[3] - box[1]) > 0.9 * g.width * g.height:
+        return g
+    return g.crop(box)
+
+
+def preprocess(img, max_edge: int = OCR_MAX_EDGE):
+    """Grayscale, shrink to max_edge, autocontrast, crop to the text, light denoise."""
+    from PIL import Image, ImageOps, ImageFilter
+    g = img.convert("L")
+    if max(g.size) > max_edge:
+        g.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    g = ImageOps.autocontrast(g)
+    if OCR_CROP:
+        g = _crop_to_text(g)
+    return g.filter(ImageFilter.MedianFilter(size=3))   # on the small image, not the 12 MP one
+
+
+def recognize(img, max_edge: int = OCR_MAX_EDGE) -> tuple:
+    """
+    (text, mean confidence 0-100, info) for an opened image. info has the
+    engine, the size actually OCR'd and the time spent in prep / recognition.
+    """
+    t0 = time.perf_counter()
+    orig = img.size
+    g = preprocess(img, max_edge)
+    t1 = time.perf_counter()
+    eng = engine()
+    try:
+        text, conf = eng.recognize(g)
+    except Exception:
+        _reset_engine()   # don't keep a wedged TessBaseAPI around for the next page
+        raise
+    t2 = time.perf_counter()
+    info = {"engine": eng.name, "size": list(orig), "ocr_size": list(g.size),
+            "prep_ms": round((t1 - t0) * 1000, 1), "ocr_ms": round((t2 - t1) * 1000, 1)}
+    return text, conf, info
+
+
+def recognize_file(path: str) -> tuple:
+    """recognize() for an image file, decoded at reduced scale where possible, camera rotation applied."""
+    from PIL import Image, ImageOps
+    edge = OCR_PHOTO_EDGE
+    with Image.open(path) as raw:
+        w, h = raw.size
+        if max(w, h) > edge:
+            s = edge / max(w, h)
+            # JPEG: decodes at the smallest 1/2, 1/4, 1/8 scale still >= this size; no-op for other formats
+            raw.draft("L", (math.ceil(w * s), math.ceil(h * s)))
+        text, conf, info = recognize(ImageOps.exif_transpose(raw), max_edge=edge)
+    info["size"] = [w, h]
+    return text, conf, info
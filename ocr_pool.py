@@ -0,0 +1,298 @@
+# ocr_pool.py
+#
+# OCR and PDF rasterisation, off the request worker. A scanned PDF is split
+# into pages that are rasterised + OCR'd in parallel in a small process pool;
+# an image is a single task. The web worker only waits on the results.
+# Recognition itself (warm engine, downscaling, cropping) is in ocr_engine.py.
+#
+# Knobs (env):
+#   OCR_WORKERS             processes in the pool                      (default min(4, cpus))
+#   OCR_MAX_JOBS            documents in flight per web worker         (default 2 x OCR_WORKERS)
+#   OCR_MAX_JOBS_PER_USER   documents in flight per user               (default 2)
+#   OCR_JOB_TIMEOUT         seconds per document                       (default 60)
+#   OCR_MAX_PAGES           pages OCR'd per PDF                        (default 10)
+#   OCR_DPI / OCR_DPI_MAX   first pass / escalation resolution         (200 / 300)
+#   OCR_MIN_CONFIDENCE      mean word confidence (0-100) below which a page
+#                           is redone at OCR_DPI_MAX                   (default 70)
+#
+# Back-pressure: when the pool already has OCR_MAX_JOBS documents the call
+# raises OcrBusy (-> HTTP 503); when one user has too many in flight it raises
+# OcrUserBusy (-> HTTP 429). Both carry retry_after. A document's slot is only
+# given back once all of its pages have actually finished, so a timed-out job
+# still counts until the pool is really free again.
+
+import os, time, threading, logging, multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import ocr_engine
+
+logger = logging.getLogger(__name__)
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+OCR_MAX_JOBS = int(os.getenv("OCR_MAX_JOBS", str(2 * OCR_WORKERS)))
+OCR_MAX_JOBS_PER_USER = int(os.getenv("OCR_MAX_JOBS_PER_USER", "2"))
+OCR_JOB_TIMEOUT = float(os.getenv("OCR_JOB_TIMEOUT", "60"))
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "10"))
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_DPI_MAX = int(os.getenv("OCR_DPI_MAX", "300"))
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "70"))
+RETRY_AFTER = 5
+
+
+class OcrBusy(RuntimeError):
+    """The pool is saturated; ask the client to come back shortly."""
+    status = 503
+    error = "ocr_busy"
+
+    def __init__(self, message="Text recognition is busy right now, please retry in a few seconds.",
+                 retry_after=RETRY_AFTER):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class OcrUserBusy(OcrBusy):
+    status = 429
+
+    def __init__(self, message="You already have documents being processed, please wait for them to finish.",
+                 retry_after=RETRY_AFTER):
+        super().__init__(message, retry_after)
+
+
+class OcrTimeout(RuntimeError):
+    pass
+
+
+# ---------- worker side (runs inside the pool) ----------
+
+def ocr_pdf_page(path: str, page: int, dpi: int):
+    """(text, confidence, info) for one PDF page."""
+    from pdf2image import convert_from_path   # needs poppler-utils
+    t0 = time.perf_counter()
+    imgs = convert_from_path(path, dpi=dpi, first_page=page, last_page=page, grayscale=True)
+    if not imgs:
+        return "", 0.0, {}
+    raster_ms = round((time.perf_counter() - t0) * 1000, 1)
+    text, conf, info = ocr_engine.recognize(imgs[0])
+    info["raster_ms"] = raster_ms
+    return text, conf, info
+
+
+def ocr_image_file(path: str):
+    """(text, confidence, info) for one image file."""
+    try:
+        from pillow_heif import register_heif_opener   # spawned workers don't inherit app.py's registration
+        register_heif_opener()
+    except Exception:
+        pass
+    return ocr_engine.recognize_file(path)
+
+
+# ---------- web worker side ----------
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+_jobs = 0
+_user_jobs: Counter = Counter()
+_stats = {"jobs": 0, "pages": 0, "escalated_pages": 0, "busy": 0, "user_busy": 0,
+          "timeouts": 0, "errors": 0, "total_ms": 0.0, "page_ms": 0.0}
+_engines: Counter = Counter()   # pages recognised per engine (tesserocr / pytesseract)
+
+
+def _executor(reset: bool = False) -> ProcessPoolExecutor:
+    global _pool, _pool_pid
+    with _lock:
+        if reset and _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn, not fork: the web worker has live threads and sockets
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _acquire(owner):
+    global _jobs
+    with _lock:
+        if _jobs >= OCR_MAX_JOBS:
+            _stats["busy"] += 1
+            raise OcrBusy()
+        if owner is not None and _user_jobs[owner] >= OCR_MAX_JOBS_PER_USER:
+            _stats["user_busy"] += 1
+            raise OcrUserBusy()
+        _jobs += 1
+        if owner is not None:
+            _user_jobs[owner] += 1
+
+
+def _release(owner):
+    global _jobs
+    with _lock:
+        _jobs -= 1
+        if owner is not None:
+            _user_jobs[owner] -= 1
+            if _user_jobs[owner] <= 0:
+                del _user_jobs[owner]
+
+
+def _run(tasks, owner, timeout):
+    """
+    Submit one document's tasks and wait up to `timeout`. Returns one entry
+    per task: the result, an Exception, or None if it didn't finish in time.
+    """
+    _acquire(owner)
+    state = {"left": 0, "all_submitted": False}
+
+    def _finished(_fut=None):
+        with _lock:
+            state["left"] -= 1
+            last = state["left"] == 0 and state["all_submitted"]
+        if last:
+            _release(owner)
+
+    futs = []
+    try:
+        pool = _executor()
+        for fn, args in tasks:
+            with _lock:
+                state["left"] += 1
+            try:
+                fut = pool.submit(fn, *args)
+            except BaseException:
+                with _lock:
+                    state["left"] -= 1
+                raise
+            fut.add_done_callback(_finished)
+            futs.append(fut)
+    except BrokenProcessPool:
+        _executor(reset=True)
+        raise
+    finally:
+        with _lock:
+            state["all_submitted"] = True
+            last = state["left"] == 0
+        if last:
+            _release(owner)
+
+    done, not_done = wait(futs, timeout=timeout)
+    for fut in not_done:
+        fut.cancel()   # queued pages never start; running ones finish and free the slot
+    out = []
+    for fut in futs:
+        if fut not in done:
+            out.append(None)
+            continue
+        err = fut.exception()
+        if isinstance(err, BrokenProcessPool):
+            _executor(reset=True)
+        out.append(err if err is not None else fut.result())
+    return out
+
+
+def _first_error(results):
+    return next((r for r in results if isinstance(r, BaseException)), None)
+
+
+def ocr_pdf(path: str, page_count: int | None = None, owner=None, timeout: float | None = None,
+            pages: list[int] | None = None) -> dict:
+    """
+    OCR PDF pages in parallel: `pages` (1-based) if given — e.g. only the pages
+    of a mixed PDF that have no text layer — else the whole document. First
+    pass at OCR_DPI; pages whose confidence is below OCR_MIN_CONFIDENCE are
+    redone at OCR_DPI_MAX if time (and pool capacity) allows.
+    Returns {"text", "pages", "by_page", "page_stats", "confidence", "dpi", "timed_out"}.
+    """
+    t0 = time.monotonic()
+    timeout = OCR_JOB_TIMEOUT if timeout is None else timeout
+    if pages is None:
+        if not page_count:
+            from pdf2image import pdfinfo_from_path
+            page_count = int(pdfinfo_from_path(path).get("Pages") or 0)
+        pages = list(range(1, page_count + 1))
+    pages = sorted(set(pages))[:OCR_MAX_PAGES]
+    if not pages:
+        return {"text": "", "pages": 0, "by_page": {}, "page_stats": [], "confidence": 0.0, "dpi": [],
+                "timed_out": 0}
+
+    results = _run([(ocr_pdf_page, (path, p, OCR_DPI)) for p in pages], owner, timeout)
+    dpis = [OCR_DPI] * len(pages)
+
+    low = [i for i, r in enumerate(results) if isinstance(r, tuple) and r[1] < OCR_MIN_CONFIDENCE]
+    left = timeout - (time.monotonic() - t0)
+    if low and OCR_DPI_MAX > OCR_DPI and left > 1:
+        try:
+            redo = _run([(ocr_pdf_page, (path, pages[i], OCR_DPI_MAX)) for i in low], owner, left)
+            for i, r in zip(low, redo):
+                if isinstance(r, tuple) and r[1] > results[i][1]:
+                    results[i], dpis[i] = r, OCR_DPI_MAX
+            with _lock:
+                _stats["escalated_pages"] += len(low)
+        except OcrBusy:
+            pass   # keep the first pass rather than fail the upload
+
+    return _summarize(results, dpis, t0, pages)
+
+
+def ocr_image(path: str, owner=None, timeout: float | None = None) -> dict:
+    """OCR one image file. Returns {"text", "pages", "by_page", "page_stats", "confidence", "dpi", "timed_out"}."""
+    t0 = time.monotonic()
+    results = _run([(ocr_image_file, (path,))], owner, OCR_JOB_TIMEOUT if timeout is None else timeout)
+    return _summarize(results, [None], t0, [1])
+
+
+def _summarize(results, dpis, t0, pages) -> dict:
+    ok = [r for r in results if isinstance(r, tuple)]
+    timed_out = sum(1 for r in results if r is None)
+    page_stats = []
+    for p, r, d in zip(pages, results, dpis):
+        if isinstance(r, tuple):
+            info = r[2] if len(r) > 2 else {}
+            page_stats.append({"page": p, "confidence": round(r[1], 1), "dpi": d, **info})
+            logger.info("ocr page %s: conf %.0f, %s ms raster / %s ms prep / %s ms ocr (%s, %s)",
+                        p, r[1], info.get("raster_ms", 0), info.get("prep_ms"), info.get("ocr_ms"),
+                        info.get("engine"), "x".join(map(str, info.get("ocr_size") or [])))
+    with _lock:
+        for ps in page_stats:
+            _engines[ps.get("engine") or "unknown"] += 1
+            _stats["page_ms"] += ps.get("raster_ms", 0) + (ps.get("prep_ms") or 0) + (ps.get("ocr_ms") or 0)
+        _stats["jobs"] += 1
+        _stats["pages"] += len(results)
+        _stats["timeouts"] += timed_out
+        _stats["errors"] += sum(1 for r in results if isinstance(r, BaseException))
+        _stats["total_ms"] += (time.monotonic() - t0) * 1000
+
+    if not ok:
+        err = _first_error(results)
+        if err is not None:
+            raise err          # e.g. TesseractNotFoundError, so callers can fall back
+        raise OcrTimeout(f"OCR did not finish within the time limit ({len(results)} page(s))")
+    if timed_out:
+        logger.warning("ocr: %d of %d page(s) timed out; returning partial text", timed_out, len(results))
+
+    return {
+        "text": "\n".join(r[0] for r in ok if r[0]).strip(),
+        "pages": len(results),
+        "by_page": {p: r[0] for p, r in zip(pages, results) if isinstance(r, tuple)},
+        "page_stats": page_stats,
+        "confidence": round(sum(r[1] for r in ok) / len(ok), 1),
+        "dpi": [d for r, d in zip(results, dpis) if isinstance(r, tuple)],
+        "timed_out": timed_out,
+    }
+
+
+def stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+        s["in_flight"] = _jobs
+        s["engines"] = dict(_engines)
+    s["avg_ms"] = round(s["total_ms"] / s["jobs"], 1) if s["jobs"] else 0.0
+    done_pages = sum(s["engines"].values())
+    s["avg_page_ms"] = round(s["page_ms"] / done_pages, 1) if done_pages else 0.0
+    s.update(workers=OCR_WORKERS, max_jobs=OCR_MAX_JOBS, max_jobs_per_user=OCR_MAX_JOBS_PER_USER,
+             dpi=OCR_DPI, dpi_max=OCR_DPI_MAX)
+    return s
@@ -0,0 +1,259 @@
+# response_cache.py
+#
+# Cache of model replies for prompts that many users send almost word for word
+# ("skills for data analyst", "interview question for a PM").
+#
+# Two tiers:
+#   * exact: the key is a hash of the endpoint, model, temperature, the other
+#     request options and the prompt, normalized (case, whitespace, trailing
+#     punctuation). Shared between workers through REDIS_URL when it's set.
+#   * similar (optional, RESPONSE_CACHE_SEMANTIC=1): a local hashed bag-of-words
+#     embedding (no model call, no extra dependency) of what the user typed.
+#     A query whose cosine similarity with a cached one (same route, model and
+#     settings) is at least RESPONSE_CACHE_SIM gets that reply. Only for short
+#     queries (RESPONSE_CACHE_SIM_WORDS) and only on routes that ask for it;
+#     per worker.
+#
+# Personal data: every entry has a scope. Callers pass scope=None ("shared")
+# only for prompts built from generic inputs; anything with a user's own
+# material (attachments, resume text, chat history) gets the user's id as
+# scope, so it can only be served back to them, or isn't cached at all.
+# Free text the user typed is only shared when shareable() says so: short
+# (RESPONSE_CACHE_SHARED_CHARS), a few lines at most, no email, phone number
+# or link. A pasted resume or cover letter fails that and is keyed per user.
+# Lookups never cross scopes, in either tier.
+#
+# Sampled replies (temperature > 0) can keep several variants per key: until
+# `variants` replies are stored every call is a miss, then a random one is
+# served, so "another question" still gets a different question.
+#
+#   RESPONSE_CACHE            1/0                                (default 1)
+#   RESPONSE_CACHE_TTL        seconds an entry lives             (default 86400)
+#   RESPONSE_CACHE_MAX        entries per worker                 (default 5000)
+#   RESPONSE_CACHE_SEMANTIC   similarity tier 1/0                (default 0)
+#   RESPONSE_CACHE_SIM        cosine threshold                   (default 0.92)
+#   RESPONSE_CACHE_SIM_WORDS  longest prompt it applies to       (default 40 words)
+#   RESPONSE_CACHE_SHARED_CHARS  longest free text shared across users (default 300)
+
+import os, re, json, math, time, random, hashlib, threading, logging
+from collections import OrderedDict
+
+from shared_store import get_shared_store
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "1") not in ("0", "false", "no")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", "5000"))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "0") in ("1", "true", "yes")
+RESPONSE_CACHE_SIM = float(os.getenv("RESPONSE_CACHE_SIM", "0.92"))
+RESPONSE_CACHE_SIM_WORDS = int(os.getenv("RESPONSE_CACHE_SIM_WORDS", "40"))
+RESPONSE_CACHE_SHARED_CHARS = int(os.getenv("RESPONSE_CACHE_SHARED_CHARS", "300"))
+
+_DIMS = 1 << 12
+_WORD = re.compile(r"[a-z0-9+#.]+")
+_STOP = frozenset("a an the for of to in on and or i my me as at is be with what which".split())
+# contact details: an email, a phone number (10+ digits), a link
+_PERSONAL = re.compile(r"[\w.+-]+@[\w-]+\.\w|(?:\d[\s().-]?){10,}|https?://|www\.", re.I)
+
+
+def normalize(text: str) -> str:
+    t = re.sub(r"\s+", " ", (text or "").strip().lower())
+    return t.rstrip(" ?!.")
+
+
+def shareable(text: str) -> bool:
+    """May a reply built from this user-typed text be served to other users?"""
+    t = (text or "").strip()
+    return len(t) <= RESPONSE_CACHE_SHARED_CHARS and t.count("\n") < 4 and not _PERSONAL.search(t)
+
+
+def _embed(text: str) -> dict[int, float]:
+    """Hashed unigrams + bigrams, L2-normalized, as a sparse vector."""
+    words = [w.rstrip(".") for w in _WORD.findall(text)]
+    words = [w.removesuffix("s") if len(w) > 3 else w for w in words if w and w not in _STOP]
+    feats = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vec: dict[int, float] = {}
+    for f in feats:
+        h = int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), "little")
+        i = h % _DIMS
+        vec[i] = vec.get(i, 0.0) + (1.0 if (h >> 63) else -1.0)
+    norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+    return {i: v / norm for i, v in vec.items() if v}
+
+
+def _cosine(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+class ResponseCache:
+    def __init__(self, ttl: int = RESPONSE_CACHE_TTL, maxsize: int = RESPONSE_CACHE_MAX,
+                 semantic: bool = RESPONSE_CACHE_SEMANTIC, threshold: float = RESPONSE_CACHE_SIM,
+                 enabled: bool = RESPONSE_CACHE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.semantic = semantic
+        self.threshold = threshold
+        self.enabled = enabled
+        # key -> {"expires", "ns", "vec", "replies": [{"text", "ms", "tokens"}]}
+        self._data: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "bypassed": 0,
+                      "evictions": 0, "shared_errors": 0, "ms_saved": 0.0, "tokens_saved": 0}
+
+    def _bump(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    # ---------- keys ----------
+
+    @staticmethod
+    def lookup_key(endpoint: str, model: str, temperature: float, prompt_parts, query: str | None = None,
+                   scope=None, **options) -> dict:
+        """
+        Everything a lookup needs. The exact key covers all of `prompt_parts`
+        (the message contents, in order) plus `options` (max_tokens,
+        response_format, ...). `query` is the variable part the user typed;
+        the similarity tier compares only that, between prompts of the same
+        endpoint/model/options/scope.
+        """
+        parts = [normalize(p) for p in prompt_parts if p]
+        scope = "shared" if scope is None else f"user:{scope}"
+        ns_src = json.dumps([endpoint, model, round(float(temperature), 2), scope,
+                             sorted((k, repr(v)) for k, v in options.items())], ensure_ascii=False)
+        ns = hashlib.sha256(ns_src.encode("utf-8")).hexdigest()[:24]
+        key = hashlib.sha256("\x00".join([ns, *parts]).encode("utf-8")).hexdigest()
+        text = normalize(query) if query is not None else (parts[-1] if parts else "")
+        return {"key": key, "ns": ns, "text": text, "endpoint": endpoint}
+
+    def _similar_ok(self, k: dict) -> bool:
+        return self.semantic and 0 < len(k["text"].split()) <= RESPONSE_CACHE_SIM_WORDS
+
+    # ---------- lookups ----------
+
+    def get(self, k: dict, variants: int = 1, similar: bool = False) -> dict | None:
+        """A cached reply {"text", "ms", "tokens", "tier"} or None."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        entry = self._get_exact(k["key"], now)
+        tier = "exact"
+        if entry is None and similar and self._similar_ok(k):
+            entry, tier = self._get_similar(k, now), "similar"
+        if entry is None or len(entry["replies"]) < max(1, variants):
+            self._bump("misses")
+            return None
+        reply = random.choice(entry["replies"])
+        with self._lock:
+            self.stats["hits"] += 1
+            self.stats["similar_hits"] += tier == "similar"
+            self.stats["ms_saved"] += reply.get("ms") or 0
+            self.stats["tokens_saved"] += reply.get("tokens") or 0
+        return {**reply, "tier": tier}
+
+    def _get_exact(self, key: str, now: float):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry["expires"] > now:
+                self._data.move_to_end(key)
+                return entry
+        store = get_shared_store()
+        if store is not None:
+            try:
+                raw = store.get(f"resp:{key}")
+            except Exception:
+                logger.warning("response cache: shared read failed", exc_info=True)
+                self._bump("shared_errors")
+                raw = None
+            if raw is not None:
+                return json.loads(raw)
+        return None
+
+    def _get_similar(self, k: dict, now: float):
+        vec = _embed(k["text"])
+        best, best_sim = None, self.threshold
+        with self._lock:
+            for entry in self._data.values():
+                if entry["ns"] != k["ns"] or entry["vec"] is None or entry["expires"] <= now:
+                    continue
+                sim = _cosine(vec, entry["vec"])
+                if sim >= best_sim:
+                    best, best_sim = entry, sim
+        return best
+
+    # ---------- storing ----------
+
+    def put(self, k: dict, text: str, ms: float = 0.0, tokens: int = 0, variants: int = 1):
+        """Store a fresh reply (up to `variants` per key)."""
+        if not self.enabled or not text:
+            return
+        reply = {"text": text, "ms": round(ms, 1), "tokens": int(tokens or 0)}
+        now = time.time()
+        embed = self._similar_ok(k)
+        with self._lock:
+            entry = self._data.get(k["key"])
+            if entry is None or entry["expires"] <= now:
+                entry = {"expires": now + self.ttl, "ns": k["ns"], "vec": _embed(k["text"]) if embed else None,
+                         "replies": []}
+                self._data[k["key"]] = entry
+            if len(entry["replies"]) < max(1, variants):
+                entry["replies"].append(reply)
+            self._data.move_to_end(k["key"])
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+            self.stats["stores"] += 1
+            shared = {"expires": entry["expires"], "ns": entry["ns"], "vec": None, "replies": list(entry["replies"])}
+        store = get_shared_store()
+        if store is not None:
+            try:
+                store.set(f"resp:{k['key']}", json.dumps(shared, ensure_ascii=False), ex=self.ttl)
+            except Exception:
+                logger.warning("response cache: shared write failed", exc_info=True)
+                self._bump("shared_errors")
+
+    def bypass(self):
+        """Count a request that wasn't cacheable (personal context)."""
+        self._bump("bypassed")
+
+    # ---------- OpenAI helper ----------
+
+    def completion(self, client, endpoint: str, model: str, messages: list[dict], temperature: float,
+                   query: str | None = None, scope=None, variants: int = 1, similar: bool = False,
+                   accept=None, **options) -> tuple[str, bool]:
+        """
+        chat.completions.create() behind the cache: (reply text, served from cache).
+        `query` is what the user typed (see lookup_key); needed for similar=True.
+        `accept(text) -> bool` keeps replies the caller can't use out of the cache;
+        so are replies that didn't finish ("length", "content_filter").
+        """
+        k = self.lookup_key(endpoint, model, temperature, [m["content"] for m in messages], query, scope, **options)
+        hit = self.get(k, variants=variants, similar=similar)
+        if hit is not None:
+            return hit["text"], True
+        t0 = time.monotonic()
+        resp = client.chat.completions.create(model=model, messages=messages, temperature=temperature, **options)
+        text = (resp.choices[0].message.content or "").strip()
+        usage = getattr(resp, "usage", None)
+        if resp.choices[0].finish_reason != "stop":
+            return text, False
+        if accept is not None and not accept(text):
+            return text, False
+        self.put(k, text, ms=(time.monotonic() - t0) * 1000,
+                 tokens=getattr(usage, "total_tokens", 0) or 0, variants=variants)
+        return text, False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            s = {**self.stats, "size": len(self._data)}
+        looked = s["hits"] + s["misses"]
+        s["hit_rate"] = round(s["hits"] / looked, 3) if looked else 0.0
+        s["ms_saved"] = round(s["ms_saved"], 1)
+        s.update(enabled=self.enabled, semantic=self.semantic, threshold=self.threshold, ttl=self.ttl,
+                 shared=get_shared_store() is not None)
+        return s
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,103 @@
+# scripts/bench_ats.py
+#
+# Times the deterministic ATS scorers of /api/resume-analysis on a fixed set
+# of synthetic resumes (seeded, so every run scores the same text).
+#
+# In a tree with ParsedResume the resume is parsed once and handed to every
+# scorer, as resume_analysis does; in an older tree each scorer gets the raw
+# text and parses it itself. To compare against an older commit:
+#
+#   git worktree add /tmp/jobcus-old <commit>
+#   python scripts/bench_ats.py --tree /tmp/jobcus-old
+#   python scripts/bench_ats.py
+#   git worktree remove /tmp/jobcus-old
+#
+# JD terms are built once per JD outside the timed loop (as the batch endpoint
+# does), so the per-resume figure is resume-side work only; building the
+# terms is timed on its own. It also checks that text and ParsedResume input
+# score the same in this tree.
+#
+#   --tree     checkout to load blueprints/resumes.py from  (default: this one)
+#   --resumes  resumes per round                             (default 60)
+#   --rounds   best of this many rounds                      (default 5)
+
+import os, sys, json, time, random, argparse
+
+VERBS = ["Led", "Managed", "Built", "Implemented", "Improved", "Reduced", "Helped", "Supported",
+         "Designed", "Automated", "Worked on"]
+SKILLS = ["agile", "scrum", "jira", "confluence", "sql", "power bi", "stakeholder management", "risk register",
+          "budget", "kpi", "AWS", "UAT", "python", "excel", "ITIL", "PMP"]
+JD = ("We are hiring a Senior Project Manager with 5+ years experience in agile and scrum delivery. "
+      "You will own the risk register, manage stakeholders, budget and timeline, run UAT and report KPIs in Power BI. "
+      "Experience with Jira, Confluence, MS Project and AWS cloud is desirable; PMP or PRINCE2 certification preferred. ") * 3
+
+
+def make_resume(seed: int) -> str:
+    r = random.Random(seed)
+    out = ["Jane Doe", "jane@example.com | +44 7700 900123 | London, UK", "", "Professional Summary",
+           "Project manager with %d years delivering %s programmes." % (r.randint(2, 12), r.choice(["healthcare", "fintech", "cloud"])),
+           "", "Experience"]
+    year = 2024
+    for j in range(r.randint(1, 5)):
+        y0 = year - r.randint(1, 4)
+        out.append("%s at Company %d   %s %d - %s" % (r.choice(["Senior Project Manager", "Delivery Manager", "Analyst"]), j,
+                                                    r.choice(["Jan", "March", "Sep"]), y0, "Present" if j == 0 else str(year)))
+        for _ in range(r.randint(2, 8)):
+            out.append("%s %s %s across %d teams, saving %d%% cost" % (r.choice(["• ", "- ", ""]), r.choice(VERBS),
+                                                                     r.choice(SKILLS), r.randint(2, 9), r.randint(5, 40)))
+        year = y0
+    out += ["", "Education", "BSc Computer Science, University of Leeds 2012", "", "Skills", ", ".join(r.sample(SKILLS, 8))]
+    if r.random() < 0.3:
+        out += ["", "References", "Available on request", "Date of birth: 1990"]
+    return "\n".join(out)
+
+
+def score(R, resume, jd: str, jd_terms: dict, level: str = "mid") -> dict:
+    """Every deterministic scorer resume_analysis runs, in its order."""
+    pf, hard = R._parse_and_format_score(resume, "text", None)
+    roles = R._extract_roles_with_dates(resume)
+    return dict(
+        pf=pf, sec=R._sections_structure_score(resume), roles=roles, jd_terms=jd_terms,
+        kw=R._keyword_match_to_jd(resume, jd_terms, roles), exp=R._experience_relevance(jd, roles, resume),
+        q=R._quant_stats(resume), edu=R._education_and_certs(resume, jd_terms), el=R._eligibility_location(resume),
+        rb=R._readability_brevity(resume, level), dp=R._content_depth_penalty(resume, level),
+        pen=R._penalties(resume, roles, hard),
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tree", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    ap.add_argument("--resumes", type=int, default=60)
+    ap.add_argument("--rounds", type=int, default=5)
+    args = ap.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.tree))
+    import blueprints.resumes as R
+
+    parse_once = hasattr(R, "ParsedResume")
+    corpus = [(make_resume(i), JD if i % 3 else "") for i in range(args.resumes)]
+
+    t0 = time.perf_counter()
+    terms = {jd: R._build_jd_terms(jd) for jd in (JD, "")}
+    jd_ms = (time.perf_counter() - t0) * 1000
+
+    if parse_once:
+        same = sum(json.dumps(score(R, text, jd, terms[jd]), default=str)
+                   == json.dumps(score(R, R.ParsedResume(text), jd, terms[jd]), default=str)
+                   for text, jd in corpus)
+        print(f"text vs ParsedResume input: {same}/{len(corpus)} identical")
+
+    best = float("inf")
+    for _ in range(args.rounds):
+        t0 = time.perf_counter()
+        for text, jd in corpus:
+            score(R, R.ParsedResume(text) if parse_once else text, jd, terms[jd])
+        best = min(best, time.perf_counter() - t0)
+    mode = "parse once (ParsedResume)" if parse_once else "text into every scorer"
+    print(f"{args.tree}: {mode}, {best / len(corpus) * 1000:.2f} ms per resume "
+          f"(best of {args.rounds} x {len(corpus)}); building JD terms {jd_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# scripts/bench_summary.py
+#
+# Prompt tokens per /api/ask turn over one long synthetic chat, three ways:
+#
+#   old       two system prompts + history[-6:] + the message (the builder
+#             before chat_context.py)
+#   budget    chat_context.build() with the plan's token budget, no summary
+#   summary   the same plus the rolling summary (conversation_summary.py),
+#             updated every CHAT_SUMMARY_EVERY replies
+#
+# No network: the conversation lives in an in-memory table and the
+# summarizer is a stand-in that returns the first --summary-words words it
+# is given, so the numbers depend only on the builders. Token counts are
+# exact with tiktoken installed, estimated otherwise (see chat_context.py).
+#
+#   python scripts/bench_summary.py [--turns 50] [--plan standard]
+#
+#   --turns          user/assistant exchanges                    (default 50)
+#   --user-words     words per user message                      (default 45)
+#   --reply-words    words per assistant reply                   (default 260)
+#   --summary-words  words the stand-in summarizer returns       (default 220)
+#   --plan           plan whose chat_context_tokens budget is used (default standard)
+
+import os, sys, random, argparse, statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat_context
+from conversation_summary import ConversationSummaries
+
+WORDS = ("resume interview salary product manager data analyst python sql leadership stakeholder "
+         "roadmap metrics offer negotiation portfolio").split()
+SYSTEM = ["career prompt " * 120, "style " * 40]   # about the size of the real two
+
+
+class _Query:
+    """Just enough of the supabase-py query builder for ConversationSummaries."""
+
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.filters, self.order_by, self.max_rows, self.op, self.payload = [], None, None, "select", None
+
+    def select(self, *_):
+        return self
+
+    def eq(self, k, v):
+        self.filters.append(lambda r: str(r.get(k)) == str(v)); return self
+
+    def gt(self, k, v):
+        self.filters.append(lambda r: r.get(k) > v); return self
+
+    def is_(self, k, _v):
+        self.filters.append(lambda r: r.get(k) is None); return self
+
+    def order(self, k, desc=False):
+        self.order_by = (k, desc); return self
+
+    def limit(self, n):
+        self.max_rows = n; return self
+
+    def insert(self, row):
+        self.op, self.payload = "insert", row; return self
+
+    def update(self, row):
+        self.op, self.payload = "update", row; return self
+
+    def execute(self):
+        rows = self.db.setdefault(self.table, [])
+        if self.op == "insert":
+            rows.append(dict(self.payload))
+            return argparse.Namespace(data=[self.payload])
+        hit = [r for r in rows if all(f(r) for f in self.filters)]
+        if self.op == "update":
+            for r in hit:
+                r.update(self.payload)
+            return argparse.Namespace(data=hit)
+        if self.order_by:
+            hit.sort(key=lambda r: r[self.order_by[0]], reverse=self.order_by[1])
+        return argparse.Namespace(data=[dict(r) for r in hit[:self.max_rows]])
+
+
+class _MemoryClient:
+    def __init__(self):
+        self.db = {"conversations": [{"id": "c1", "summary": None, "summary_upto": None}]}
+
+    def table(self, name):
+        return _Query(self.db, name)
+
+
+def run(mode: str, args) -> tuple[list[int], int, dict]:
+    rnd = random.Random(1)
+    text = lambda n: " ".join(rnd.choice(WORDS) for _ in range(n))
+    client = _MemoryClient()
+    summaries = ConversationSummaries(enabled=mode == "summary")
+    summarizer_in = 0
+
+    def summarize(msgs):
+        nonlocal summarizer_in
+        summarizer_in += sum(chat_context.count_tokens(m["content"]) for m in msgs)
+        return " ".join(msgs[-1]["content"].split()[:args.summary_words])
+
+    tokens, ts = [], 0
+    for turn in range(args.turns):
+        user = text(args.user_words)
+        rows = sorted(client.db.get("conversation_messages", []), key=lambda r: r["created_at"])
+        history = [{"role": r["role"], "content": r["content"]} for r in rows[-summaries.window:]]
+        if mode == "old":
+            msgs = [{"role": "system", "content": p} for p in SYSTEM] + history[-6:] + [{"role": "user", "content": user}]
+            tokens.append(chat_context.REPLY_PRIMING + sum(chat_context._msg_tokens(m["content"], "gpt-4o-mini") for m in msgs))
+        else:
+            summary = summaries.get(client, "c1") if mode == "summary" else None
+            _msgs, report = chat_context.build("gpt-4o-mini", SYSTEM, user, history=history, summary=summary, plan=args.plan)
+            tokens.append(report["prompt_tokens"])
+        for role, content in (("user", user), ("assistant", text(args.reply_words))):
+            ts += 1
+            client.table("conversation_messages").insert(
+                {"conversation_id": "c1", "role": role, "content": content, "created_at": f"{ts:06d}"}).execute()
+        if mode == "summary" and (turn + 1) % summaries.every == 0:
+            summaries.update(client, "c1", summarize)
+    return tokens, summarizer_in, summaries.snapshot()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=50)
+    ap.add_argument("--user-words", type=int, default=45)
+    ap.add_argument("--reply-words", type=int, default=260)
+    ap.add_argument("--summary-words", type=int, default=220)
+    ap.add_argument("--plan", default="standard")
+    args = ap.parse_args()
+
+    print(f"tokenizer: {'tiktoken' if chat_context.tiktoken is not None else 'estimate'}, "
+          f"{args.turns} turns, plan {args.plan}")
+    for mode in ("old", "budget", "summary"):
+        tokens, summarizer_in, snap = run(mode, args)
+        line = (f"{mode:8s} prompt tokens/turn: mean {statistics.mean(tokens):6.0f}  max {max(tokens):6d}  "
+                f"last {tokens[-1]:6d}")
+        if mode == "summary":
+            line += (f"  | {snap['updates']} updates, {snap['messages_folded']} messages folded, "
+                     f"summarizer input {summarizer_in / args.turns:.0f} tokens/turn")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
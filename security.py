@@ -1,5 +1,7 @@
 # security.py
-import os, requests, logging
+import os, logging
+
+import http_pool
 from flask import Request
 
 # Configure logging
@@ -46,7 +48,7 @@ def verify_turnstile(req: Request) -> tuple[bool, dict]:
 
     try:
         logger.info("Verifying Turnstile token for IP %s", data["remoteip"])
-        r = requests.post(TURNSTILE_VERIFY_URL, data=data, timeout=6)
+        r = http_pool.post(TURNSTILE_VERIFY_URL, data=data, timeout=6)
         j = r.json()
         if j.get("success"):
             logger.info("Turnstile verification successful")
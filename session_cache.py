@@ -0,0 +1,272 @@
+# session_cache.py
+#
+# Keeps the per-request auth checks off Supabase.
+#
+# Before: every authenticated request did
+#   1. select users           (load_user)
+#   2. select user_sessions   (enforce_single_active_session)
+#   3. update last_seen       (same)
+#
+# Now:
+#   * user rows and session rows sit in a small in-process LRU for
+#     USER_CACHE_TTL seconds (default 60);
+#   * the user row is also carried in a short-lived signed cookie
+#     (USER_COOKIE_MAX_AGE, default 5 min) so a fresh worker doesn't have to
+#     hit the database either;
+#   * last_seen is touched at most once per SESSION_TOUCH_INTERVAL seconds per
+#     session, and the touches are written in one batched UPDATE.
+#
+# Anything that changes plan/role/session state must call invalidate_user().
+# That drops this worker's entries right away and, when a shared store is
+# configured (REDIS_URL), records the time so other workers and older cookies
+# are ignored too.
+#
+# Without a shared store an invalidation can't reach the other workers, so a
+# cancelled plan would keep its paid features there for as long as the cached
+# copies live. In that mode the cookie tier is off (cookies are neither issued
+# nor trusted) and rows are cached for USER_CACHE_LOCAL_TTL (default 5 s) at most.
+
+import os, time, threading, logging
+from collections import OrderedDict
+from datetime import datetime
+
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+from shared_store import get_shared_store
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_LOCAL_TTL = int(os.getenv("USER_CACHE_LOCAL_TTL", "5"))
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "5000"))
+USER_COOKIE = "jobcus_uc"
+USER_COOKIE_MAX_AGE = int(os.getenv("USER_COOKIE_MAX_AGE", "300"))
+SESSION_TOUCH_INTERVAL = int(os.getenv("SESSION_TOUCH_INTERVAL", "300"))
+SESSION_TOUCH_FLUSH = int(os.getenv("SESSION_TOUCH_FLUSH", "30"))
+
+# the fields the User model needs; nothing else goes into the cookie
+USER_FIELDS = ("auth_id", "email", "fullname", "role", "plan", "plan_status")
+
+_cookie_signer = URLSafeTimedSerializer(os.getenv("SECRET_KEY", "dev"), salt="user-cache")
+
+
+class TTLCache:
+    """Thread-safe LRU with a per-entry time-to-live."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (value, stored_at) or None."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.time() - stored_at > self.ttl:
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return value, stored_at
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_where(self, pred):
+        with self._lock:
+            for k in [k for k, (_ts, v) in self._data.items() if pred(v)]:
+                self._data.pop(k, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+_users = TTLCache(USER_CACHE_MAX, USER_CACHE_TTL)      # auth_id -> user row
+_sessions = TTLCache(USER_CACHE_MAX, USER_CACHE_TTL)   # sid -> user_sessions row
+_invalidated: dict[str, float] = {}                    # auth_id -> when (this worker)
+_inv_lock = threading.Lock()
+
+
+def _inv_key(auth_id: str) -> str:
+    return f"ucache:inv:{auth_id}"
+
+
+def shared() -> bool:
+    """True when invalidations reach every worker (REDIS_URL is set and up)."""
+    return get_shared_store() is not None
+
+
+def _row_ttl() -> float:
+    return USER_CACHE_TTL if shared() else min(USER_CACHE_TTL, USER_CACHE_LOCAL_TTL)
+
+
+def invalidated_at(auth_id: str) -> float:
+    """Latest invalidation time for this user, local or shared (0 if never)."""
+    with _inv_lock:
+        ts = _invalidated.get(auth_id, 0.0)
+    store = get_shared_store()
+    if store is not None:
+        try:
+            raw = store.get(_inv_key(auth_id))
+            if raw is not None:
+                ts = max(ts, float(raw))
+        except Exception:
+            logger.warning("session cache: shared store read failed", exc_info=True)
+    return ts
+
+
+def invalidate_user(auth_id: str | None):
+    """Forget cached user/session state for auth_id (call after any plan/role/session change)."""
+    if not auth_id:
+        return
+    auth_id = str(auth_id)
+    now = time.time()
+    _users.pop(auth_id)
+    _sessions.pop_where(lambda row: str((row or {}).get("auth_id")) == auth_id)
+    with _inv_lock:
+        _invalidated[auth_id] = now
+        if len(_invalidated) > USER_CACHE_MAX:
+            # anything older than the longest-lived cached copy no longer matters
+            cutoff = now - max(USER_CACHE_TTL, USER_COOKIE_MAX_AGE)
+            for k in [k for k, ts in _invalidated.items() if ts < cutoff]:
+                _invalidated.pop(k, None)
+    store = get_shared_store()
+    if store is not None:
+        try:
+            store.set(_inv_key(auth_id), now, ex=max(USER_CACHE_TTL, USER_COOKIE_MAX_AGE) + 60)
+        except Exception:
+            logger.warning("session cache: shared store write failed", exc_info=True)
+
+
+# ---------- users ----------
+
+def get_user_row(auth_id: str):
+    hit = _users.get(str(auth_id))
+    if hit is None:
+        return None
+    row, stored_at = hit
+    if time.time() - stored_at > _row_ttl() or stored_at <= invalidated_at(str(auth_id)):
+        _users.pop(str(auth_id))
+        return None
+    return row
+
+
+def put_user_row(row: dict):
+    if row and row.get("auth_id"):
+        _users.set(str(row["auth_id"]), {k: row.get(k) for k in USER_FIELDS})
+
+
+def dump_user_cookie(row: dict) -> str | None:
+    """Signed copy of the row for the browser; None when there's no shared store to revoke it."""
+    if not shared():
+        return None
+    return _cookie_signer.dumps({k: row.get(k) for k in USER_FIELDS} | {"iat": time.time()})
+
+
+def load_user_cookie(token: str | None, auth_id: str):
+    """User row from the signed cookie, if it is fresh, for this user and not invalidated."""
+    if not token or not shared():
+        return None
+    try:
+        data = _cookie_signer.loads(token, max_age=USER_COOKIE_MAX_AGE)
+    except (BadSignature, SignatureExpired):
+        return None
+    if str(data.get("auth_id")) != str(auth_id):
+        return None
+    if float(data.get("iat") or 0) <= invalidated_at(str(auth_id)):
+        return None
+    return {k: data.get(k) for k in USER_FIELDS}
+
+
+# ---------- sessions ----------
+
+def get_session_row(sid: str):
+    hit = _sessions.get(str(sid))
+    if hit is None:
+        return None
+    row, stored_at = hit
+    if time.time() - stored_at > _row_ttl() or stored_at <= invalidated_at(str(row.get("auth_id"))):
+        _sessions.pop(str(sid))
+        return None
+    return row
+
+
+def put_session_row(sid: str, row: dict):
+    if sid and row:
+        _sessions.set(str(sid), {"id": row.get("id"), "auth_id": row.get("auth_id"),
+                                 "is_active": row.get("is_active")})
+
+
+def forget_session(sid: str | None):
+    if sid:
+        _sessions.pop(str(sid))
+
+
+# ---------- throttled last_seen ----------
+
+class LastSeenToucher:
+    """
+    Collects last_seen touches and writes them in batches.
+    `write(sids, iso_ts)` does the actual UPDATE ... WHERE id IN (sids).
+    """
+
+    def __init__(self, write, interval: int = SESSION_TOUCH_INTERVAL, flush_every: int = SESSION_TOUCH_FLUSH):
+        self.write = write
+        self.interval = interval
+        self.flush_every = max(1, flush_every)
+        self._last: dict[str, float] = {}
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def touch(self, sid: str):
+        now = time.time()
+        with self._lock:
+            if now - self._last.get(sid, 0) < self.interval:
+                return
+            self._last[sid] = now
+            self._pending.add(sid)
+            if len(self._last) > USER_CACHE_MAX:
+                cutoff = now - self.interval
+                for k in [k for k, ts in self._last.items() if ts < cutoff]:
+                    self._last.pop(k, None)
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="last-seen-flush", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.flush_every)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            sids, self._pending = sorted(self._pending), set()
+        if not sids:
+            return
+        try:
+            self.write(sids, datetime.utcnow().isoformat())
+        except Exception:
+            logger.warning("last_seen flush failed; will retry", exc_info=True)
+            with self._lock:
+                self._pending.update(sids)
@@ -0,0 +1,90 @@
+# shared_store.py
+import os, threading, time, logging
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+
+
+class LocalStore:
+    """
+    In-process stand-in for the few Redis commands we use
+    (get / set / incrby / delete / expire). Values come back as bytes, like
+    redis-py, so code written against one works against the other.
+    Handy for tests, local dev and single-worker deploys.
+    """
+
+    def __init__(self):
+        self._data: dict[str, tuple[bytes, float | None]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, exp = item
+        if exp is not None and exp <= time.time():
+            self._data.pop(key, None)
+            return None
+        return item
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode("utf-8")
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._live(key)
+            return item[0] if item else None
+
+    def set(self, key: str, value, ex: int | None = None, nx: bool = False):
+        with self._lock:
+            if nx and self._live(key):
+                return None
+            self._data[key] = (self._encode(value), (time.time() + ex) if ex else None)
+            return True
+
+    def incrby(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            item = self._live(key)
+            value = int(item[0]) if item else 0
+            exp = item[1] if item else None
+            value += int(amount)
+            self._data[key] = (self._encode(value), exp)
+            return value
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for k in keys if self._data.pop(k, None) is not None)
+
+    def expire(self, key: str, seconds: int) -> bool:
+        with self._lock:
+            item = self._live(key)
+            if not item:
+                return False
+            self._data[key] = (item[0], time.time() + seconds)
+            return True
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_shared_store():
+    """
+    Store shared by all gunicorn workers: a Redis client when REDIS_URL is set
+    and redis-py is installed, otherwise None (callers stay per-worker).
+    """
+    global _store
+    if _store is not None or not REDIS_URL:
+        return _store
+    with _store_lock:
+        if _store is None:
+            try:
+                import redis  # optional dependency
+                _store = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+            except Exception:
+                logger.warning("REDIS_URL is set but Redis is unavailable; using per-worker caches", exc_info=True)
+                return None
+    return _store
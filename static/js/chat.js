@@ -594,6 +594,83 @@ async function sendMessageToAPI(payload) {
   }); // expected: { reply, modelUsed }
 }
 
+// ──────────────────────────────────────────────────────────────
+/** Streaming variant: POST /api/ask with stream=true, read SSE events,
+ *  call onDelta(fullTextSoFar) per token, resolve with the same shape
+ *  as sendMessageToAPI. Falls back to plain JSON if streaming isn't available. */
+// ──────────────────────────────────────────────────────────────
+async function askStream(payload, onDelta) {
+  if (typeof ReadableStream === "undefined" || typeof TextDecoder === "undefined") {
+    return apiFetch('/api/ask', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(payload)
+    });
+  }
+
+  const headers = { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' };
+  const csrf = typeof getCookie === "function" ? (getCookie('csrf_token') || getCookie('XSRF-TOKEN')) : null;
+  if (csrf) headers['X-CSRFToken'] = csrf;
+
+  const resp = await fetch('/api/ask', {
+    method: 'POST',
+    credentials: 'same-origin',
+    headers,
+    body: JSON.stringify({ ...payload, stream: true })
+  });
+
+  // same error contract as apiFetch so handleChatLimitError keeps working
+  if (!resp.ok) {
+    if (resp.status === 401) {
+      window.location = '/account?next=' + encodeURIComponent(location.pathname);
+      throw new Error('Unauthorized');
+    }
+    const text = await resp.text();
+    throw new Error(`Request failed ${resp.status}: ${text.slice(0, 200)}`);
+  }
+  if (!(resp.headers.get('content-type') || '').includes('text/event-stream') || !resp.body) {
+    return resp.json();
+  }
+
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "", text = "", result = {};
+
+  const handle = (block) => {
+    let event = "message", data = "";
+    for (const line of block.split("\n")) {
+      if (line.startsWith("event:")) event = line.slice(6).trim();
+      else if (line.startsWith("data:")) data += line.slice(5).trim();
+    }
+    if (!data) return;
+    let obj;
+    try { obj = JSON.parse(data); } catch { return; }
+    if (event === "meta") {
+      result = { ...result, ...obj };
+    } else if (event === "token") {
+      text += obj.delta || "";
+      onDelta?.(text);
+    } else if (event === "done") {
+      result = { ...result, ...obj };
+    }
+  };
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let idx;
+    while ((idx = buf.indexOf("\n\n")) !== -1) {
+      handle(buf.slice(0, idx));
+      buf = buf.slice(idx + 2);
+    }
+  }
+  if (buf.trim()) handle(buf);
+
+  if (result.reply == null) result.reply = text;
+  return result;
+}
+
 // ──────────────────────────────────────────────────────────────
 // Detect if a message is about job search (natural language)
 // ──────────────────────────────────────────────────────────────
@@ -1294,13 +1371,14 @@ document.addEventListener("DOMContentLoaded", () => {
               method: "POST",
               headers: { "Content-Type": "application/json" },
               body: JSON.stringify({ query: q })
-            }).catch(() => ({ remotive:[], adzuna:[], jsearch:[] }))
+            }).catch(() => ({ remotive:[], adzuna:[], jsearch:[], jobs:[] }))
           ));
           jobs = results.reduce((acc, r) => ({
             remotive: [...(acc.remotive||[]), ...(r.remotive||[])],
             adzuna:   [...(acc.adzuna  ||[]), ...(r.adzuna  ||[])],
             jsearch:  [...(acc.jsearch ||[]), ...(r.jsearch ||[])],
-          }), {remotive:[], adzuna:[], jsearch:[]});
+            jobs:     [...(acc.jobs    ||[]), ...(r.jobs    ||[])],
+          }), {remotive:[], adzuna:[], jsearch:[], jobs:[]});
         } else {
           jobs = await apiFetch("/jobs", {
             method: "POST",
@@ -1332,19 +1410,27 @@ document.addEventListener("DOMContentLoaded", () => {
         return;
       }
 
-      // Normal AI chat
-      const data = await apiFetch("/api/ask", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          message,
-          model: currentModel,
-          conversation_id: conversationId,
-          attachments: (window.chatAttachments || []).map(a => ({
-            filename: a.filename,
-            text: a.text
-          }))
-        })
+      // Normal AI chat (streamed: show tokens as they arrive, final render below)
+      let streamEl = null;
+      const data = await askStream({
+        message,
+        model: currentModel,
+        conversation_id: conversationId,
+        attachments: (window.chatAttachments || []).map(a => ({
+          filename: a.filename,
+          text: a.text
+        }))
+      }, (textSoFar) => {
+        if (!streamEl) {
+          hideAIStatus();
+          answerRegion.innerHTML = "";
+          streamEl = document.createElement("div");
+          streamEl.className = "markdown streaming";
+          streamEl.style.whiteSpace = "pre-wrap";
+          answerRegion.appendChild(streamEl);
+        }
+        streamEl.textContent = textSoFar;
+        scrollToBottom();
       });
 
       // get the assistant text from the response (cover a few shapes)
@@ -1627,7 +1713,17 @@ async function fetchJobs(query, aiBlock) {
 function displayJobs(data, aiBlock) {
   const jobsContainer = document.createElement("div");
   jobsContainer.className = "job-listings";
-  const allJobs = [...(data?.remotive || []), ...(data?.adzuna || []), ...(data?.jsearch || [])];
+  // Prefer the server's merged + ranked list; fall back to the per-provider arrays
+  const raw = (Array.isArray(data?.jobs) && data.jobs.length)
+    ? data.jobs
+    : [...(data?.remotive || []), ...(data?.adzuna || []), ...(data?.jsearch || [])];
+  const seen = new Set();
+  const allJobs = raw.filter(job => {
+    const key = `${(job.title || "").toLowerCase()}|${(job.company || "").toLowerCase()}`;
+    if (seen.has(key)) return false;
+    seen.add(key);
+    return true;
+  });
   if (!allJobs.length) return;
   const heading = document.createElement("p");
   heading.innerHTML = `<strong>Here are some job opportunities that match your interest:</strong>`;
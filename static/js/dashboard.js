@@ -428,26 +428,23 @@ document.addEventListener("DOMContentLoaded", () => {
     if (analyzeBtn) analyzeBtn.disabled = true;
 
     try {
-      const b64 = await fileToBase64(f);
-      const body = {
-        jobDescription: jdInput?.value || "",
-        jobRole: roleSelect?.value || ""
-      };
-      if (f.type === "application/pdf") {
-        body.pdf = b64;
-      } else if (f.type === "application/vnd.openxmlformats-officedocument.wordprocessingml.document") {
-        body.docx = b64;
-      } else {
+      const b64 = await fileToBase64(f);   // still kept in localStorage below
+      if (f.type !== "application/pdf" &&
+          f.type !== "application/vnd.openxmlformats-officedocument.wordprocessingml.document") {
         alert("Unsupported type. Upload PDF or DOCX.");
         if (analyzingEl) analyzingEl.style.display = "none";
         if (analyzeBtn) analyzeBtn.disabled = false;
         return;
       }
+      // send the file itself (multipart) — no base64 in the request body
+      const body = new FormData();
+      body.append("file", f);
+      body.append("jobDescription", jdInput?.value || "");
+      body.append("jobRole", roleSelect?.value || "");
 
       const res = await fetch("/api/resume-analysis", {
         method: "POST",
-        headers: {"Content-Type":"application/json"},
-        body: JSON.stringify(body)
+        body
       });
 
       const text = await res.text();
@@ -267,19 +267,17 @@ document.addEventListener("DOMContentLoaded", () => {
           return;
         }
 
-        const b64  = await fileToBase64(f);
-        const body = {
-          jobDescription: jdInput?.value || "",
-          jobRole: roleSelect?.value || ""
-        };
-        if (isPdf(f)) body.pdf = b64;
-        else if (isDocx(f)) body.docx = b64;
+        const b64  = await fileToBase64(f);   // still kept in localStorage below
+        // send the file itself (multipart) — no base64 in the request body
+        const body = new FormData();
+        body.append("file", f);
+        body.append("jobDescription", jdInput?.value || "");
+        body.append("jobRole", roleSelect?.value || "");
 
         // 🔹 MISSING BEFORE — add the fetch + parse
         const res  = await fetch("/api/resume-analysis", {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify(body)
+          body
         });
         const text = await res.text();
         let data = null; try { data = JSON.parse(text); } catch {}
@@ -363,7 +361,8 @@ document.addEventListener("DOMContentLoaded", () => {
         if (!isPdf(file) && !isDocx(file)) { alert("Unsupported type. Upload PDF or DOCX."); return; }
         const b64 = await fileToBase64(file);
         localStorage.setItem("resumeBase64", b64);
-        payload = isPdf(file) ? { pdf: b64 } : { docx: b64 };
+        payload = new FormData();
+        payload.append("file", file);
       } else {
         alert("Paste text or upload a file.");
         return;
@@ -373,11 +372,13 @@ document.addEventListener("DOMContentLoaded", () => {
       resultsWrap && (resultsWrap.style.display = "none");
 
       try {
-        const res = await fetch("/api/resume-analysis", {
-          method:  "POST",
-          headers: { "Content-Type": "application/json" },
-          body:    JSON.stringify(payload)
-        });
+        const res = await fetch("/api/resume-analysis", payload instanceof FormData
+          ? { method: "POST", body: payload }
+          : {
+              method:  "POST",
+              headers: { "Content-Type": "application/json" },
+              body:    JSON.stringify(payload)
+            });
 
         const text = await res.text();
         let data   = await parseJsonSafe(res, text);
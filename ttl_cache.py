@@ -0,0 +1,226 @@
+# ttl_cache.py
+#
+# Small caching layer for expensive, mostly-idempotent calls (Adzuna salary
+# lookups, job-market aggregates, ...). Replaces the old unbounded `_cache`
+# dict in app.py.
+#
+#   @cache_for(3600)                            # 1h TTL, LRU-bounded
+#   @cache_for(3600, stale=600, shared=True)    # + serve stale while refreshing,
+#                                               #   + share across workers via Redis
+#
+# * keyed on the function plus ALL positional and keyword arguments
+# * bounded: least recently used entries go first once `maxsize` is reached
+# * single-flight: concurrent misses for one key make one upstream call
+# * stale-while-revalidate: inside the `stale` window the old value is returned
+#   at once and refreshed in the background
+# * hit/miss/eviction counters per cache (cache_stats(), shown on /admin/metrics)
+# * optional shared layer (REDIS_URL, see shared_store.py) so every worker
+#   reuses the same upstream results
+
+import time, pickle, hashlib, threading, functools, logging
+from collections import OrderedDict
+
+from shared_store import get_shared_store
+
+logger = logging.getLogger(__name__)
+
+try:
+    from flask import current_app, has_app_context
+except ImportError:  # usable outside Flask too
+    current_app = None
+    has_app_context = lambda: False
+
+_MISSING = object()
+_REGISTRY: "dict[str, TTLCache]" = {}
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value, fresh_until, stale_until):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class TTLCache:
+    """Thread-safe LRU + TTL map with single-flight loading."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 512, stale: float = 0, shared: bool = False):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stale = stale
+        self.shared = shared
+        self._data: "OrderedDict[object, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: dict[object, threading.Event] = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "shared_hits": 0,
+                      "loads": 0, "load_errors": 0, "refreshes": 0, "evictions": 0}
+        _REGISTRY[name] = self
+
+    # ---------- local LRU ----------
+
+    def _get_entry(self, key):
+        with self._lock:
+            e = self._data.get(key)
+            if e is None:
+                return None
+            if time.time() >= e.stale_until:
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return e
+
+    def _put(self, key, value, fresh_until=None):
+        now = time.time()
+        fresh_until = fresh_until or now + self.ttl
+        with self._lock:
+            self._data[key] = _Entry(value, fresh_until, fresh_until + self.stale)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _bump(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "size": len(self._data), "maxsize": self.maxsize,
+                    "ttl": self.ttl, "stale": self.stale, "shared": self.shared}
+
+    # ---------- shared layer ----------
+
+    def _shared_key(self, key) -> str:
+        return "cache:" + self.name + ":" + hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    def _shared_get(self, key):
+        store = get_shared_store() if self.shared else None
+        if store is None:
+            return _MISSING
+        try:
+            raw = store.get(self._shared_key(key))
+            if raw is None:
+                return _MISSING
+            fresh_until, value = pickle.loads(raw)
+            if time.time() >= fresh_until:
+                return _MISSING
+            self._put(key, value, fresh_until)
+            return value
+        except Exception:
+            logger.warning("cache %s: shared read failed", self.name, exc_info=True)
+            return _MISSING
+
+    def _shared_set(self, key, value):
+        store = get_shared_store() if self.shared else None
+        if store is None:
+            return
+        try:
+            store.set(self._shared_key(key), pickle.dumps((time.time() + self.ttl, value)),
+                      ex=int(self.ttl) + 1)
+        except Exception:
+            logger.warning("cache %s: shared write failed", self.name, exc_info=True)
+
+    # ---------- loading ----------
+
+    def _load(self, key, loader):
+        """Run `loader` once per key at a time; other callers wait for its result."""
+        with self._lock:
+            ev = self._inflight.get(key)
+            leader = ev is None
+            if leader:
+                ev = self._inflight[key] = threading.Event()
+        if not leader:
+            ev.wait()
+            e = self._get_entry(key)
+            if e is not None:
+                return e.value
+            # the leader failed; try ourselves rather than fail everybody
+            return loader()
+        try:
+            self._bump("loads")
+            value = loader()
+            self._put(key, value)
+            self._shared_set(key, value)
+            return value
+        except Exception:
+            self._bump("load_errors")
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            ev.set()
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._inflight:
+                return
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def _run():
+            try:
+                if app is not None:
+                    with app.app_context():
+                        self._load(key, loader)
+                else:
+                    self._load(key, loader)
+                self._bump("refreshes")
+            except Exception:
+                logger.warning("cache %s: background refresh failed", self.name, exc_info=True)
+
+        threading.Thread(target=_run, name=f"cache-refresh-{self.name}", daemon=True).start()
+
+    def get_or_load(self, key, loader):
+        now = time.time()
+        e = self._get_entry(key)
+        if e is not None:
+            if now < e.fresh_until:
+                self._bump("hits")
+                return e.value
+            # stale but usable: answer now, refresh behind the scenes
+            self._bump("stale_hits")
+            self._refresh_in_background(key, loader)
+            return e.value
+
+        value = self._shared_get(key)
+        if value is not _MISSING:
+            self._bump("shared_hits")
+            return value
+
+        self._bump("misses")
+        return self._load(key, loader)
+
+
+def _make_key(args, kwargs):
+    key = (args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        # lists/dicts in the arguments: fall back to a stable repr
+        return repr(key)
+
+
+def cache_for(seconds: float, maxsize: int = 512, stale: float = 0, shared: bool = False):
+    """Decorator: cache the function's result per argument tuple for `seconds`."""
+    def deco(fn):
+        cache = TTLCache(f"{fn.__module__}.{fn.__qualname__}", seconds, maxsize=maxsize,
+                         stale=stale, shared=shared)
+
+        @functools.wraps(fn)
+        def wrapped(*a, **kw):
+            return cache.get_or_load(_make_key(a, kw), lambda: fn(*a, **kw))
+
+        wrapped.cache = cache
+        return wrapped
+    return deco
+
+
+def cache_stats() -> dict:
+    return {name: c.snapshot() for name, c in _REGISTRY.items()}
@@ -0,0 +1,360 @@
+# usage_cache.py
+#
+# Write-behind cache in front of the usage counter backend (limits.py).
+#
+# Every quota check used to be a database round trip. With the cache on,
+# most checks are answered from memory and the increments are shipped to
+# usage_counters in coalesced batches by a background thread.
+#
+#   USAGE_CACHE=off      (default) every check hits the database, as before
+#   USAGE_CACHE=local    per-worker cache
+#   USAGE_CACHE=shared   counts live in Redis (REDIS_URL) and are exact across
+#                        workers; falls back to "local" if Redis isn't there
+#
+#   USAGE_CACHE_READ_TTL        seconds a database read is trusted (default 5)
+#   USAGE_CACHE_MAX_STALENESS   max seconds an increment waits before it is
+#                               written to the database (default 2)
+#   USAGE_CACHE_MAX_PENDING     max unflushed increments per counter per worker
+#                               (default 3)
+#
+# Overshoot bound (local mode): a worker only answers from memory while it
+# holds fewer than MAX_PENDING unflushed increments for a counter and the
+# counter is more than MAX_PENDING below its limit; otherwise it goes through
+# the backend's atomic incr_if_below. Increments other workers haven't
+# flushed yet are invisible, so a limit can be overshot by at most
+# (workers - 1) * MAX_PENDING. Set MAX_PENDING=0 to disable local answers.
+# In shared mode the check itself is an atomic INCRBY, so there is no
+# overshoot; only the database copy lags by up to MAX_STALENESS.
+
+import os, time, atexit, threading, logging
+
+from shared_store import LocalStore, get_shared_store
+
+logger = logging.getLogger(__name__)
+
+USAGE_CACHE = os.getenv("USAGE_CACHE", "off").strip().lower()
+READ_TTL = float(os.getenv("USAGE_CACHE_READ_TTL", "5"))
+MAX_STALENESS = float(os.getenv("USAGE_CACHE_MAX_STALENESS", "2"))
+MAX_PENDING = int(os.getenv("USAGE_CACHE_MAX_PENDING", "3"))
+
+# How long counter keys live in the shared store, per period kind
+# (a bit longer than the period itself; 'total' never expires).
+_STORE_TTL = {
+    "hour": 2 * 3600,
+    "day": 2 * 86400,
+    "week": 8 * 86400,
+    "month": 32 * 86400,
+    "year": 367 * 86400,
+}
+
+
+class _Entry:
+    __slots__ = ("lock", "base", "fetched", "pending", "inflight", "dead")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.base = 0        # last known database count (+ deltas being flushed)
+        self.fetched = 0.0   # when `base` was read from the database
+        self.pending = 0     # increments not yet handed to the flusher
+        self.inflight = 0    # increments the flusher is writing right now
+        self.dead = False    # pruned: get a fresh entry instead
+
+
+class CachedCounterBackend:
+    """
+    Wraps any counter backend (get_count / set_count / incr_if_below /
+    incr_many_if_below) and speaks the same protocol.
+    """
+
+    def __init__(self, inner, store=None, read_ttl: float = READ_TTL,
+                 max_staleness: float = MAX_STALENESS, max_pending: int = MAX_PENDING):
+        self.inner = inner
+        self.store = store
+        self.read_ttl = read_ttl
+        self.max_staleness = max(0.05, max_staleness)
+        self.max_pending = max(0, max_pending)
+        self._entries: dict[tuple[str, str, str, str], _Entry] = {}
+        self._lock = threading.Lock()
+        self._flusher: threading.Thread | None = None
+        self._flusher_pid = None
+        self._stop = threading.Event()
+        self._stats = {"local": 0, "backend": 0, "shared": 0, "flushes": 0,
+                       "flushed_increments": 0, "flush_errors": 0}
+        atexit.register(self.flush)
+
+    # ---------- bookkeeping ----------
+
+    def _entry(self, k) -> _Entry:
+        with self._lock:
+            e = self._entries.get(k)
+            if e is None:
+                e = self._entries[k] = _Entry()
+            return e
+
+    def _lock_entries(self, keys) -> list[_Entry]:
+        """
+        The entries for `keys`, locked (in a fixed order, so two batches over the
+        same counters can't deadlock). Retries if _prune dropped one in between,
+        so increments never land on an entry the flusher no longer sees.
+        """
+        order = sorted(range(len(keys)), key=lambda i: keys[i])
+        while True:
+            entries = [self._entry(k) for k in keys]
+            for i in order:
+                entries[i].lock.acquire()
+            if not any(e.dead for e in entries):
+                return entries
+            for i in order:
+                entries[i].lock.release()
+
+    @staticmethod
+    def _unlock(entries):
+        for e in entries:
+            e.lock.release()
+
+    def _bump(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["counters"] = len(self._entries)
+            out["pending"] = sum(e.pending + e.inflight for e in self._entries.values())
+        out["mode"] = "shared" if self.store is not None else "local"
+        return out
+
+    def _ensure_flusher(self):
+        # started lazily so it lives in the gunicorn worker, not the master
+        if self._flusher is not None and self._flusher.is_alive() and self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive() and self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            self._flusher = threading.Thread(target=self._flush_loop, name="usage-cache-flush", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.max_staleness):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("usage cache flush failed")
+
+    def _refresh(self, user_id, feature, kind, key, e: _Entry):
+        # caller holds e.lock; never re-read while a flush is on the wire,
+        # the database would not include those increments yet
+        if e.inflight == 0 and time.time() - e.fetched > self.read_ttl:
+            e.base = self.inner.get_count(user_id, feature, kind, key)
+            e.fetched = time.time()
+
+    # ---------- shared store ----------
+
+    @staticmethod
+    def _store_key(user_id, feature, kind, key) -> str:
+        return f"usage:{user_id}:{feature}:{kind}:{key}"
+
+    def _store_count(self, user_id, feature, kind, key) -> int:
+        sk = self._store_key(user_id, feature, kind, key)
+        raw = self.store.get(sk)
+        if raw is not None:
+            return int(raw)
+        # first use (or Redis was flushed): seed from the database plus
+        # whatever this worker hasn't written yet
+        [e] = self._lock_entries([(user_id, feature, kind, key)])
+        try:
+            seed = self.inner.get_count(user_id, feature, kind, key) + e.pending + e.inflight
+        finally:
+            e.lock.release()
+        self.store.set(sk, seed, ex=_STORE_TTL.get(kind), nx=True)
+        raw = self.store.get(sk)
+        return int(raw) if raw is not None else seed
+
+    def _store_incr_many(self, user_id, items):
+        done = []
+        counts = []
+        for i, (f, k, key, amount, limit) in enumerate(items):
+            self._store_count(user_id, f, k, key)  # make sure it's seeded
+            sk = self._store_key(user_id, f, k, key)
+            n = int(self.store.incrby(sk, amount))
+            done.append((sk, amount))
+            if limit is not None and n > limit:
+                for sk_, amount_ in done:
+                    self.store.incrby(sk_, -amount_)
+                counts = [self._store_count(user_id, f_, k_, key_) for (f_, k_, key_, _a, _l) in items]
+                return False, counts, i
+            counts.append(n)
+        return True, counts, None
+
+    # ---------- backend protocol ----------
+
+    def get_count(self, user_id: str, feature: str, kind: str, key: str) -> int:
+        if self.store is not None:
+            try:
+                return self._store_count(user_id, feature, kind, key)
+            except Exception:
+                logger.warning("usage cache: shared store read failed", exc_info=True)
+        [e] = self._lock_entries([(user_id, feature, kind, key)])
+        try:
+            self._refresh(user_id, feature, kind, key, e)
+            return e.base + e.pending
+        finally:
+            e.lock.release()
+
+    def set_count(self, user_id: str, feature: str, kind: str, key: str, count: int) -> None:
+        # absolute writes go straight through and replace anything cached
+        [e] = self._lock_entries([(user_id, feature, kind, key)])
+        try:
+            self.inner.set_count(user_id, feature, kind, key, count)
+            e.base, e.pending, e.fetched = int(count), 0, time.time()
+        finally:
+            e.lock.release()
+        if self.store is not None:
+            try:
+                self.store.set(self._store_key(user_id, feature, kind, key), int(count), ex=_STORE_TTL.get(kind))
+            except Exception:
+                logger.warning("usage cache: shared store write failed", exc_info=True)
+
+    def incr_if_below(
+        self, user_id: str, feature: str, kind: str, key: str, amount: int, limit: int | None
+    ) -> tuple[bool, int]:
+        allowed, counts, _ = self.incr_many_if_below(user_id, [(feature, kind, key, amount, limit)])
+        return allowed, counts[0]
+
+    def incr_many_if_below(self, user_id: str, items: list) -> tuple[bool, list[int], int | None]:
+        if not items:
+            return True, [], None
+        self._ensure_flusher()
+
+        if self.store is not None:
+            try:
+                allowed, counts, denied = self._store_incr_many(user_id, items)
+                self._bump("shared")
+                if allowed:
+                    self._add_pending(user_id, items)
+                return allowed, counts, denied
+            except Exception:
+                logger.warning("usage cache: shared store unavailable, using per-worker cache", exc_info=True)
+
+        entries = self._lock_entries([(user_id, f, k, key) for (f, k, key, _a, _l) in items])
+        try:
+            for (f, k, key, _a, _l), e in zip(items, entries):
+                self._refresh(user_id, f, k, key, e)
+
+            local_ok = all(
+                e.pending + e.inflight + amount <= self.max_pending
+                and (limit is None or e.base + e.pending + amount <= limit - self.max_pending)
+                for (_f, _k, _key, amount, limit), e in zip(items, entries)
+            )
+            if local_ok:
+                for (_f, _k, _key, amount, _l), e in zip(items, entries):
+                    e.pending += amount
+                self._bump("local")
+                return True, [e.base + e.pending for e in entries], None
+
+            # close to a limit (or too much unflushed): ask the database, and
+            # hand it this worker's pending increments in the same call
+            self._bump("backend")
+            deltas = [e.pending for e in entries]
+            allowed, counts, denied = self.inner.incr_many_if_below(
+                user_id,
+                [(f, k, key, amount + d, limit) for (f, k, key, amount, limit), d in zip(items, deltas)],
+            )
+            if not allowed and any(deltas):
+                # the check failed, but the earlier increments still have to land
+                _ok, counts, _ = self.inner.incr_many_if_below(
+                    user_id, [(f, k, key, d, None) for (f, k, key, _a, _l), d in zip(items, deltas)]
+                )
+            now = time.time()
+            for (_f, _k, _key, amount, _l), e, d, used in zip(items, entries, deltas, counts):
+                known = e.base + d + (amount if allowed else 0)
+                # `used` may predate an in-flight flush; never go below what we know
+                e.base = max(int(used), known) if e.inflight else int(used)
+                e.pending = 0
+                e.fetched = now
+            return allowed, [e.base for e in entries], denied
+        finally:
+            self._unlock(entries)
+
+    def _add_pending(self, user_id, items):
+        for (f, k, key, amount, _l) in items:
+            [e] = self._lock_entries([(user_id, f, k, key)])
+            try:
+                e.pending += amount
+            finally:
+                e.lock.release()
+
+    # ---------- flushing ----------
+
+    def flush(self) -> int:
+        """Write all pending increments to the inner backend. Returns how many were written."""
+        with self._lock:
+            snapshot = list(self._entries.items())
+
+        batches: dict[str, list] = {}
+        for (user_id, f, k, key), e in snapshot:
+            with e.lock:
+                if e.pending <= 0:
+                    continue
+                d, e.pending = e.pending, 0
+                e.inflight += d
+                e.base += d
+            batches.setdefault(user_id, []).append(((f, k, key, d, None), e))
+
+        written = 0
+        for user_id, rows in batches.items():
+            try:
+                self.inner.incr_many_if_below(user_id, [item for item, _e in rows])
+                written += sum(item[3] for item, _e in rows)
+                for item, e in rows:
+                    with e.lock:
+                        e.inflight -= item[3]
+            except Exception:
+                logger.warning("usage cache: flush for user %s failed, will retry", user_id, exc_info=True)
+                self._bump("flush_errors")
+                for item, e in rows:
+                    with e.lock:
+                        e.inflight -= item[3]
+                        e.base -= item[3]
+                        e.pending += item[3]
+
+        if batches:
+            self._bump("flushes")
+            self._bump("flushed_increments", written)
+        self._prune()
+        return written
+
+    def _prune(self):
+        # drop idle counters (old hour/day windows pile up otherwise)
+        cutoff = time.time() - max(self.read_ttl, 60)
+        with self._lock:
+            for k, e in list(self._entries.items()):
+                # under the entry's own lock: whoever takes it next sees `dead` and starts over
+                if not e.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if e.pending == 0 and e.inflight == 0 and e.fetched < cutoff:
+                        e.dead = True
+                        self._entries.pop(k, None)
+                finally:
+                    e.lock.release()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+def wrap_if_enabled(backend):
+    """Put a CachedCounterBackend in front of `backend` when USAGE_CACHE is on."""
+    if USAGE_CACHE in ("", "0", "off", "false", "no"):
+        return backend
+    store = None
+    if USAGE_CACHE == "shared":
+        store = get_shared_store()
+        if store is None:
+            logger.warning("USAGE_CACHE=shared but no shared store is configured; using per-worker cache")
+    elif USAGE_CACHE == "shared-local":
+        # single-process stand-in for Redis (dev / tests)
+        store = LocalStore()
+    return CachedCounterBackend(backend, store=store)